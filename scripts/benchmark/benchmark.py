@@ -0,0 +1,217 @@
+"""
+Benchmark of the extractor run against a local mock of the Snapchat Marketing API.
+
+Each scenario is run by a separate process, so its peak memory is not affected by other scenarios or by the mock
+server. Usage:
+
+    python scripts/benchmark/benchmark.py --scenario small --scenario hourly --output results.json
+    python scripts/benchmark/benchmark.py --parameters '{"clientType": "async", "concurrency": 50}'
+    python scripts/benchmark/benchmark.py --scenario small --action run --action list_organizations
+"""
+import argparse
+import datetime
+import json
+import logging
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from mock_api import MockSnapchatApi
+
+ACTIONS = ['run', 'list_organizations']
+SRC_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'src')
+START_DATE = datetime.date(2021, 1, 1)
+
+# Number of ad accounts, campaigns per account (or a list of them for each account), ad squads per campaign and ads
+# per ad squad, and the date range.
+SCENARIOS = {
+    'small': {'accounts': 2, 'campaigns': 3, 'adsquads': 2, 'ads': 2, 'days': 31, 'granularity': 'DAY'},
+    'medium': {'accounts': 5, 'campaigns': 10, 'adsquads': 3, 'ads': 3, 'days': 90, 'granularity': 'DAY'},
+    'large': {'accounts': 10, 'campaigns': 20, 'adsquads': 5, 'ads': 4, 'days': 365, 'granularity': 'DAY'},
+    'hourly': {'accounts': 2, 'campaigns': 5, 'adsquads': 2, 'ads': 2, 'days': 28, 'granularity': 'HOUR'},
+    'skewed': {'accounts': 8, 'campaigns': [2, 2, 2, 2, 2, 2, 2, 30], 'adsquads': 2, 'ads': 2, 'days': 62,
+               'granularity': 'DAY'}
+}
+
+
+def createDataDir(scenario, parameters, action='run'):
+
+    dataDir = tempfile.mkdtemp(prefix='snapchat-benchmark-')
+
+    for folder in ['in', 'out/tables', 'out/files']:
+        os.makedirs(os.path.join(dataDir, folder))
+
+    _endDate = START_DATE + datetime.timedelta(days=scenario['days'])
+    config = {
+        'action': action,
+        'parameters': {
+            'statisticsObjects': ['campaigns', 'adsquads', 'ads'],
+            'query': 'impressions,swipes,spend,video_views',
+            'dateSettings': {'startDate': START_DATE.isoformat(), 'endDate': _endDate.isoformat()},
+            'attributionSettings': {'granularity': scenario['granularity']},
+            **parameters
+        },
+        'authorization': {'oauth_api': {'credentials': {
+            'appKey': 'key', '#appSecret': 'secret', '#data': json.dumps({'refresh_token': 'token'})}}}
+    }
+
+    with open(os.path.join(dataDir, 'config.json'), 'w') as configFile:
+        json.dump(config, configFile)
+
+    with open(os.path.join(dataDir, 'in', 'state.json'), 'w') as stateFile:
+        json.dump({}, stateFile)
+
+    return dataDir
+
+
+def runComponent(dataDir, apiUrl, resultPath):
+
+    sys.path.insert(0, SRC_PATH)
+
+    import snapchat.async_client
+    import snapchat.client
+    import snapchat.result
+
+    # Both clients read the URLs when they are created or when a request is made.
+    for module in [snapchat.client, snapchat.async_client]:
+        module.BASE_URL = f'{apiUrl}/v1/'
+        module.REFRESH_URL = f'{apiUrl}/login/oauth2/access_token'
+
+    writerStats = {'rows': 0, 'cpu_seconds': 0.0}
+
+    def timeWriter(writerow):
+
+        def _writerow(self, listToWrite):
+            # Writers are called from several threads, CPU time of the calling thread excludes the others.
+            start = time.thread_time()
+            writerow(self, listToWrite)
+            writerStats['cpu_seconds'] += time.thread_time() - start
+
+        return _writerow
+
+    def countRows(encodeRows):
+
+        def _encodeRows(self, listToWrite):
+            rows = encodeRows(self, listToWrite)
+            writerStats['rows'] += len(rows)
+            return rows
+
+        return _encodeRows
+
+    for writer in [snapchat.result.SnapchatWriter, snapchat.result.SnapchatStatisticsWriter]:
+        writer.writerow = timeWriter(writer.writerow)
+        writer.encodeRows = countRows(writer.encodeRows)
+
+    os.environ['KBC_DATADIR'] = dataDir
+
+    importStart = time.perf_counter()
+    import component
+    importSeconds = time.perf_counter() - importStart
+
+    start, cpuStart = time.perf_counter(), time.process_time()
+
+    comp = component.SnapchatComponent()
+    initSeconds = time.perf_counter() - start
+    comp.execute_action()
+
+    seconds = time.perf_counter() - start
+    summary = comp.metrics.getSummary()
+    endpoints = summary['endpoints'].values()
+
+    result = {
+        'seconds': round(seconds, 3),
+        'import_seconds': round(importSeconds, 3),
+        'init_seconds': round(initSeconds, 3),
+        'cpu_seconds': round(time.process_time() - cpuStart, 3),
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'requests': sum([e['requests'] for e in endpoints]),
+        'rate_limited': sum([e['rate_limited'] for e in endpoints]),
+        'rows': writerStats['rows'],
+        'rows_per_second': round(writerStats['rows'] / seconds, 1),
+        'writer_cpu_seconds': round(writerStats['cpu_seconds'], 3),
+        'phases': summary['phases']
+    }
+
+    with open(resultPath, 'w') as resultFile:
+        json.dump(result, resultFile)
+
+
+def runScenario(name, scenario, parameters, latency, rateLimit, action='run', rowLatency=0.0):
+
+    api = MockSnapchatApi(scenario['accounts'], scenario['campaigns'], scenario['adsquads'], scenario['ads'],
+                          latency=latency, rateLimit=rateLimit, rowLatency=rowLatency)
+    apiUrl = api.start()
+    dataDir = createDataDir(scenario, parameters, action)
+    resultPath = os.path.join(dataDir, 'benchmark.json')
+
+    logging.info(f"Running scenario {name} with action {action}.")
+    start = time.perf_counter()
+
+    try:
+        process = subprocess.run([sys.executable, os.path.abspath(__file__), '--run-component', dataDir, apiUrl,
+                                  resultPath], capture_output=True, text=True)
+
+    finally:
+        processSeconds = time.perf_counter() - start
+        api.stop()
+
+    if process.returncode != 0:
+        logging.error(f"Scenario {name} failed:\n{process.stderr}")
+        sys.exit(1)
+
+    with open(resultPath) as resultFile:
+        result = json.load(resultFile)
+
+    # Wall-clock time of the whole process, including start of the interpreter and imports.
+    result['process_seconds'] = round(processSeconds, 3)
+    result['server_requests'] = api.requestCount
+    result['server_rate_limited'] = api.rateLimitedCount
+
+    return result
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Benchmark of the extractor against a mock Snapchat API.')
+    parser.add_argument('--scenario', action='append', choices=list(SCENARIOS),
+                        help='Scenario to run, may be repeated. Defaults to small and hourly.')
+    parser.add_argument('--parameters', default='{}', help='JSON with parameters of the configuration.')
+    parser.add_argument('--latency', type=float, default=0.02, help='Latency of each response in seconds.')
+    parser.add_argument('--row-latency', type=float, default=0.0,
+                        help='Additional latency of statistics responses in seconds per row of the response.')
+    parser.add_argument('--rate-limit', type=float, default=None,
+                        help='Requests per second for statistics, after which the mock API responds with 429.')
+    parser.add_argument('--action', action='append', choices=ACTIONS,
+                        help='Action of the configuration, may be repeated. Defaults to run.')
+    parser.add_argument('--output', help='Path of a JSON file to save the results to.')
+    parser.add_argument('--run-component', nargs=3, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_component is not None:
+        logging.disable(logging.INFO)
+        runComponent(*args.run_component)
+        return
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    results = {}
+
+    for name in (args.scenario or ['small', 'hourly']):
+        for action in (args.action or ['run']):
+
+            _key = name if action == 'run' else f'{name} {action}'
+            results[_key] = runScenario(name, SCENARIOS[name], json.loads(args.parameters), args.latency,
+                                        args.rate_limit, action, args.row_latency)
+            logging.info(f"{_key}: " + ', '.join([f'{key} {value}' for key, value in results[_key].items()
+                                                  if key != 'phases']))
+
+    if args.output is not None:
+        with open(args.output, 'w') as outputFile:
+            json.dump(results, outputFile, indent=2)
+
+
+if __name__ == '__main__':
+    main()
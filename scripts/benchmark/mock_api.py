@@ -0,0 +1,233 @@
+import datetime
+import json
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+STATISTICS_TYPES = {'adaccounts': 'AD_ACCOUNT', 'campaigns': 'CAMPAIGN', 'adsquads': 'AD_SQUAD', 'ads': 'AD'}
+BREAKDOWN_OBJECTS = {'campaign': 'campaigns', 'adsquad': 'adsquads', 'ad': 'ads'}
+LISTING_KEYS = {'adaccounts': 'adaccount', 'campaigns': 'campaign', 'adsquads': 'adsquad', 'ads': 'ad',
+                'creatives': 'creative'}
+
+# Longest date range of a single statistics request accepted by the API.
+MAX_STATISTICS_RANGE = {'DAY': datetime.timedelta(days=32), 'HOUR': datetime.timedelta(days=7)}
+GRANULARITY_STEP = {'DAY': datetime.timedelta(days=1), 'HOUR': datetime.timedelta(hours=1)}
+ENTITY_TIME = '2020-01-01T00:00:00.000Z'
+
+
+class MockSnapchatApi:
+
+    def __init__(self, accounts=1, campaigns=1, adsquads=1, ads=1, creatives=1, latency=0.0, rateLimit=None,
+                 pageSize=None, timezone='America/Los_Angeles', rowLatency=0.0):
+
+        self.paramLatency = latency
+        self.paramRowLatency = rowLatency
+        self.paramRateLimit = rateLimit
+        self.paramPageSize = pageSize
+        self.paramTimezone = timezone
+
+        self.entities = self._createEntities(accounts, campaigns, adsquads, ads, creatives)
+        self.requestCount = 0
+        self.rateLimitedCount = 0
+
+        self._tokens = float(rateLimit) if rateLimit is not None else 0.0
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self._server = None
+
+    def _createEntities(self, accounts, campaigns, adsquads, ads, creatives):
+
+        entities = {key: {} for key in LISTING_KEYS}
+        entities['organizations'] = [{'id': 'org0', 'name': 'Organization 0', 'updated_at': ENTITY_TIME}]
+        entities['adaccounts']['org0'] = [{'id': f'acc{a}', 'name': f'Ad account {a}', 'timezone': self.paramTimezone,
+                                           'updated_at': ENTITY_TIME} for a in range(accounts)]
+
+        for a, account in enumerate(entities['adaccounts']['org0']):
+
+            # Number of campaigns may differ by ad account, to simulate accounts of very different sizes.
+            accountId = account['id']
+            _campaigns = campaigns[a] if isinstance(campaigns, list) else campaigns
+            entities['campaigns'][accountId] = [{'id': f'{accountId}-c{c}', 'name': f'Campaign {c}',
+                                                 'ad_account_id': accountId, 'status': 'ACTIVE',
+                                                 'start_time': ENTITY_TIME, 'updated_at': ENTITY_TIME}
+                                                for c in range(_campaigns)]
+            entities['adsquads'][accountId] = [{'id': f'{c["id"]}-s{s}', 'name': f'Ad squad {s}',
+                                                'campaign_id': c['id'], 'status': 'ACTIVE',
+                                                'updated_at': ENTITY_TIME}
+                                               for c in entities['campaigns'][accountId] for s in range(adsquads)]
+            entities['ads'][accountId] = [{'id': f'{s["id"]}-a{a}', 'name': f'Ad {a}', 'ad_squad_id': s['id'],
+                                           'creative_id': f'{accountId}-cr0', 'status': 'ACTIVE',
+                                           'updated_at': ENTITY_TIME}
+                                          for s in entities['adsquads'][accountId] for a in range(ads)]
+            entities['creatives'][accountId] = [{'id': f'{accountId}-cr{c}', 'name': f'Creative {c}',
+                                                 'ad_account_id': accountId, 'updated_at': ENTITY_TIME}
+                                                for c in range(creatives)]
+
+        return entities
+
+    def start(self):
+
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                api.handle(self, 'POST')
+
+            def do_GET(self):
+                api.handle(self, 'GET')
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+        return f'http://127.0.0.1:{self._server.server_address[1]}'
+
+    def stop(self):
+
+        self._server.shutdown()
+        self._server.server_close()
+
+    def isRateLimited(self):
+
+        if self.paramRateLimit is None:
+            return False
+
+        # Token bucket of the server, allowing at most a second worth of requests in a burst.
+        with self._lock:
+
+            now = time.monotonic()
+            self._tokens = min(self.paramRateLimit, self._tokens + (now - self._updated) * self.paramRateLimit)
+            self._updated = now
+
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return False
+
+            self.rateLimitedCount += 1
+            return True
+
+    @staticmethod
+    def send(handler, statusCode, body, headers={}):
+
+        content = json.dumps(body).encode()
+        handler.send_response(statusCode)
+        handler.send_header('Content-Type', 'application/json')
+        handler.send_header('Content-Length', str(len(content)))
+
+        for key, value in headers.items():
+            handler.send_header(key, value)
+
+        handler.end_headers()
+        handler.wfile.write(content)
+
+    def handle(self, handler, method):
+
+        with self._lock:
+            self.requestCount += 1
+
+        if self.paramLatency > 0:
+            time.sleep(self.paramLatency)
+
+        url = urlparse(handler.path)
+        params = {key: value[0] for key, value in parse_qs(url.query).items()}
+        segments = [s for s in url.path.split('/') if s != ''][1:]
+
+        if method == 'POST':
+            return self.send(handler, 200, {'access_token': 'token', 'expires_in': 1800})
+
+        elif segments == ['me', 'organizations']:
+            return self.send(handler, 200, {'request_status': 'SUCCESS', 'organizations': [
+                {'sub_request_status': 'SUCCESS', 'organization': o} for o in self.entities['organizations']]})
+
+        elif segments[-1] == 'stats':
+            if self.isRateLimited() is True:
+                return self.send(handler, 429, {'request_status': 'ERROR', 'debug_message': 'Too many requests'},
+                                 {'Retry-After': '1'})
+
+            statusCode, body = self.getStatistics(segments[0], segments[1], params)
+
+            # Larger responses take longer, e.g. breakdowns of ad accounts with many objects.
+            if self.paramRowLatency > 0 and statusCode == 200:
+                time.sleep(self.paramRowLatency * self.countRows(body))
+
+            return self.send(handler, statusCode, body)
+
+        else:
+            return self.send(handler, *self.getListing(segments[-1], segments[1], url.path, params))
+
+    @staticmethod
+    def countRows(body):
+
+        stats = [s['timeseries_stat'] for s in body['timeseries_stats']]
+        stats += [b for s in stats for breakdown in s.get('breakdown_stats', {}).values() for b in breakdown]
+
+        return sum([len(s.get('timeseries', [])) for s in stats])
+
+    def getListing(self, objectType, parentId, path, params):
+
+        if parentId not in self.entities[objectType]:
+            return 404, {'request_status': 'ERROR', 'debug_message': f'Unknown parent {parentId}.'}
+
+        objects = self.entities[objectType][parentId]
+        limit = int(params.get('limit', 50))
+        limit = min(limit, self.paramPageSize) if self.paramPageSize is not None else limit
+        cursor = int(params.get('cursor', 0))
+        key = LISTING_KEYS[objectType]
+
+        body = {'request_status': 'SUCCESS', 'paging': {},
+                key + 's': [{'sub_request_status': 'SUCCESS', key: o} for o in objects[cursor:cursor + limit]]}
+
+        if cursor + limit < len(objects):
+            body['paging']['next_link'] = f'https://adsapi.snapchat.com{path}?cursor={cursor + limit}&limit={limit}'
+
+        return 200, body
+
+    @staticmethod
+    def getTimeseries(objectId, fields, granularity, startTime, endTime):
+
+        timeseries = []
+        step = GRANULARITY_STEP[granularity]
+
+        while startTime < endTime:
+
+            _start = startTime.isoformat(timespec='milliseconds')
+            timeseries += [{'start_time': _start, 'end_time': (startTime + step).isoformat(timespec='milliseconds'),
+                            'stats': {f: zlib.crc32(f'{objectId}{f}{_start}'.encode()) % 1000 for f in fields}}]
+            startTime += step
+
+        return timeseries
+
+    def getStatistics(self, objectType, objectId, params):
+
+        granularity = params['granularity']
+        fields = params['fields'].split(',')
+        startTime = datetime.datetime.fromisoformat(params['start_time'])
+        endTime = datetime.datetime.fromisoformat(params['end_time'])
+
+        if endTime - startTime > MAX_STATISTICS_RANGE[granularity]:
+            return 400, {'request_status': 'ERROR', 'debug_message': 'Date range of the request is too long.'}
+
+        stat = {'id': objectId, 'type': STATISTICS_TYPES[objectType], 'granularity': granularity,
+                'swipe_up_attribution_window': params['swipe_up_attribution_window'],
+                'view_attribution_window': params['view_attribution_window'],
+                'start_time': params['start_time'], 'end_time': params['end_time']}
+
+        if 'breakdown' in params:
+            breakdown = params['breakdown']
+            stat['breakdown_stats'] = {breakdown: [
+                {'id': o['id'], 'type': STATISTICS_TYPES[BREAKDOWN_OBJECTS[breakdown]], 'granularity': granularity,
+                 'start_time': params['start_time'], 'end_time': params['end_time'],
+                 'timeseries': self.getTimeseries(o['id'], fields, granularity, startTime, endTime)}
+                for o in self.entities[BREAKDOWN_OBJECTS[breakdown]].get(objectId, [])]}
+
+        else:
+            stat['timeseries'] = self.getTimeseries(objectId, fields, granularity, startTime, endTime)
+
+        return 200, {'request_status': 'SUCCESS',
+                     'timeseries_stats': [{'sub_request_status': 'SUCCESS', 'timeseries_stat': stat}]}
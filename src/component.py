@@ -1,15 +1,27 @@
-import dateparser
+import copy
 import datetime
+import httpx
+import importlib.util
 import json
 import logging
+import os
 import pytz
+import requests
 import sys
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
 from keboola.component import UserException
 from keboola.component.base import ComponentBase, sync_action
 from keboola.component.sync_actions import SelectElement
-from keboola.utils import split_dates_to_chunks
-from snapchat.client import SnapchatClient
-from snapchat.result import SnapchatWriter, SnapchatStatisticsWriter
+from snapchat.activity import SnapchatActivityIndex
+from snapchat.async_client import SnapchatAsyncClientAdapter
+from snapchat.cache import SnapchatStatisticsCache
+from snapchat.client import SnapchatClient, SnapchatClientException
+from snapchat.metrics import SnapchatMetrics
+from snapchat.planner import SnapchatRequestPlan
+from snapchat.ratelimit import SnapchatRateLimiter
+from snapchat.result import OUTPUT_FORMATS, SnapchatWriter, SnapchatStatisticsWriter, createFileManifest
+from snapchat.scheduler import SnapchatScheduler
 
 
 KEY_DOWNLOAD_OBJECTS = 'statisticsObjects'
@@ -19,11 +31,33 @@ KEY_QUERY = 'query'
 
 KEY_DATES_START = 'startDate'
 KEY_DATES_END = 'endDate'
+KEY_DATES_INCREMENTAL = 'incremental'
+KEY_DATES_LOOKBACK = 'lookbackDays'
 
 KEY_ATTRIBUTION_GRANULARITY = 'granularity'
 KEY_ATTRIBUTION_SWIPE = 'windowSwipe'
 KEY_ATTRIBUTION_VIEW = 'windowView'
+KEY_ATTRIBUTION_DAILY_ROLLUP = 'dailyRollup'
+KEY_ATTRIBUTION_ADDITIONAL_WINDOWS = 'additionalWindows'
 KEY_SELECTED_ORGS = 'selectedOrganizations'
+KEY_CONCURRENCY = 'concurrency'
+KEY_ACCOUNT_CONCURRENCY = 'accountConcurrency'
+KEY_STATISTICS_MODE = 'statisticsMode'
+KEY_SKIP_INACTIVE = 'skipInactiveObjects'
+KEY_CLIENT_TYPE = 'clientType'
+KEY_RATE_LIMIT = 'rateLimit'
+KEY_CHANGED_ENTITIES_ONLY = 'changedEntitiesOnly'
+KEY_ENTITY_CACHE_HOURS = 'entityCacheHours'
+KEY_OUTPUT_FORMAT = 'outputFormat'
+KEY_SLICE_ROWS = 'sliceRows'
+KEY_CHECKPOINT = 'checkpoint'
+KEY_WRITE_METRICS = 'writeMetrics'
+KEY_STATISTICS_CACHE = 'statisticsCache'
+KEY_OBJECT_QUERY = 'objectQuery'
+KEY_FIELDS_PER_REQUEST = 'fieldsPerRequest'
+KEY_DRY_RUN = 'dryRun'
+KEY_REQUEST_BUDGET = 'requestBudget'
+KEY_BUDGET_ACTION = 'budgetAction'
 
 MANDATORY_PARAMS = []
 
@@ -36,9 +70,58 @@ SUPPORTED_OBJECTS = ['campaigns', 'adsquads', 'ads']
 SUPPORTED_GRANULARITY = ['HOUR', 'DAY']
 SUPPORTED_WINDOW_VIEW = ["1_HOUR", "3_HOUR", "6_HOUR", "1_DAY", "7_DAY", "28_DAY"]
 SUPPORTED_WINDOW_SWIPE = ["1_DAY", "7_DAY", "28_DAY"]
+WINDOW_SWIPE_DAYS = {"1_DAY": 1, "7_DAY": 7, "28_DAY": 28}
+WINDOW_VIEW_DAYS = {"1_HOUR": 1, "3_HOUR": 1, "6_HOUR": 1, "1_DAY": 1, "7_DAY": 7, "28_DAY": 28}
+SUPPORTED_STATISTICS_MODES = ['object', 'breakdown']
+
+# Metrics, which can not be summed from hours into days. With the daily rollup, they are requested with daily
+# granularity in separate requests.
+NON_ADDITIVE_METRICS = ['uniques', 'frequency', 'attachment_uniques', 'attachment_frequency', 'avg_view_time_millis',
+                        'avg_screen_time_millis', 'attachment_avg_view_time_millis']
+SUPPORTED_CLIENT_TYPES = ['sync', 'async']
+SUPPORTED_BUDGET_ACTIONS = ['fail', 'reduce']
+
+BREAKDOWN_OBJECTS = {
+    'campaigns': 'campaign',
+    'adsquads': 'adsquad',
+    'ads': 'ad'
+}
 
 DATE_CHUNK_FORMAT = '%Y-%m-%d'
 
+# The API allows at most 32 days of daily and 7 days of hourly statistics in a single request. Chunks are split
+# in the timezone of the ad account, a day of daylight saving time change may be an hour longer.
+STATISTICS_CHUNK_DAYS = {'DAY': 31, 'HOUR': 6}
+STATISTICS_PERIODS = {'DAY': datetime.timedelta(days=1), 'HOUR': datetime.timedelta(hours=1)}
+
+STATE_STATISTICS = 'statistics'
+STATE_ENTITIES = 'entities'
+STATE_ENTITIES_LISTED = 'listed_at'
+STATE_CHECKPOINT = 'checkpoint'
+STATE_ACCOUNT_COSTS = 'account_costs'
+STATE_STATISTICS_LATENCY = 'statistics_latency'
+
+# Attributes of listed entities kept between runs; enough to detect a change and to tell when an entity was active.
+ENTITY_CACHE_FIELDS = ['updated_at', 'created_at', 'start_time', 'end_time']
+ENTITY_PARENT_KEYS = {
+    'campaigns': None,
+    'adsquads': 'campaign_id',
+    'ads': 'ad_squad_id',
+    'creatives': None
+}
+
+DEFAULT_CONCURRENCY = 4
+DEFAULT_ACCOUNT_CONCURRENCY = 4
+MAX_CONCURRENCY = 32
+MAX_ASYNC_CONCURRENCY = 1000
+
+# Errors of the API and of the connection to it, which fail only the download of the affected ad account.
+ACCOUNT_ERRORS = (SnapchatClientException, requests.exceptions.RequestException, httpx.HTTPError)
+
+METRICS_FILE_NAME = 'snapchat_metrics.json'
+STATISTICS_CACHE_FILE_NAME = 'snapchat_statistics_cache.json.gz'
+STATISTICS_CACHE_TAG = 'snapchat-statistics-cache'
+
 
 class SnapchatComponent(ComponentBase):
 
@@ -46,23 +129,37 @@ class SnapchatComponent(ComponentBase):
         ComponentBase.__init__(self, required_parameters=MANDATORY_PARAMS)
         self.cfg_params = self.configuration.parameters
         self.parseAuthorization()
-        self.client = SnapchatClient(self.varRefreshToken, self.varAppKey, self.varAppSecret)
+        self.metrics = SnapchatMetrics()
 
-        self.writerOrganizations = SnapchatWriter(self.data_folder_path, 'organizations')
-        self.writerAdaccounts = SnapchatWriter(self.data_folder_path, 'adaccounts')
-        self.writerCampaigns = SnapchatWriter(self.data_folder_path, 'campaigns')
-        self.writerAdsquads = SnapchatWriter(self.data_folder_path, 'adsquads')
-        self.writerCreatives = SnapchatWriter(self.data_folder_path, 'creatives')
-        self.writerAds = SnapchatWriter(self.data_folder_path, 'ads')
+        # Sync actions only authenticate and list organizations, output, dates and the client of the run
+        # are not needed for them.
+        if self.configuration.action in [None, '', 'run']:
+            self.initializeRun()
 
+    def initializeRun(self):
+
+        self.stateIn = self.get_state_file()
+        self.stateOut = copy.deepcopy(self.stateIn)
+        self._stateLock = threading.Lock()
         self.checkParameters()
 
-        if self.paramObjects != []:
-            self.writerStatistics = SnapchatStatisticsWriter(self.data_folder_path, metricFields=self.paramQuery)
+        self.writerOrganizations = self.createWriter('organizations')
+        self.writerAdaccounts = self.createWriter('adaccounts')
+        self.writerCampaigns = self.createWriter('campaigns')
+        self.writerAdsquads = self.createWriter('adsquads')
+        self.writerCreatives = self.createWriter('creatives')
+        self.writerAds = self.createWriter('ads')
+
+        self.statisticsCache = None
+        self.varBreakdownSizes = {}
+        self.client = self.createClient()
+
+        if self.paramObjects != [] and self.paramDryRun is False:
+            self.writerStatistics = SnapchatStatisticsWriter(self.data_folder_path, metricFields=self.varMetricFields,
+                                                             outputFormat=self.paramOutputFormat,
+                                                             sliceRows=self.paramSliceRows)
 
-        self.paramDateChunks = split_dates_to_chunks(self.paramStartDate, self.paramEndDate,
-                                                     28 if self.paramGranularity == 'DAY' else 6,
-                                                     strformat=DATE_CHUNK_FORMAT)
+        self.paramDateChunks = self.splitDatesToChunks(self.paramStartDate)
 
         logging.debug(self.paramDateChunks)
 
@@ -79,6 +176,9 @@ class SnapchatComponent(ComponentBase):
         else:
             self.paramObjects = _objects
 
+        # The dateparser package takes most of the start-up time, it is only imported by the run.
+        import dateparser
+
         _dates = self.cfg_params.get(KEY_DATES_ATTR, {})
         _startDate = dateparser.parse(_dates.get(KEY_DATES_START, '30 days ago'))
         _endDate = dateparser.parse(_dates.get(KEY_DATES_END, 'yesterday'))
@@ -97,8 +197,7 @@ class SnapchatComponent(ComponentBase):
 
             logging.debug(f"start: {_startDate}, end: {_endDate}.")
 
-        _query = self.cfg_params.get(KEY_QUERY, '')
-        _queryClean = list(set([m.strip() for m in _query.replace('\n', ',').split(',') if m.strip() != '']))
+        _queryClean = self.parseQuery(self.cfg_params.get(KEY_QUERY, ''))
 
         if _queryClean == []:
             self.paramQuery = ['impressions', 'spend']
@@ -108,6 +207,32 @@ class SnapchatComponent(ComponentBase):
 
         logging.debug(f"Query: {self.paramQuery}.")
 
+        _objectQuery = self.cfg_params.get(KEY_OBJECT_QUERY, {})
+        _diff = set(_objectQuery) - set(SUPPORTED_OBJECTS)
+
+        if not isinstance(_objectQuery, dict) or len(_diff) > 0:
+            logging.error(f"Unsupported objects {_diff} in parameter \"{KEY_OBJECT_QUERY}\".")
+            sys.exit(1)
+
+        else:
+            # Objects without their own metrics use the common query.
+            self.paramObjectQuery = {obj: self.parseQuery(q) for obj, q in _objectQuery.items()
+                                     if self.parseQuery(q) != []}
+
+        # Columns of the statistics table are all metrics requested for any object type.
+        self.varMetricFields = list(dict.fromkeys(self.paramQuery + [m for obj in SUPPORTED_OBJECTS
+                                                                     for m in self.paramObjectQuery.get(obj, [])]))
+
+        _fieldsPerRequest = self.cfg_params.get(KEY_FIELDS_PER_REQUEST, 0)
+
+        if not isinstance(_fieldsPerRequest, int) or _fieldsPerRequest < 0:
+            logging.error(f"Unsupported fields per request setting {_fieldsPerRequest}. Must be a non-negative "
+                          f"integer.")
+            sys.exit(1)
+
+        else:
+            self.paramFieldsPerRequest = _fieldsPerRequest
+
         _attribution = self.cfg_params.get(KEY_ATTRIBUTION_ATTR, {})
         _granularity = _attribution.get(KEY_ATTRIBUTION_GRANULARITY, 'DAY')
 
@@ -136,6 +261,246 @@ class SnapchatComponent(ComponentBase):
         else:
             self.paramWindowView = _view
 
+        # Statistics are requested for each combination of attribution windows, the configured one comes first.
+        self.paramAttributionWindows = [(self.paramWindowSwipe, self.paramWindowView)]
+        _additionalWindows = _attribution.get(KEY_ATTRIBUTION_ADDITIONAL_WINDOWS, [])
+
+        if not isinstance(_additionalWindows, list) or not all([isinstance(w, dict) for w in _additionalWindows]):
+            logging.error(f"Unsupported additional attribution windows {_additionalWindows}. Must be a list of "
+                          f"objects with {KEY_ATTRIBUTION_SWIPE} and {KEY_ATTRIBUTION_VIEW}.")
+            sys.exit(1)
+
+        for _windows in _additionalWindows:
+
+            _swipe = _windows.get(KEY_ATTRIBUTION_SWIPE, self.paramWindowSwipe)
+            _view = _windows.get(KEY_ATTRIBUTION_VIEW, self.paramWindowView)
+
+            if _swipe not in SUPPORTED_WINDOW_SWIPE or _view not in SUPPORTED_WINDOW_VIEW:
+                logging.error(f"Unsupported additional attribution windows {_swipe} and {_view}.")
+                sys.exit(1)
+
+            elif (_swipe, _view) not in self.paramAttributionWindows:
+                self.paramAttributionWindows += [(_swipe, _view)]
+
+        self.paramDailyRollup = bool(_attribution.get(KEY_ATTRIBUTION_DAILY_ROLLUP, False))
+
+        if self.paramDailyRollup is True and self.paramGranularity != 'HOUR':
+            logging.error("Daily rollup is only supported with the HOUR granularity.")
+            sys.exit(1)
+
+        self.paramIncremental = bool(_dates.get(KEY_DATES_INCREMENTAL, False))
+        _lookback = _dates.get(KEY_DATES_LOOKBACK, self.getAttributionWindowDays())
+
+        if not isinstance(_lookback, int) or _lookback < 0:
+            logging.error(f"Unsupported look-back setting {_lookback}. Must be a non-negative integer.")
+            sys.exit(1)
+
+        else:
+            self.paramLookbackDays = _lookback
+
+        # Statistics downloaded with different settings can not be continued incrementally.
+        self.varStatisticsSettings = {
+            'query': sorted(self.paramQuery),
+            'granularity': self.paramGranularity,
+            'windowSwipe': self.paramWindowSwipe,
+            'windowView': self.paramWindowView
+        }
+
+        if self.paramObjectQuery != {}:
+            self.varStatisticsSettings['objectQuery'] = {obj: sorted(q) for obj, q in self.paramObjectQuery.items()}
+
+        if self.paramDailyRollup is True:
+            self.varStatisticsSettings['dailyRollup'] = True
+
+        if len(self.paramAttributionWindows) > 1:
+            self.varStatisticsSettings['attributionWindows'] = [list(w) for w in self.paramAttributionWindows]
+
+        _clientType = self.cfg_params.get(KEY_CLIENT_TYPE, 'sync')
+
+        if _clientType not in SUPPORTED_CLIENT_TYPES:
+            logging.error(f"Unsupported client type {_clientType}.")
+            sys.exit(1)
+
+        else:
+            self.paramClientType = _clientType
+
+        # Requests of the asynchronous client are not bound to threads, many more of them can be in flight.
+        self.paramConcurrency = self._getConcurrencyParameter(KEY_CONCURRENCY, DEFAULT_CONCURRENCY,
+                                                              MAX_ASYNC_CONCURRENCY if _clientType == 'async'
+                                                              else MAX_CONCURRENCY)
+        _rateLimit = self.cfg_params.get(KEY_RATE_LIMIT)
+
+        if _rateLimit is not None and (not isinstance(_rateLimit, (int, float)) or _rateLimit <= 0):
+            logging.error(f"Unsupported rate limit setting {_rateLimit}. Must be a positive number.")
+            sys.exit(1)
+
+        else:
+            self.paramRateLimit = _rateLimit
+
+        self.paramAccountConcurrency = self._getConcurrencyParameter(KEY_ACCOUNT_CONCURRENCY,
+                                                                     DEFAULT_ACCOUNT_CONCURRENCY)
+
+        _mode = self.cfg_params.get(KEY_STATISTICS_MODE, 'object')
+
+        if _mode not in SUPPORTED_STATISTICS_MODES:
+            logging.error(f"Unsupported statistics mode {_mode}.")
+            sys.exit(1)
+
+        else:
+            self.paramStatisticsMode = _mode
+
+        self.paramSkipInactive = bool(self.cfg_params.get(KEY_SKIP_INACTIVE, False))
+        self.paramChangedEntitiesOnly = bool(self.cfg_params.get(KEY_CHANGED_ENTITIES_ONLY, False))
+        _cacheHours = self.cfg_params.get(KEY_ENTITY_CACHE_HOURS, 0)
+
+        if not isinstance(_cacheHours, (int, float)) or _cacheHours < 0:
+            logging.error(f"Unsupported entity cache setting {_cacheHours}. Must be a non-negative number.")
+            sys.exit(1)
+
+        else:
+            self.paramEntityCacheHours = _cacheHours
+
+        self.paramEntityCache = self.paramChangedEntitiesOnly is True or self.paramEntityCacheHours > 0
+
+        _outputFormat = self.cfg_params.get(KEY_OUTPUT_FORMAT, 'csv')
+
+        if _outputFormat not in OUTPUT_FORMATS:
+            logging.error(f"Unsupported output format {_outputFormat}.")
+            sys.exit(1)
+
+        elif _outputFormat == 'parquet' and importlib.util.find_spec('pyarrow') is None:
+            logging.error("Output format parquet requires the pyarrow package, which is not installed.")
+            sys.exit(1)
+
+        else:
+            self.paramOutputFormat = _outputFormat
+
+        _sliceRows = self.cfg_params.get(KEY_SLICE_ROWS, 0)
+
+        if not isinstance(_sliceRows, int) or _sliceRows < 0:
+            logging.error(f"Unsupported slice setting {_sliceRows}. Must be a non-negative integer.")
+            sys.exit(1)
+
+        elif _sliceRows > 0 and self.paramOutputFormat != 'csv':
+            logging.error("Sliced output is only supported for the csv output format.")
+            sys.exit(1)
+
+        else:
+            self.paramSliceRows = _sliceRows
+
+        self.paramCheckpoint = bool(self.cfg_params.get(KEY_CHECKPOINT, False))
+        self.paramWriteMetrics = bool(self.cfg_params.get(KEY_WRITE_METRICS, False))
+        self.paramStatisticsCache = bool(self.cfg_params.get(KEY_STATISTICS_CACHE, False))
+        self.paramDryRun = bool(self.cfg_params.get(KEY_DRY_RUN, False))
+        _requestBudget = self.cfg_params.get(KEY_REQUEST_BUDGET, 0)
+
+        if not isinstance(_requestBudget, int) or _requestBudget < 0:
+            logging.error(f"Unsupported request budget setting {_requestBudget}. Must be a non-negative integer.")
+            sys.exit(1)
+
+        else:
+            self.paramRequestBudget = _requestBudget
+
+        _budgetAction = self.cfg_params.get(KEY_BUDGET_ACTION, 'fail')
+
+        if _budgetAction not in SUPPORTED_BUDGET_ACTIONS:
+            logging.error(f"Unsupported budget action {_budgetAction}.")
+            sys.exit(1)
+
+        else:
+            self.paramBudgetAction = _budgetAction
+
+        # Progress of a previous run can only be continued, if it was requesting the same statistics.
+        self.varCheckpointSettings = {
+            **self.varStatisticsSettings,
+            'objects': sorted(self.paramObjects),
+            'statisticsMode': self.paramStatisticsMode,
+            'skipInactiveObjects': self.paramSkipInactive,
+            'startDate': self.paramStartDate.strftime(DATE_CHUNK_FORMAT),
+            'endDate': self.paramEndDate.strftime(DATE_CHUNK_FORMAT)
+        }
+
+    @staticmethod
+    def parseQuery(query):
+
+        return list(dict.fromkeys([m.strip() for m in query.replace('\n', ',').split(',') if m.strip() != '']))
+
+    def getObjectMetrics(self, objectType):
+
+        return self.paramObjectQuery.get(objectType, self.paramQuery)
+
+    def getFieldGroups(self, objectType, metrics=None):
+
+        # Long lists of metrics are split into several requests, their responses are merged before writing.
+        _metrics = self.getObjectMetrics(objectType) if metrics is None else metrics
+        _size = self.paramFieldsPerRequest if self.paramFieldsPerRequest > 0 else max(len(_metrics), 1)
+
+        return [','.join(_metrics[i:i + _size]) for i in range(0, len(_metrics), _size)]
+
+    def getStatisticsParts(self, objectType):
+
+        # Granularity and fields of each request of a date chunk.
+        parts = [(self.paramGranularity, _fields) for _fields in self.getFieldGroups(objectType)]
+
+        if self.paramDailyRollup is True:
+            _nonAdditive = [m for m in self.getObjectMetrics(objectType) if m in NON_ADDITIVE_METRICS]
+            parts += [('DAY', _fields) for _fields in self.getFieldGroups(objectType, _nonAdditive)]
+
+        return parts
+
+    def getWrittenStatistics(self, objectType, timezone, statisticsParts):
+
+        _statistics = SnapchatStatisticsWriter.mergeStatistics([s for g, s in statisticsParts
+                                                                if g == self.paramGranularity])
+
+        if self.paramDailyRollup is False:
+            return _statistics
+
+        # Days are summed from hours, metrics which can not be summed are merged from the daily requests.
+        _additive = [m for m in self.getObjectMetrics(objectType) if m not in NON_ADDITIVE_METRICS]
+        _daily = SnapchatStatisticsWriter.mergeStatistics(
+            [SnapchatStatisticsWriter.rollupStatistics(_statistics, timezone, _additive)]
+            + [s for g, s in statisticsParts if g == 'DAY'])
+
+        return _statistics + _daily
+
+    def createWriter(self, tableName):
+
+        return SnapchatWriter(self.data_folder_path, tableName, self.paramOutputFormat, self.paramSliceRows)
+
+    def getAttributionWindowDays(self):
+
+        # Conversions are attributed to a day for the longest of the attribution windows.
+        return max([max(WINDOW_SWIPE_DAYS[_swipe], WINDOW_VIEW_DAYS[_view])
+                    for _swipe, _view in self.paramAttributionWindows])
+
+    def _getConcurrencyParameter(self, key, default, maximum=MAX_CONCURRENCY):
+
+        _concurrency = self.cfg_params.get(key, default)
+
+        if not isinstance(_concurrency, int) or not 1 <= _concurrency <= maximum:
+            logging.error(f"Unsupported {key} setting {_concurrency}. Must be an integer between 1 and "
+                          f"{maximum}.")
+            sys.exit(1)
+
+        else:
+            return _concurrency
+
+    def createClient(self):
+
+        rateLimiter = SnapchatRateLimiter(self.paramRateLimit)
+
+        if self.paramClientType == 'async':
+            # Listings of all entity types of ad accounts are requested alongside statistics, the pool must fit
+            # both of them.
+            _maxConnections = self.paramConcurrency + self.paramAccountConcurrency * len(ENTITY_PARENT_KEYS)
+            return SnapchatAsyncClientAdapter(self.varRefreshToken, self.varAppKey, self.varAppSecret, rateLimiter,
+                                              _maxConnections, self.metrics)
+
+        else:
+            return SnapchatClient(self.varRefreshToken, self.varAppKey, self.varAppSecret, rateLimiter,
+                                  self.metrics)
+
     def getAuthorization(self):
 
         try:
@@ -158,12 +523,104 @@ class SnapchatComponent(ComponentBase):
             logging.error("Key %s missing in authorization." % e)
             sys.exit(1)
 
-    def normalizeTime(self, timezone):
+    def splitDatesToChunks(self, startDate, endDate=None):
+
+        from keboola.utils import split_dates_to_chunks
+
+        return split_dates_to_chunks(startDate, self.paramEndDate if endDate is None else endDate,
+                                     STATISTICS_CHUNK_DAYS[self.paramGranularity], strformat=DATE_CHUNK_FORMAT)
+
+    def getStatisticsStartDate(self, adAccountId, objectType):
+
+        _lastState = self.stateIn.get(STATE_STATISTICS, {}).get(adAccountId, {}).get(objectType)
+
+        if self.paramIncremental is False or _lastState is None \
+                or _lastState.get('settings') != self.varStatisticsSettings:
+            return self.paramStartDate
+
+        _lastEndDate = datetime.datetime.strptime(_lastState['end_date'], DATE_CHUNK_FORMAT)
+        _startDate = _lastEndDate - datetime.timedelta(days=self.paramLookbackDays)
+
+        return max(self.paramStartDate.replace(tzinfo=None), _startDate)
+
+    def getDateChunks(self, adAccountId, objectType):
+
+        _startDate = self.getStatisticsStartDate(adAccountId, objectType)
+
+        if _startDate is self.paramStartDate:
+            return self.paramDateChunks
+
+        elif _startDate.date() >= self.paramEndDate.date():
+            logging.info(f"Statistics of {objectType} for ad account {adAccountId} are up to date.")
+            return []
+
+        else:
+            logging.debug(f"Downloading statistics of {objectType} for ad account {adAccountId} from {_startDate}.")
+            return self.splitDatesToChunks(_startDate)
+
+    def updateStatisticsState(self, adAccountId, objectTypes):
+
+        if self.paramIncremental is False:
+            return
+
+        _endDate = self.paramEndDate.strftime(DATE_CHUNK_FORMAT)
+
+        with self._stateLock:
+
+            _accountState = self.stateOut.setdefault(STATE_STATISTICS, {}).setdefault(adAccountId, {})
+
+            for objectType in objectTypes:
+
+                _lastState = _accountState.get(objectType, {})
+                _objectEndDate = _endDate
+
+                if _lastState.get('settings') == self.varStatisticsSettings:
+                    _objectEndDate = max(_endDate, _lastState['end_date'])
+
+                _accountState[objectType] = {'end_date': _objectEndDate, 'settings': self.varStatisticsSettings}
+
+    def getCheckpoint(self, adAccountId):
+
+        _checkpoint = self.stateIn.get(STATE_CHECKPOINT, {})
+
+        if self.paramCheckpoint is False or _checkpoint.get('settings') != self.varCheckpointSettings:
+            return {}
+
+        else:
+            return _checkpoint.get('accounts', {}).get(adAccountId, {})
+
+    def updateCheckpoint(self, adAccountId, objectType=None, dateChunk=None):
+
+        if self.paramCheckpoint is False:
+            return
+
+        with self._stateLock:
+
+            _checkpoint = self.stateOut.get(STATE_CHECKPOINT, {})
+
+            if _checkpoint.get('settings') != self.varCheckpointSettings:
+                _checkpoint = self.stateOut[STATE_CHECKPOINT] = {'settings': self.varCheckpointSettings, 'accounts': {}}
+
+            _accountCheckpoint = _checkpoint['accounts'].setdefault(adAccountId, {})
+
+            if objectType is None:
+                _accountCheckpoint['finished'] = True
+
+            else:
+                _accountCheckpoint.setdefault('chunks', {}).setdefault(objectType, []).append(
+                    self.getCheckpointKey(dateChunk))
+
+    @staticmethod
+    def getCheckpointKey(dateChunk):
+
+        return f"{dateChunk['start_date']}/{dateChunk['end_date']}"
+
+    def normalizeTime(self, timezone, dateChunks=None):
 
         tz = pytz.timezone(timezone)
         chunks = []
 
-        for chunk in self.paramDateChunks:
+        for chunk in (self.paramDateChunks if dateChunks is None else dateChunks):
 
             _start = tz.localize(datetime.datetime.strptime(chunk['start_date'],
                                                             DATE_CHUNK_FORMAT)).replace(hour=0).isoformat()
@@ -174,6 +631,33 @@ class SnapchatComponent(ComponentBase):
 
         return chunks
 
+    def getRequestDateChunks(self, timezone, dateChunks, activityIndex=None, objectIds=[]):
+
+        if activityIndex is None or dateChunks == []:
+            return self.normalizeTime(timezone, dateChunks)
+
+        # The date range is narrowed to days, in which any of the objects may have delivered, and split again,
+        # so no requests are spent on leading and trailing days without data.
+        tz = pytz.timezone(timezone)
+        _activeStart, _activeEnd = activityIndex.getActiveRange(objectIds)
+        _startDate = datetime.datetime.strptime(dateChunks[0]['start_date'], DATE_CHUNK_FORMAT)
+        _endDate = datetime.datetime.strptime(dateChunks[-1]['end_date'], DATE_CHUNK_FORMAT)
+
+        if _activeStart is not None:
+            _localStart = _activeStart.astimezone(tz).replace(tzinfo=None)
+            _startDate = max(_startDate, datetime.datetime.combine(_localStart.date(), datetime.time()))
+
+        if _activeEnd is not None:
+            _localEnd = _activeEnd.astimezone(tz).replace(tzinfo=None)
+            _endDay = datetime.datetime.combine(_localEnd.date(), datetime.time())
+            _endDate = min(_endDate, _endDay if _localEnd == _endDay else _endDay + datetime.timedelta(days=1))
+
+        if _startDate >= _endDate:
+            return []
+
+        else:
+            return self.normalizeTime(timezone, self.splitDatesToChunks(_startDate, _endDate))
+
     def getAndWriteOrganizations(self):
 
         allOrgs = self.client.getOrganizations()
@@ -196,83 +680,620 @@ class SnapchatComponent(ComponentBase):
         self.writerAdaccounts.writerow(allAdAccs)
         self.varAdAccs = {acc['id']: {"timezone": acc['timezone']} for acc in allAdAccs}
 
-    def getAndWriteCampaigns(self, adAccountId):
+    def getCachedEntities(self, adAccountId, objectType):
 
-        allCampaigns = self.client.getCampaignsForAdAccount(adAccountId)
-        self.writerCampaigns.writerow(allCampaigns)
+        return self.stateIn.get(STATE_ENTITIES, {}).get(adAccountId, {}).get(objectType, {})
 
-        if 'campaigns' in self.paramObjects:
-            return [(c['id'], 'campaigns') for c in allCampaigns]
+    def isEntityCacheFresh(self, adAccountId):
+
+        _accountCache = self.stateIn.get(STATE_ENTITIES, {}).get(adAccountId, {})
+
+        if self.paramEntityCacheHours <= 0 or STATE_ENTITIES_LISTED not in _accountCache \
+                or not all([obj in _accountCache for obj in ENTITY_PARENT_KEYS]):
+            return False
+
+        _listedAt = datetime.datetime.fromisoformat(_accountCache[STATE_ENTITIES_LISTED])
+        _age = datetime.datetime.now(datetime.timezone.utc) - _listedAt
+
+        return _age < datetime.timedelta(hours=self.paramEntityCacheHours)
+
+    def updateEntityCache(self, adAccountId, objectType, entities):
+
+        with self._stateLock:
+            _accountCache = self.stateOut.setdefault(STATE_ENTITIES, {}).setdefault(adAccountId, {})
+            _accountCache[objectType] = entities
+            _accountCache[STATE_ENTITIES_LISTED] = datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+    def getCachedStatObjects(self, adAccountId, activityIndex=None):
+
+        statObjects = []
+
+        for objectType in SUPPORTED_OBJECTS:
+
+            _entities = self.getCachedEntities(adAccountId, objectType)
+
+            if activityIndex is not None:
+                activityIndex.add([{'id': _id, **_entity} for _id, _entity in _entities.items()],
+                                  parentKey=ENTITY_PARENT_KEYS[objectType])
+
+            if objectType in self.paramObjects:
+                statObjects += [(_id, objectType) for _id in _entities]
+
+        return statObjects
+
+    def getAndWriteEntities(self, adAccountId, pages, writer, objectType, activityIndex=None):
+
+        # Pages are written as they arrive, only identifiers of objects are kept for statistics.
+        statObjects = []
+        parentKey = ENTITY_PARENT_KEYS[objectType]
+        cachedEntities = self.getCachedEntities(adAccountId, objectType)
+        listedEntities = {}
+
+        for page in pages:
+
+            with self.metrics.timer('writing'):
+                if self.paramChangedEntitiesOnly is True:
+                    # Output tables are incremental, entities not changed since the last run are already in Storage.
+                    writer.writerow([e for e in page if e['id'] not in cachedEntities
+                                     or cachedEntities[e['id']].get('updated_at') != e.get('updated_at')])
+
+                else:
+                    writer.writerow(page)
+
+            if activityIndex is not None:
+                activityIndex.add(page, parentKey=parentKey)
+
+            if objectType in self.paramObjects:
+                statObjects += [(e['id'], objectType) for e in page]
+
+            if self.paramEntityCache is True:
+                listedEntities.update({e['id']: {k: e[k] for k in ENTITY_CACHE_FIELDS + [parentKey]
+                                                 if e.get(k) is not None} for e in page})
+
+        if self.paramEntityCache is True:
+            self.updateEntityCache(adAccountId, objectType, listedEntities)
+
+        return statObjects
+
+    def getAndWriteCampaigns(self, adAccountId, activityIndex=None):
+
+        return self.getAndWriteEntities(adAccountId, self.client.iterCampaignsForAdAccount(adAccountId),
+                                        self.writerCampaigns, 'campaigns', activityIndex)
+
+    def getAndWriteAdSquads(self, adAccountId, activityIndex=None):
+
+        return self.getAndWriteEntities(adAccountId, self.client.iterAdSquadsForAdAccount(adAccountId),
+                                        self.writerAdsquads, 'adsquads', activityIndex)
+
+    def getAndWriteCreatives(self, adAccountId):
+
+        return self.getAndWriteEntities(adAccountId, self.client.iterCreativesForAdAccount(adAccountId),
+                                        self.writerCreatives, 'creatives')
+
+    def getAndWriteAds(self, adAccountId, activityIndex=None):
+
+        return self.getAndWriteEntities(adAccountId, self.client.iterAdsForAdAccount(adAccountId), self.writerAds,
+                                        'ads', activityIndex)
+
+    def getAndWriteAllEntities(self, adAccountId, listingExecutor, activityIndex=None):
+
+        # Listings of entity types do not depend on each other, each one is paginated and written by its own thread.
+        futures = [listingExecutor.submit(self.getAndWriteCampaigns, adAccountId, activityIndex),
+                   listingExecutor.submit(self.getAndWriteAdSquads, adAccountId, activityIndex),
+                   listingExecutor.submit(self.getAndWriteAds, adAccountId, activityIndex),
+                   listingExecutor.submit(self.getAndWriteCreatives, adAccountId)]
+
+        try:
+            # Objects keep the order of entity types, regardless of which listing finished first.
+            return [statObject for future in futures for statObject in future.result()]
+
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+
+    def getStatisticsRequests(self, adAccountId, allStatObjects):
+
+        if self.paramStatisticsMode == 'breakdown':
+            # One request per object type returns statistics of all objects of that type in the ad account.
+            _endpoints = list(dict.fromkeys([end for _, end in allStatObjects]))
+            return [(end, 'adaccounts', adAccountId, BREAKDOWN_OBJECTS[end]) for end in _endpoints]
 
         else:
-            return []
+            return [(end, end, obj, None) for obj, end in allStatObjects]
 
-    def getAndWriteAdSquads(self, adAccountId):
+    @staticmethod
+    def isActiveInChunk(activityIndex, objectId, dateChunk):
 
-        allAdSquads = self.client.getAdSquadsForAdAccount(adAccountId)
-        self.writerAdsquads.writerow(allAdSquads)
+        if activityIndex is None:
+            return True
+
+        else:
+            return activityIndex.isActive(objectId, datetime.datetime.fromisoformat(dateChunk['start_date']),
+                                          datetime.datetime.fromisoformat(dateChunk['end_date']))
 
-        if 'adsquads' in self.paramObjects:
-            return [(a['id'], 'adsquads') for a in allAdSquads]
+    def loadStatisticsCache(self):
+
+        self.statisticsCache = SnapchatStatisticsCache()
+        _cacheFiles = self.get_input_files_definitions(tags=[STATISTICS_CACHE_TAG])
+
+        if _cacheFiles == []:
+            logging.info("No statistics cache found in input files, all statistics will be requested.")
 
         else:
-            return []
+            self.statisticsCache.load(max(_cacheFiles, key=lambda f: int(f.id or 0)).full_path)
 
-    def getAndWriteCreatives(self, adAccountId):
+        # Statistics of periods, which ended before the attribution window, no longer change.
+        self.varStatisticsClosedBefore = datetime.datetime.now(datetime.timezone.utc) \
+            - datetime.timedelta(days=self.getAttributionWindowDays())
+
+    def saveStatisticsCache(self):
+
+        os.makedirs(self.files_out_path, exist_ok=True)
+        _path = os.path.join(self.files_out_path, STATISTICS_CACHE_FILE_NAME)
+        self.statisticsCache.save(_path)
 
-        allCreatives = self.client.getCreativesForAdAccount(adAccountId)
-        self.writerCreatives.writerow(allCreatives)
+        # The cache is replaced by each run, older copies expire.
+        createFileManifest(_path, [STATISTICS_CACHE_TAG], isPermanent=False)
+        logging.info(f"Statistics of {self.statisticsCache.varHits} requests were read from the statistics cache.")
 
-    def getAndWriteAds(self, adAccountId):
+    def submitStatistics(self, executor, endpoint, endpointId, dateChunk, breakdown, fields, granularity=None,
+                         windows=None):
 
-        allAds = self.client.getAdsForAdAccount(adAccountId)
-        self.writerAds.writerow(allAds)
+        _granularity = self.paramGranularity if granularity is None else granularity
+        _windowSwipe, _windowView = self.paramAttributionWindows[0] if windows is None else windows
+        _startTime = dateChunk['start_date']
+        _cacheKey, _cached = None, []
 
-        if 'ads' in self.paramObjects:
-            return [(a['id'], 'ads') for a in allAds]
+        if self.statisticsCache is not None:
+            _cacheKey = self.statisticsCache.getKey(endpoint, endpointId, fields, _granularity,
+                                                    _windowSwipe, _windowView, breakdown)
+            _cached, _startTime = self.statisticsCache.lookup(_cacheKey, _startTime, dateChunk['end_date'])
+
+        if _startTime is None:
+            future = Future()
+            future.set_result([])
 
         else:
+            future = executor.submitStatistics(endpoint, endpointId, fields, _granularity, _startTime,
+                                               dateChunk['end_date'], _windowSwipe, _windowView,
+                                               breakdown)
+
+        return future, (_cacheKey, _cached, _startTime)
+
+    def getCachedStatistics(self, statistics, dateChunk, cacheContext):
+
+        _cacheKey, _cached, _startTime = cacheContext
+
+        if _cacheKey is None:
+            return statistics
+
+        if _startTime is not None:
+            self.statisticsCache.update(_cacheKey, _startTime, dateChunk['end_date'], statistics,
+                                        self.varStatisticsClosedBefore)
+
+        return self.statisticsCache.merge(_cached, statistics)
+
+    def getDatesByObject(self, adAccountId, allStatObjects):
+
+        return {obj: self.getDateChunks(adAccountId, obj) for obj in set([end for _, end in allStatObjects])}
+
+    def estimateStatisticsCost(self, allStatObjects, datesByObject):
+
+        # Statistics of each object for each date chunk, before inactive objects and cached periods are skipped,
+        # regardless of whether they are requested by object or in breakdowns.
+        _cost = sum([len(datesByObject[objectType]) * len(self.getStatisticsParts(objectType))
+                     for _, objectType in allStatObjects])
+
+        return _cost * len(self.paramAttributionWindows)
+
+    def recordAccountCosts(self, adAccountId, allStatObjects, cost):
+
+        # Breakdowns return statistics of all objects of a type in the ad account.
+        for objectType, breakdown in BREAKDOWN_OBJECTS.items():
+            self.varBreakdownSizes[(adAccountId, breakdown)] = len([o for o, t in allStatObjects if t == objectType])
+
+        with self._stateLock:
+            self.stateOut.setdefault(STATE_ACCOUNT_COSTS, {})[adAccountId] = cost
+
+    def estimateRequestCost(self, endpoint, endpointId, fields, granularity, startTime, endTime, windowSwipe,
+                            windowView, breakdown=None):
+
+        # Size of the response, i.e. values of metrics for all objects and periods; larger responses take longer.
+        _periods = (datetime.datetime.fromisoformat(endTime) - datetime.datetime.fromisoformat(startTime)) \
+            / STATISTICS_PERIODS[granularity]
+        _objects = 1 if breakdown is None else self.varBreakdownSizes.get((endpointId, breakdown), 1)
+
+        return _objects * _periods * len(fields.split(','))
+
+    def planStatisticsRequests(self, adAccountId, timezone, allStatObjects, activityIndex=None, datesByObject=None):
+
+        if allStatObjects == []:
             return []
 
+        statRequests = self.getStatisticsRequests(adAccountId, allStatObjects)
+
+        if datesByObject is None:
+            datesByObject = self.getDatesByObject(adAccountId, allStatObjects)
+
+        logging.debug(datesByObject)
+
+        finishedChunks = {obj: set(chunks) for obj, chunks in self.getCheckpoint(adAccountId).get('chunks', {}).items()}
+        plannedRequests = []
+
+        for objectType, end, obj, breakdown in statRequests:
+
+            _objectIds = [obj] if breakdown is None else [_obj for _obj, _end in allStatObjects if _end == objectType]
+
+            for dr in self.getRequestDateChunks(timezone, datesByObject[objectType], activityIndex, _objectIds):
+
+                if breakdown is None:
+                    _isActive = self.isActiveInChunk(activityIndex, obj, dr)
+                else:
+                    _isActive = any([self.isActiveInChunk(activityIndex, _obj, dr)
+                                     for _obj, _end in allStatObjects if _end == objectType])
+
+                _chunkKey = (objectType, self.getCheckpointKey(dr))
+
+                # Chunks downloaded completely by a previous run, which did not finish, are not requested again.
+                if _isActive is False or _chunkKey[1] in finishedChunks.get(objectType, set()):
+                    continue
+
+                plannedRequests += [(objectType, end, obj, breakdown, dr, _windows)
+                                    for _windows in self.paramAttributionWindows]
+
+        return plannedRequests
+
+    def getAndWriteStatistics(self, adAccountId, timezone, allStatObjects, executor, activityIndex=None,
+                              datesByObject=None, plannedRequests=None):
+
+        allStatIds = set([obj for obj, _ in allStatObjects])
+
+        if plannedRequests is None:
+            plannedRequests = self.planStatisticsRequests(adAccountId, timezone, allStatObjects, activityIndex,
+                                                          datesByObject)
+
+        pendingChunks = {}
+        pendingParts = {}
+        futures = {}
+
+        for objectType, end, obj, breakdown, dr, _windows in plannedRequests:
+
+            _chunkKey = (objectType, self.getCheckpointKey(dr))
+            _statisticsParts = self.getStatisticsParts(objectType)
+
+            # Each combination of attribution windows is merged and written separately, its rows differ
+            # in the attribution columns of the primary key.
+            _requestKey = (objectType, end, obj, _chunkKey[1], _windows)
+            pendingParts[_requestKey] = [len(_statisticsParts), []]
+            pendingChunks[_chunkKey] = pendingChunks.get(_chunkKey, 0) + 1
+
+            for _granularity, _fields in _statisticsParts:
+                _future, _cacheContext = self.submitStatistics(executor, end, obj, dr, breakdown, _fields,
+                                                               _granularity, _windows)
+                futures[_future] = (objectType, dr, _cacheContext, _requestKey, _granularity)
+
+        # Each response is written as a whole once it is complete, so a failed request never leaves
+        # a partial response in the output.
+        try:
+            for future in as_completed(futures):
+                # Breakdowns may contain objects, which were not listed for the ad account or were not active
+                # in the date chunk; these would not be requested in the object mode.
+                objectType, dr, _cacheContext, _requestKey, _granularity = futures[future]
+                _parts = pendingParts[_requestKey]
+                _parts[0] -= 1
+                _parts[1] += [(_granularity, self.getCachedStatistics(future.result(), dr, _cacheContext))]
+
+                # Responses for parts of the metrics are written together, once all of them are complete.
+                if _parts[0] > 0:
+                    continue
+
+                _statistics = self.getWrittenStatistics(objectType, timezone, pendingParts.pop(_requestKey)[1])
+
+                with self.metrics.timer('writing'):
+                    self.writerStatistics.writerow([s for s in _statistics if s['id'] in allStatIds
+                                                    and self.isActiveInChunk(activityIndex, s['id'], dr)])
+
+                # A chunk of an object type is finished, once responses of all its requests were written.
+                _chunkKey = (objectType, self.getCheckpointKey(dr))
+                pendingChunks[_chunkKey] -= 1
+
+                if pendingChunks[_chunkKey] == 0:
+                    self.updateCheckpoint(adAccountId, objectType, dr)
+
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+
+    def createActivityIndex(self):
+
+        if self.paramSkipInactive is False:
+            return None
+
+        else:
+            return SnapchatActivityIndex(self.getAttributionWindowDays())
+
+    def listAdAccount(self, adAccId, listingExecutor):
+
+        if self.getCheckpoint(adAccId).get('finished') is True:
+            logging.info(f"Ad account {adAccId} was downloaded by the previous run, skipping.")
+            self.updateCheckpoint(adAccId)
+            return None
+
+        logging.info(f"Starting download for ad account {adAccId}.")
+
+        allStatObjects = []
+        activityIndex = self.createActivityIndex()
+
+        if self.isEntityCacheFresh(adAccId):
+            logging.info(f"Using entities of ad account {adAccId} listed in a previous run.")
+            allStatObjects += self.getCachedStatObjects(adAccId, activityIndex)
+
+        else:
+            with self.metrics.timer('entities'):
+                allStatObjects += self.getAndWriteAllEntities(adAccId, listingExecutor, activityIndex)
+
+        datesByObject = self.getDatesByObject(adAccId, allStatObjects)
+        self.recordAccountCosts(adAccId, allStatObjects,
+                                self.estimateStatisticsCost(allStatObjects, datesByObject))
+
+        return allStatObjects, activityIndex, datesByObject
+
+    def downloadStatistics(self, adAccId, adAccIdSet, listing, statisticsExecutor, plannedRequests=None):
+
+        allStatObjects, activityIndex, datesByObject = listing
+
+        with self.metrics.timer('statistics'):
+            self.getAndWriteStatistics(adAccId, adAccIdSet['timezone'], allStatObjects, statisticsExecutor,
+                                       activityIndex, datesByObject, plannedRequests)
+        self.updateStatisticsState(adAccId, self.paramObjects)
+        self.updateCheckpoint(adAccId)
+
+        logging.info(f"Finished download for ad account {adAccId}.")
+
+    def downloadAdAccount(self, adAccId, adAccIdSet, statisticsExecutor, listingExecutor):
+
+        listing = self.listAdAccount(adAccId, listingExecutor)
+
+        if listing is not None:
+            self.downloadStatistics(adAccId, adAccIdSet, listing, statisticsExecutor)
+
+    def runForAdAccounts(self, accountExecutor, function, arguments, failedAdAccs):
+
+        results = {}
+        futures = {accountExecutor.submit(function, adAccId, *args): adAccId for adAccId, args in arguments.items()}
+
+        try:
+            for future in as_completed(futures):
+
+                adAccId = futures[future]
+
+                # Only errors of the API are isolated to the ad account, any other error fails the run at once.
+                try:
+                    results[adAccId] = future.result()
+
+                except ACCOUNT_ERRORS as e:
+                    logging.error(f"Download for ad account {adAccId} failed: {e}")
+                    failedAdAccs[adAccId] = e
+
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+
+        return results
+
+    def planAdAccounts(self, listings):
+
+        # Plans are made again from the listings whenever the date range changes, the date chunks of each object
+        # type are therefore not taken from the listing.
+        return {adAccId: self.planStatisticsRequests(adAccId, self.varAdAccs[adAccId]['timezone'], allStatObjects,
+                                                     activityIndex)
+                for adAccId, (allStatObjects, activityIndex, _) in listings.items()}
+
+    def getRequestPlan(self, plans):
+
+        plan = SnapchatRequestPlan()
+
+        for adAccId, plannedRequests in plans.items():
+            for objectType, end, obj, breakdown, dr, windows in plannedRequests:
+                for _granularity, _fields in self.getStatisticsParts(objectType):
+
+                    # Parts, which would be read from the statistics cache as a whole, make no request.
+                    if self.statisticsCache is not None and self.statisticsCache.isCached(
+                            self.statisticsCache.getKey(end, obj, _fields, _granularity, *windows, breakdown),
+                            dr['start_date'], dr['end_date']):
+                        continue
+
+                    plan.add(adAccId, objectType, _granularity)
+
+        return plan
+
+    def logRequestPlan(self, plan):
+
+        # Latency of statistics requests is kept from previous runs, listings of this run are the fallback.
+        _latency, _source = self.stateIn.get(STATE_STATISTICS_LATENCY), 'previous runs'
+
+        if _latency is None:
+            _latency = SnapchatRequestPlan.getMedianLatency(self.metrics.getSummary(), statistics=False)
+            _source = 'listings of this run'
+
+        plan.logSummary(_latency, _source, self.paramConcurrency, self.paramRateLimit)
+
+    def applyRequestBudget(self, listings, plans, plan):
+
+        _calls = plan.getTotal()
+
+        if self.paramRequestBudget == 0 or _calls <= self.paramRequestBudget:
+            return plans
+
+        elif self.paramBudgetAction == 'fail':
+            raise UserException(f"The run would make {_calls} statistics requests, which is more than the budget "
+                                f"of {self.paramRequestBudget} requests. Shorten the date range or raise the budget.")
+
+        # The oldest statistics are left out, the range starts at the earliest date chunk, from which the plan
+        # fits the budget. Plans only get smaller with a later start date.
+        _startDates = sorted(set([dr['start_date'][:10] for _plans in plans.values()
+                                  for _, _, _, _, dr, _ in _plans]))
+        _originalStartDate, _originalChunks = self.paramStartDate, self.paramDateChunks
+        _low, _high, _fitting = 1, len(_startDates) - 1, None
+
+        while _low <= _high:
+
+            _middle = (_low + _high) // 2
+            self.paramStartDate = datetime.datetime.strptime(_startDates[_middle], DATE_CHUNK_FORMAT)
+            self.paramDateChunks = self.splitDatesToChunks(self.paramStartDate)
+            _plans = self.planAdAccounts(listings)
+
+            if self.getRequestPlan(_plans).getTotal() <= self.paramRequestBudget:
+                _fitting, _high = (self.paramStartDate, self.paramDateChunks, _plans), _middle - 1
+
+            else:
+                _low = _middle + 1
+
+        if _fitting is None:
+            self.paramStartDate, self.paramDateChunks = _originalStartDate, _originalChunks
+            raise UserException(f"The run would make {_calls} statistics requests, which is more than the budget "
+                                f"of {self.paramRequestBudget} requests, even the last date chunk exceeds it.")
+
+        self.paramStartDate, self.paramDateChunks, _plans = _fitting
+        logging.warning(f"The run would make {_calls} statistics requests, which is more than the budget of "
+                        f"{self.paramRequestBudget} requests. Statistics are downloaded from "
+                        f"{self.paramStartDate.strftime(DATE_CHUNK_FORMAT)} instead of "
+                        f"{_originalStartDate.strftime(DATE_CHUNK_FORMAT)}, {self.getRequestPlan(_plans).getTotal()} "
+                        f"requests will be made. Earlier statistics are not downloaded by later incremental runs.")
+
+        return _plans
+
+    def downloadAdAccounts(self):
+
+        failedAdAccs = {}
+
+        # Ad accounts with the most statistics requests in the previous run are listed first, accounts not seen
+        # before precede them, as their size is not known.
+        _costs = self.stateIn.get(STATE_ACCOUNT_COSTS, {})
+        _adAccs = sorted(self.varAdAccs.items(), key=lambda acc: -_costs.get(acc[0], float('inf')))
+
+        # Statistics requests of all ad accounts share a single pool, so the number of requests in flight
+        # is bounded by the concurrency setting regardless of the number of accounts processed at once.
+        # Each ad account lists all entity types at once, listings never wait for a free thread.
+        with self.client.createExecutor(self.paramConcurrency) as statisticsExecutor, \
+                ThreadPoolExecutor(max_workers=self.paramAccountConcurrency) as accountExecutor, \
+                ThreadPoolExecutor(max_workers=self.paramAccountConcurrency * len(ENTITY_PARENT_KEYS)) \
+                as listingExecutor:
+
+            # Largest requests waiting are sent first, so that no long request is left for the end of the run.
+            scheduler = SnapchatScheduler(statisticsExecutor, self.paramConcurrency, self.estimateRequestCost)
+
+            if self.paramDryRun is False and self.paramRequestBudget == 0:
+                self.runForAdAccounts(accountExecutor, self.downloadAdAccount,
+                                      {adAccId: (adAccIdSet, scheduler, listingExecutor)
+                                       for adAccId, adAccIdSet in _adAccs}, failedAdAccs)
+
+            else:
+                # The number of statistics requests is only known once all ad accounts are listed, statistics
+                # are not requested before that.
+                listings = self.runForAdAccounts(accountExecutor, self.listAdAccount,
+                                                 {adAccId: (listingExecutor,) for adAccId, _ in _adAccs},
+                                                 failedAdAccs)
+                listings = {adAccId: listing for adAccId, listing in listings.items() if listing is not None}
+                plans = self.planAdAccounts(listings)
+                plan = self.getRequestPlan(plans)
+                self.logRequestPlan(plan)
+
+                if self.paramDryRun is True:
+                    logging.info("Dry run, no statistics were requested.")
+
+                else:
+                    plans = self.applyRequestBudget(listings, plans, plan)
+                    self.runForAdAccounts(accountExecutor, self.downloadStatistics,
+                                          {adAccId: (self.varAdAccs[adAccId], listing, scheduler, plans[adAccId])
+                                           for adAccId, listing in listings.items()}, failedAdAccs)
+
+        if failedAdAccs != {} and self.paramCheckpoint is True:
+            # The run finishes successfully, so the downloaded data and the progress are saved; the next run
+            # continues with the remaining work.
+            logging.warning(f"Download failed for {len(failedAdAccs)} out of {len(self.varAdAccs)} ad accounts: "
+                            f"{list(failedAdAccs.keys())}. Progress was saved, the next run will continue "
+                            f"the download.")
+
+        elif failedAdAccs != {}:
+            raise UserException(f"Download failed for {len(failedAdAccs)} out of {len(self.varAdAccs)} ad accounts: "
+                                f"{list(failedAdAccs.keys())}.")
+
+        else:
+            self.stateOut.pop(STATE_CHECKPOINT, None)
+
     def run(self):
 
-        self.query_preview()
+        try:
+            with self.metrics.timer('organizations'):
+                self.getAndWriteOrganizations()
+            logging.info("Organizations obtained.")
+
+            with self.metrics.timer('adaccounts'):
+                self.getAndWriteAdAccounts()
+            logging.info("Ad accounts obtained.")
+
+            if self.paramStatisticsCache is True:
+                self.loadStatisticsCache()
+
+            with self.metrics.timer('download'):
+                self.downloadAdAccounts()
+
+            if self.paramStatisticsCache is True and self.paramDryRun is False:
+                self.saveStatisticsCache()
+
+            # All output must be flushed, before the state marks it as downloaded.
+            with self.metrics.timer('closing'):
+                self.closeWriters()
 
-        self.getAndWriteOrganizations()
-        logging.info("Organizations obtained.")
+            # A dry run downloads no statistics, the state of the previous run is kept as it was.
+            if self.paramDryRun is True:
+                self.write_state_file(self.stateIn)
 
-        self.getAndWriteAdAccounts()
-        logging.info("Ad accounts obtained.")
+            else:
+                self.updateStatisticsLatency()
+                self.write_state_file(self.stateOut)
 
-        for adAccId, adAccIdSet in self.varAdAccs.items():
+        finally:
+            self.closeWriters()
+            self.client.close()
+            self.reportMetrics()
 
-            logging.info(f"Starting download for ad account {adAccId}.")
+    def updateStatisticsLatency(self):
 
-            allStatObjects = []
-            dates = self.normalizeTime(adAccIdSet['timezone'])
+        # Kept for run time estimates of later request plans; runs without statistics requests keep the last value.
+        _latency = SnapchatRequestPlan.getMedianLatency(self.metrics.getSummary())
 
-            logging.debug(dates)
+        if _latency is not None:
+            self.stateOut[STATE_STATISTICS_LATENCY] = round(_latency, 4)
 
-            allStatObjects += self.getAndWriteCampaigns(adAccId)
-            allStatObjects += self.getAndWriteAdSquads(adAccId)
-            allStatObjects += self.getAndWriteAds(adAccId)
-            self.getAndWriteCreatives(adAccId)
+    def reportMetrics(self):
 
-            for obj, end in allStatObjects:
+        self.metrics.logSummary()
 
-                for dr in dates:
+        if self.paramWriteMetrics is True:
+            os.makedirs(self.files_out_path, exist_ok=True)
+            _path = os.path.join(self.files_out_path, METRICS_FILE_NAME)
+            self.metrics.writeSummary(_path)
+            createFileManifest(_path, ['snapchat', 'metrics'])
 
-                    _measures = self.client.getStatistics(end, obj, ','.join(self.paramQuery), self.paramGranularity,
-                                                          dr['start_date'], dr['end_date'], self.paramWindowSwipe,
-                                                          self.paramWindowView)
+    def closeWriters(self):
 
-                    self.writerStatistics.writerow(_measures)
+        for writer in [self.writerOrganizations, self.writerAdaccounts, self.writerCampaigns, self.writerAdsquads,
+                       self.writerCreatives, self.writerAds]:
+            writer.close()
 
-            logging.info(f"Finished download for ad account {adAccId}.")
+        if self.paramObjects != [] and self.paramDryRun is False:
+            self.writerStatistics.close()
 
     @sync_action("list_organizations")
     def query_preview(self):
-        orgs = self.client.getOrganizations()
+        # A single request needs neither the asynchronous client, nor the rate limit of the run.
+        client = SnapchatClient(self.varRefreshToken, self.varAppKey, self.varAppSecret, metrics=self.metrics)
+        orgs = client.getOrganizations()
         return [SelectElement(value=org["id"], label=f'{org["name"]} ({org["id"]})') for org in orgs]
 
 
@@ -284,7 +1305,7 @@ if __name__ == "__main__":
         comp = SnapchatComponent()
         # this triggers the run method by default and is controlled by the configuration.action parameter
         comp.execute_action()
-    except UserException as exc:
+    except (UserException, SnapchatClientException) as exc:
         logging.exception(exc)
         exit(1)
     except Exception as exc:
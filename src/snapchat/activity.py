@@ -0,0 +1,92 @@
+import datetime
+import logging
+import threading
+
+
+class SnapchatActivityIndex:
+
+    def __init__(self, paddingDays=0):
+
+        self.paramPadding = datetime.timedelta(days=paddingDays)
+        self._entities = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _parseTime(value):
+
+        if not value:
+            return None
+
+        try:
+            parsedTime = datetime.datetime.fromisoformat(value)
+
+        except (TypeError, ValueError):
+            logging.warning(f"Could not parse time {value}, the object is considered active for the whole period.")
+            return None
+
+        # Times without an offset are in UTC, all of them must be comparable with timezone aware date chunks.
+        if parsedTime.tzinfo is None:
+            return parsedTime.replace(tzinfo=datetime.timezone.utc)
+
+        else:
+            return parsedTime.astimezone(datetime.timezone.utc)
+
+    def add(self, listOfEntities, parentKey=None):
+
+        for entity in listOfEntities:
+
+            # Nothing can be delivered before an entity was created, nor before its start time.
+            _starts = [t for t in [self._parseTime(entity.get('start_time')),
+                                   self._parseTime(entity.get('created_at'))] if t is not None]
+            _start = max(_starts) if _starts != [] else None
+            _end = self._parseTime(entity.get('end_time'))
+            _parentId = entity.get(parentKey) if parentKey is not None else None
+
+            with self._lock:
+                self._entities[entity['id']] = (_start, _end, _parentId)
+
+    def getActivePeriod(self, entityId):
+
+        _start, _end, _parentId = self._entities.get(entityId, (None, None, None))
+
+        if _parentId is not None:
+
+            _parentStart, _parentEnd = self.getActivePeriod(_parentId)
+
+            if _parentStart is not None:
+                _start = _parentStart if _start is None else max(_start, _parentStart)
+
+            if _parentEnd is not None:
+                _end = _parentEnd if _end is None else min(_end, _parentEnd)
+
+        return _start, _end
+
+    def getActiveRange(self, entityIds):
+
+        # Period, in which any of the entities may have delivered, including the attribution window.
+        _periods = [self.getActivePeriod(entityId) for entityId in entityIds]
+
+        if _periods == []:
+            return None, None
+
+        _starts = [_start for _start, _ in _periods]
+        _ends = [_end for _, _end in _periods]
+
+        _rangeStart = None if None in _starts else min(_starts)
+        _rangeEnd = None if None in _ends else max(_ends) + self.paramPadding
+
+        return _rangeStart, _rangeEnd
+
+    def isActive(self, entityId, startTime, endTime):
+
+        _start, _end = self.getActivePeriod(entityId)
+
+        if _start is not None and _start >= endTime:
+            return False
+
+        # Conversions are attributed to an entity for the length of attribution window after it ended.
+        elif _end is not None and _end + self.paramPadding <= startTime:
+            return False
+
+        else:
+            return True
@@ -0,0 +1,375 @@
+import asyncio
+import os
+import threading
+import time
+from json.decoder import JSONDecodeError
+
+import httpx
+from keboola.http_client import AsyncHttpClient
+
+from snapchat.client import (ACCESS_TOKEN_EXPIRATION, BASE_URL, PAGINATION_LIMIT, REFRESH_URL, SnapchatApiBase,
+                             SnapchatClientException)
+from snapchat.cache import SnapchatResponseCache
+from snapchat.metrics import SnapchatMetrics
+from snapchat.ratelimit import SnapchatRateLimiter
+
+MAX_CONNECTIONS = 100
+
+
+class AsyncSnapchatClient(SnapchatApiBase, AsyncHttpClient):
+
+    def __init__(self, refreshToken, clientId, clientSecret, rateLimiter=None, maxConnections=MAX_CONNECTIONS,
+                 metrics=None, responseCache=None):
+
+        self.paramRefreshToken = refreshToken
+        self.paramClientId = clientId
+        self.paramClientSecret = clientSecret
+        self.rateLimiter = rateLimiter if rateLimiter is not None else SnapchatRateLimiter()
+        self.metrics = metrics if metrics is not None else SnapchatMetrics()
+        self.responseCache = responseCache if responseCache is not None else SnapchatResponseCache()
+
+        self.paramMaxConnections = maxConnections
+
+        # Rate limited requests are retried in _requestWithRetries, paced by the rate limiter.
+        super().__init__(base_url=BASE_URL, retry_status_codes=[500, 502, 503, 504])
+        self._tokenLock = asyncio.Lock()
+        self.varAccessTokenCreated = 0
+
+    async def openConnectionPool(self):
+
+        # All requests of the client share a single connection pool, which must be large enough for all requests
+        # in flight, otherwise they queue for a connection. The client created by the base class with the default
+        # limits of httpx is closed, before it is replaced.
+        await self.client.aclose()
+        self.client = httpx.AsyncClient(timeout=self.timeout, verify=self.verify_ssl, headers=self.default_headers,
+                                        auth=self.auth,
+                                        limits=httpx.Limits(max_connections=self.paramMaxConnections,
+                                                            max_keepalive_connections=self.paramMaxConnections))
+
+    async def _requestRaw(self, method, url, **kwargs):
+
+        cacheKey = self._getCacheKey(method, url, kwargs)
+
+        if cacheKey is None:
+            return await self._requestWithRetries(method, url, **kwargs)
+
+        response, isCached = await self.responseCache.getOrRequestAsync(
+            cacheKey, lambda: self._requestWithRetries(method, url, **kwargs))
+
+        if isCached is True:
+            self.metrics.recordCacheHit(method, response.url)
+
+        return response
+
+    async def _requestWithRetries(self, method, url, **kwargs):
+
+        attempt = 0
+
+        while True:
+
+            reservation = await self.rateLimiter.acquireAsync()
+            start = time.perf_counter()
+
+            try:
+                response = await self._request(method, url, is_absolute_path=True, **kwargs)
+
+            # Errors are reported with the response of the API, same as in the synchronous client.
+            except httpx.HTTPStatusError as e:
+                response = e.response
+
+            self._recordRequest(method, response, time.perf_counter() - start, min(attempt, 1))
+            self.rateLimiter.update(response.status_code, response.headers, reservation)
+
+            if not self._isRateLimitRetried(response, attempt):
+                return response
+
+            attempt += 1
+
+    @staticmethod
+    def _parseJson(response):
+
+        try:
+            return response.status_code, response.json()
+        except JSONDecodeError as json_err:
+            raise SnapchatClientException(f" Failed to parse json from : {response}") from json_err
+
+    async def refreshAccessToken(self):
+
+        reqRefresh = await self._requestRaw('POST', REFRESH_URL, params=self._getRefreshParameters(),
+                                            ignore_auth=True)
+        self._setAccessToken(*self._parseJson(reqRefresh))
+
+    async def _checkAndRefreshAccessToken(self):
+
+        if int(time.time() - self.varAccessTokenCreated) >= ACCESS_TOKEN_EXPIRATION:
+            async with self._tokenLock:
+                if int(time.time() - self.varAccessTokenCreated) >= ACCESS_TOKEN_EXPIRATION:
+                    await self.refreshAccessToken()
+
+    async def getOrganizations(self):
+
+        await self._checkAndRefreshAccessToken()
+
+        reqOrgs = await self._requestRaw('GET', os.path.join(self.base_url, 'me/organizations'))
+        return self._parseOrganizations(*self._parseJson(reqOrgs))
+
+    async def _iterPaginatedRequest(self, endpointPath, returnKey):
+
+        cursor = None
+        moreRecords = True
+
+        while moreRecords is True:
+
+            await self._checkAndRefreshAccessToken()
+
+            paramsPagination = {'limit': PAGINATION_LIMIT}
+
+            if cursor is not None:
+                paramsPagination['cursor'] = cursor
+
+            reqPagination = await self._requestRaw('GET', os.path.join(self.base_url, endpointPath),
+                                                   params=paramsPagination)
+            page, nextPageCursor = self._parsePage(returnKey, reqPagination.url, *self._parseJson(reqPagination))
+            self.metrics.recordRows('GET', reqPagination.url, len(page))
+
+            yield page
+
+            if nextPageCursor is None:
+                moreRecords = False
+            else:
+                cursor = nextPageCursor
+
+    async def _getPaginatedRequest(self, endpointPath, returnKey):
+
+        results = []
+
+        async for page in self._iterPaginatedRequest(endpointPath, returnKey):
+            results += page
+
+        return results
+
+    def iterAdAccounts(self, organizationId):
+
+        return self._iterPaginatedRequest(f'organizations/{organizationId}/adaccounts', 'adaccount')
+
+    def iterCampaignsForAdAccount(self, adAccountId):
+
+        return self._iterPaginatedRequest(f'adaccounts/{adAccountId}/campaigns', 'campaign')
+
+    def iterAdSquadsForAdAccount(self, adAccountId):
+
+        return self._iterPaginatedRequest(f'adaccounts/{adAccountId}/adsquads', 'adsquad')
+
+    def iterAdsForAdAccount(self, adAccountId):
+
+        return self._iterPaginatedRequest(f'adaccounts/{adAccountId}/ads', 'ad')
+
+    def iterCreativesForAdAccount(self, adAccountId):
+
+        return self._iterPaginatedRequest(f'adaccounts/{adAccountId}/creatives', 'creative')
+
+    async def getAdAccounts(self, organizationId):
+
+        return await self._getPaginatedRequest(f'organizations/{organizationId}/adaccounts', 'adaccount')
+
+    async def getCampaignsForAdAccount(self, adAccountId):
+
+        return await self._getPaginatedRequest(f'adaccounts/{adAccountId}/campaigns', 'campaign')
+
+    async def getAdSquadsForAdAccount(self, adAccountId):
+
+        return await self._getPaginatedRequest(f'adaccounts/{adAccountId}/adsquads', 'adsquad')
+
+    async def getAdsForAdAccount(self, adAccountId):
+
+        return await self._getPaginatedRequest(f'adaccounts/{adAccountId}/ads', 'ad')
+
+    async def getCreativesForAdAccount(self, adAccountId):
+
+        return await self._getPaginatedRequest(f'adaccounts/{adAccountId}/creatives', 'creative')
+
+    async def getStatistics(self, endpoint, endpointId, fields, granularity, startTime, endTime, windowSwipe,
+                            windowView, breakdown=None):
+
+        await self._checkAndRefreshAccessToken()
+
+        urlStatistics = os.path.join(self.base_url, endpoint, endpointId, 'stats')
+        paramsStatistics = self._getStatisticsParameters(fields, granularity, startTime, endTime, windowSwipe,
+                                                         windowView, breakdown)
+
+        reqStatistics = await self._requestRaw('GET', urlStatistics, params=paramsStatistics)
+        statistics = self._parseStatistics(endpoint, endpointId, breakdown, *self._parseJson(reqStatistics))
+        self.metrics.recordRows('GET', reqStatistics.url, len(statistics))
+
+        return statistics
+
+
+class SnapchatAsyncExecutor:
+
+    def __init__(self, client, loop, maxConcurrency):
+
+        self.client = client
+        self.loop = loop
+        self.paramMaxConcurrency = maxConcurrency
+        self._semaphore = None
+        self._futures = set()
+        self._cancelled = False
+
+    async def _runBounded(self, coroutineFunction, *args):
+
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.paramMaxConcurrency)
+
+        async with self._semaphore:
+
+            # Futures are cancelled from another thread one by one, a queued request may get its turn before
+            # its own cancellation arrives.
+            if self._cancelled is True:
+                raise asyncio.CancelledError()
+
+            return await coroutineFunction(*args)
+
+    def _submit(self, coroutineFunction, *args):
+
+        # Coroutines are awaited on the event loop of the client, so the number of requests in flight
+        # is not limited by number of threads.
+        future = asyncio.run_coroutine_threadsafe(self._runBounded(coroutineFunction, *args), self.loop)
+
+        self._futures.add(future)
+        future.add_done_callback(self._futures.discard)
+
+        return future
+
+    def submitStatistics(self, *args):
+
+        return self._submit(self.client.getStatistics, *args)
+
+    def shutdown(self, wait=True, cancel_futures=False):
+
+        self._cancelled = self._cancelled or cancel_futures
+
+        for future in list(self._futures):
+
+            if cancel_futures is True:
+                future.cancel()
+
+            elif wait is True:
+                try:
+                    future.result()
+                except BaseException:
+                    pass
+
+    def __enter__(self):
+
+        return self
+
+    def __exit__(self, *args):
+
+        self.shutdown(wait=True)
+        return False
+
+
+class SnapchatAsyncClientAdapter:
+
+    def __init__(self, refreshToken, clientId, clientSecret, rateLimiter=None, maxConnections=MAX_CONNECTIONS,
+                 metrics=None):
+
+        # The asynchronous client runs on its own event loop in a background thread, while its methods are exposed
+        # synchronously with the same interface as SnapchatClient.
+        self.loop = asyncio.new_event_loop()
+        self._loopThread = threading.Thread(target=self.loop.run_forever, name='snapchat-async-client', daemon=True)
+        self._loopThread.start()
+
+        self.client = self._run(self._createClient(refreshToken, clientId, clientSecret, rateLimiter,
+                                                   maxConnections, metrics))
+        self.metrics = self.client.metrics
+
+    @staticmethod
+    async def _createClient(refreshToken, clientId, clientSecret, rateLimiter, maxConnections, metrics):
+
+        client = AsyncSnapchatClient(refreshToken, clientId, clientSecret, rateLimiter, maxConnections, metrics)
+        await client.openConnectionPool()
+        await client.refreshAccessToken()
+
+        return client
+
+    def _run(self, coroutine):
+
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def _iterate(self, asyncIterator):
+
+        async def _next():
+            try:
+                return True, await asyncIterator.__anext__()
+            except StopAsyncIteration:
+                return False, None
+
+        while True:
+
+            hasNext, page = self._run(_next())
+
+            if hasNext is False:
+                return
+
+            yield page
+
+    def createExecutor(self, maxConcurrency):
+
+        return SnapchatAsyncExecutor(self.client, self.loop, maxConcurrency)
+
+    def close(self):
+
+        self._run(self.client.close())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._loopThread.join()
+
+    def getOrganizations(self):
+
+        return self._run(self.client.getOrganizations())
+
+    def iterAdAccounts(self, organizationId):
+
+        return self._iterate(self.client.iterAdAccounts(organizationId))
+
+    def iterCampaignsForAdAccount(self, adAccountId):
+
+        return self._iterate(self.client.iterCampaignsForAdAccount(adAccountId))
+
+    def iterAdSquadsForAdAccount(self, adAccountId):
+
+        return self._iterate(self.client.iterAdSquadsForAdAccount(adAccountId))
+
+    def iterAdsForAdAccount(self, adAccountId):
+
+        return self._iterate(self.client.iterAdsForAdAccount(adAccountId))
+
+    def iterCreativesForAdAccount(self, adAccountId):
+
+        return self._iterate(self.client.iterCreativesForAdAccount(adAccountId))
+
+    def getAdAccounts(self, organizationId):
+
+        return self._run(self.client.getAdAccounts(organizationId))
+
+    def getCampaignsForAdAccount(self, adAccountId):
+
+        return self._run(self.client.getCampaignsForAdAccount(adAccountId))
+
+    def getAdSquadsForAdAccount(self, adAccountId):
+
+        return self._run(self.client.getAdSquadsForAdAccount(adAccountId))
+
+    def getAdsForAdAccount(self, adAccountId):
+
+        return self._run(self.client.getAdsForAdAccount(adAccountId))
+
+    def getCreativesForAdAccount(self, adAccountId):
+
+        return self._run(self.client.getCreativesForAdAccount(adAccountId))
+
+    def getStatistics(self, endpoint, endpointId, fields, granularity, startTime, endTime, windowSwipe, windowView,
+                      breakdown=None):
+
+        return self._run(self.client.getStatistics(endpoint, endpointId, fields, granularity, startTime, endTime,
+                                                   windowSwipe, windowView, breakdown))
@@ -0,0 +1,294 @@
+import asyncio
+import collections
+import datetime
+import gzip
+import json
+import logging
+import threading
+
+RESPONSE_CACHE_SIZE = 128
+RESPONSE_CACHE_BYTES = 64 * 2**20
+
+STATISTICS_CACHE_VERSION = 1
+STATISTICS_CACHE_RETENTION_DAYS = 90
+GZIP_COMPRESS_LEVEL = 6
+
+# Attributes of statistics, which describe the request rather than the object.
+STATISTICS_HEADER_EXCLUDED = ['timeseries', 'start_time', 'end_time', 'finalized_data_end_time']
+
+
+class SnapchatResponseCache:
+
+    def __init__(self, maxSize=RESPONSE_CACHE_SIZE, maxBytes=RESPONSE_CACHE_BYTES):
+
+        self.paramMaxSize = maxSize
+        self.paramMaxBytes = maxBytes
+
+        self._responses = collections.OrderedDict()
+        self._bytes = 0
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def getKey(method, url, params=None):
+
+        # Parameters without a value are not sent, their order does not change the response.
+        _params = tuple(sorted([(str(k), str(v)) for k, v in (params or {}).items() if v is not None]))
+        return method.upper(), str(url).rstrip('/'), _params
+
+    def get(self, key):
+
+        with self._lock:
+
+            if key not in self._responses:
+                return None
+
+            self._responses.move_to_end(key)
+            return self._responses[key]
+
+    def put(self, key, response):
+
+        # Only successful responses are kept, errors are requested again.
+        size = len(response.content)
+
+        if response.status_code != 200 or size > self.paramMaxBytes:
+            return
+
+        with self._lock:
+
+            if key in self._responses:
+                self._bytes -= len(self._responses.pop(key).content)
+
+            self._responses[key] = response
+            self._bytes += size
+
+            while len(self._responses) > self.paramMaxSize or self._bytes > self.paramMaxBytes:
+                _, evicted = self._responses.popitem(last=False)
+                self._bytes -= len(evicted.content)
+
+    def _reserve(self, key, event):
+
+        # Returns a cached response, an event of the same request in flight, or None if the caller should request it.
+        with self._lock:
+
+            if key in self._responses:
+                self._responses.move_to_end(key)
+                return self._responses[key]
+
+            elif key in self._pending:
+                return self._pending[key]
+
+            self._pending[key] = event
+            return None
+
+    def _release(self, key):
+
+        with self._lock:
+            self._pending.pop(key).set()
+
+    def getOrRequest(self, key, requestFunction):
+
+        while True:
+
+            cached = self._reserve(key, threading.Event())
+
+            if cached is None:
+                break
+
+            elif isinstance(cached, threading.Event):
+                # Identical request is in flight, its response is used once it completes.
+                cached.wait()
+
+            else:
+                return cached, True
+
+        try:
+            response = requestFunction()
+            self.put(key, response)
+            return response, False
+
+        finally:
+            self._release(key)
+
+    async def getOrRequestAsync(self, key, requestFunction):
+
+        while True:
+
+            cached = self._reserve(key, asyncio.Event())
+
+            if cached is None:
+                break
+
+            elif isinstance(cached, asyncio.Event):
+                await cached.wait()
+
+            else:
+                return cached, True
+
+        try:
+            response = await requestFunction()
+            self.put(key, response)
+            return response, False
+
+        finally:
+            self._release(key)
+
+
+class SnapchatStatisticsCache:
+
+    def __init__(self, retentionDays=STATISTICS_CACHE_RETENTION_DAYS):
+
+        self.paramRetentionDays = retentionDays
+        self.varHits = 0
+
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def getKey(endpoint, endpointId, fields, granularity, windowSwipe, windowView, breakdown=None):
+
+        _fields = ','.join(sorted(fields.split(',')))
+        return '/'.join([endpoint, endpointId, _fields, granularity, windowSwipe, windowView, str(breakdown)])
+
+    @staticmethod
+    def _parseTime(value):
+
+        return datetime.datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+    @classmethod
+    def _mergeIntervals(cls, intervals):
+
+        merged = []
+
+        for start, end in sorted(intervals, key=lambda i: cls._parseTime(i[0])):
+
+            if merged != [] and cls._parseTime(start) <= cls._parseTime(merged[-1][1]):
+                if cls._parseTime(end) > cls._parseTime(merged[-1][1]):
+                    merged[-1][1] = end
+
+            else:
+                merged += [[start, end]]
+
+        return merged
+
+    def _getCoveredEnd(self, entry, start):
+
+        coveredEnd = None
+
+        for _start, _end in entry['covered']:
+            if self._parseTime(_start) <= start < self._parseTime(_end):
+                coveredEnd = _end
+
+        return coveredEnd
+
+    def isCached(self, key, startTime, endTime):
+
+        # Whether the whole range would be read from the cache, without marking the entry as used.
+        with self._lock:
+
+            entry = self._entries.get(key)
+            coveredEnd = self._getCoveredEnd(entry, self._parseTime(startTime)) if entry is not None else None
+
+        return coveredEnd is not None and self._parseTime(coveredEnd) >= self._parseTime(endTime)
+
+    def lookup(self, key, startTime, endTime):
+
+        # Returns statistics cached from the start of the requested range, and the time from which the rest
+        # must be requested; None if the whole range is cached.
+        with self._lock:
+
+            entry = self._entries.get(key)
+
+            if entry is None:
+                return [], startTime
+
+            entry['used_at'] = datetime.date.today().isoformat()
+            start, end = self._parseTime(startTime), self._parseTime(endTime)
+            coveredEnd = self._getCoveredEnd(entry, start)
+
+            if coveredEnd is None:
+                return [], startTime
+
+            _cachedEnd = min(end, self._parseTime(coveredEnd))
+            statistics = [{**stat['header'], 'timeseries': [
+                t for _start, t in sorted(stat['timeseries'].items()) if start <= self._parseTime(_start) < _cachedEnd]}
+                for stat in entry['statistics'].values()]
+
+            self.varHits += 1
+
+        return statistics, None if _cachedEnd >= end else coveredEnd
+
+    @staticmethod
+    def merge(cachedStatistics, statistics):
+
+        # Statistics of an object are joined into one, cached timeseries precede the requested ones.
+        merged = {}
+
+        for stat in cachedStatistics + statistics:
+
+            if stat['id'] not in merged:
+                merged[stat['id']] = {**stat, 'timeseries': list(stat.get('timeseries', []))}
+
+            else:
+                merged[stat['id']]['timeseries'] += stat.get('timeseries', [])
+
+        return list(merged.values())
+
+    def update(self, key, startTime, endTime, statistics, closedBefore):
+
+        # Only periods, which ended before the attribution window and which the API reports as finalized,
+        # do not change any more.
+        _finalized = [self._parseTime(s['finalized_data_end_time']) for s in statistics
+                      if s.get('finalized_data_end_time') is not None]
+        _closedBefore = min([closedBefore] + _finalized)
+        _timeseries = [t for s in statistics for t in s.get('timeseries', [])
+                       if self._parseTime(t['end_time']) <= _closedBefore]
+
+        if self._parseTime(endTime) <= _closedBefore:
+            coveredEnd = endTime
+
+        elif _timeseries != []:
+            coveredEnd = max([t['end_time'] for t in _timeseries], key=self._parseTime)
+
+        else:
+            return
+
+        if self._parseTime(coveredEnd) <= self._parseTime(startTime):
+            return
+
+        with self._lock:
+
+            entry = self._entries.setdefault(key, {'covered': [], 'statistics': {}})
+            entry['used_at'] = datetime.date.today().isoformat()
+            entry['covered'] = self._mergeIntervals(entry['covered'] + [[startTime, coveredEnd]])
+
+            for stat in statistics:
+
+                _stat = entry['statistics'].setdefault(stat['id'], {'timeseries': {}})
+                _stat['header'] = {k: v for k, v in stat.items() if k not in STATISTICS_HEADER_EXCLUDED}
+                _stat['timeseries'].update({t['start_time']: t for t in stat.get('timeseries', [])
+                                            if self._parseTime(t['start_time']) < self._parseTime(coveredEnd)})
+
+    def load(self, path):
+
+        try:
+            with gzip.open(path, 'rt') as cacheFile:
+                _cache = json.load(cacheFile)
+
+            # Cache written by a different version of the component may have a different structure.
+            self._entries = _cache['entries'] if _cache.get('version') == STATISTICS_CACHE_VERSION else {}
+
+        except (OSError, ValueError, KeyError, AttributeError) as e:
+            logging.warning(f"Statistics cache {path} could not be read and is ignored: {e}")
+            self._entries = {}
+
+    def save(self, path):
+
+        # Entries not used for a long time, e.g. of removed ad accounts or of changed settings, are dropped.
+        _usedAfter = (datetime.date.today() - datetime.timedelta(days=self.paramRetentionDays)).isoformat()
+
+        with self._lock:
+            entries = {k: e for k, e in self._entries.items() if e.get('used_at', _usedAfter) >= _usedAfter}
+
+        with gzip.open(path, 'wt', compresslevel=GZIP_COMPRESS_LEVEL) as cacheFile:
+            json.dump({'version': STATISTICS_CACHE_VERSION, 'entries': entries}, cacheFile)
@@ -1,12 +1,20 @@
 import logging
 import os
-import sys
+import requests
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from keboola.http_client import HttpClient
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
 from urllib.parse import urlparse, parse_qs
 from json.decoder import JSONDecodeError
+from snapchat.cache import SnapchatResponseCache
+from snapchat.metrics import SnapchatMetrics
+from snapchat.ratelimit import MAX_RATE_LIMIT_RETRIES, SnapchatRateLimiter
 
 BASE_URL = 'https://adsapi.snapchat.com/v1/'
+REFRESH_URL = 'https://accounts.snapchat.com/login/oauth2/access_token'
 ACCESS_TOKEN_EXPIRATION = 1700
 PAGINATION_LIMIT = 500
 
@@ -15,29 +23,38 @@ class SnapchatClientException(Exception):
     pass
 
 
-class SnapchatClient(HttpClient):
+class SnapchatApiBase:
 
-    def __init__(self, refreshToken, clientId, clientSecret):
+    def _getCacheKey(self, method, url, kwargs):
 
-        self.paramRefreshToken = refreshToken
-        self.paramClientId = clientId
-        self.paramClientSecret = clientSecret
+        # Only listings and statistics are cached, requests refreshing the access token are always sent.
+        if method.upper() != 'GET':
+            return None
 
-        super().__init__(base_url=BASE_URL, status_forcelist=(429, 500, 502, 503, 504))
-        self.refreshAccessToken()
+        return self.responseCache.getKey(method, url, kwargs.get('params'))
 
-    def refreshAccessToken(self):
+    @staticmethod
+    def _isRateLimitRetried(response, attempt):
+
+        # Once the retries run out, rate limited requests are still retried, as long as the API tells when.
+        return response.status_code == 429 and (attempt < MAX_RATE_LIMIT_RETRIES
+                                                or 'Retry-After' in response.headers)
+
+    def _recordRequest(self, method, response, latency, retries=0):
+
+        self.metrics.recordRequest(method, response.url, response.status_code, latency, len(response.content),
+                                   retries)
+
+    def _getRefreshParameters(self):
 
-        urlRefresh = 'https://accounts.snapchat.com/login/oauth2/access_token'
-        paramsRefresh = {
+        return {
             'code': self.paramRefreshToken,
             'client_id': self.paramClientId,
             'client_secret': self.paramClientSecret,
             'grant_type': 'refresh_token'
         }
 
-        reqRefresh = self.post_raw(urlRefresh, params=paramsRefresh)
-        scRefresh, jsRefresh = reqRefresh.status_code, reqRefresh.json()
+    def _setAccessToken(self, scRefresh, jsRefresh):
 
         if scRefresh == 200:
 
@@ -49,37 +66,211 @@ class SnapchatClient(HttpClient):
 
         else:
 
-            logging.info("Access token could not be refreshed. Received: %s - %s" % (scRefresh, jsRefresh))
-            sys.exit(1)
+            raise SnapchatClientException("Access token could not be refreshed. Received: %s - %s" %
+                                          (scRefresh, jsRefresh))
 
-    def _checkAndRefreshAccessToken(self):
+    @staticmethod
+    def _parseOrganizations(scOrgs, jsOrgs):
 
-        currentTime = time.time()
-        timeDiff = int(currentTime - self.varAccessTokenCreated)
+        if scOrgs == 200:
+
+            logging.info("Organizations obtained successfully.")
+            return [obj['organization'] for obj in jsOrgs['organizations']]
 
-        if timeDiff >= ACCESS_TOKEN_EXPIRATION:
-            self.refreshAccessToken()
         else:
-            pass
 
-    def getOrganizations(self):
+            raise SnapchatClientException("Could not obtain organizations. Received: %s - %s." % (scOrgs, jsOrgs))
 
-        self._checkAndRefreshAccessToken()
+    @staticmethod
+    def _parseCursorParameter(urlToParse):
 
-        urlOrgs = os.path.join(self.base_url, 'me/organizations')
+        if urlToParse is None:
+            return None
+        else:
+            parsedUrl = urlparse(urlToParse)
+            cursor = parse_qs(parsedUrl.query).get('cursor', [None])[0]
+            return cursor
 
-        reqOrgs = self.get_raw(urlOrgs)
-        scOrgs, jsOrgs = reqOrgs.status_code, reqOrgs.json()
+    @classmethod
+    def _parsePage(cls, returnKey, urlPagination, scPagination, jsPagination):
 
-        if scOrgs == 200:
+        if scPagination == 200:
 
-            logging.info("Organizations obtained successfully.")
-            return [obj['organization'] for obj in jsOrgs['organizations']]
+            nextPageUrl = jsPagination.get('paging', {}).get('next_link', None)
+            return [obj[returnKey] for obj in jsPagination[returnKey + 's']], cls._parseCursorParameter(nextPageUrl)
+
+        else:
+
+            raise SnapchatClientException("Could not obtain %s. Request to %s failed. Received: %s - %s." %
+                                          (returnKey, urlPagination, scPagination, jsPagination))
+
+    @staticmethod
+    def _flattenBreakdownStatistics(listOfStatistics, breakdown):
+
+        flatStatistics = []
+
+        for stat in listOfStatistics:
+
+            parentAttributes = {
+                'granularity': stat.get('granularity'),
+                'swipe_up_attribution_window': stat.get('swipe_up_attribution_window'),
+                'view_attribution_window': stat.get('view_attribution_window')
+            }
+
+            for childStat in stat.get('breakdown_stats', {}).get(breakdown, []):
+                flatStatistics += [{**parentAttributes, **childStat}]
+
+        return flatStatistics
+
+    @staticmethod
+    def _getStatisticsParameters(fields, granularity, startTime, endTime, windowSwipe, windowView, breakdown=None):
+
+        paramsStatistics = {
+            'fields': fields,
+            'granularity': granularity,
+            'start_time': startTime,
+            'end_time': endTime,
+            'swipe_up_attribution_window': windowSwipe,
+            'view_attribution_window': windowView
+        }
+
+        if breakdown is not None:
+            paramsStatistics['breakdown'] = breakdown
+
+        return paramsStatistics
+
+    @classmethod
+    def _parseStatistics(cls, endpoint, endpointId, breakdown, scStatistics, jsStatistics):
+
+        if scStatistics == 200:
+
+            statistics = [x['timeseries_stat'] for x in jsStatistics['timeseries_stats']]
+
+            if breakdown is None:
+                return statistics
+
+            else:
+                return cls._flattenBreakdownStatistics(statistics, breakdown)
 
         else:
 
-            logging.error("Could not obtain organizations. Received: %s - %s." % (scOrgs, jsOrgs))
-            sys.exit(1)
+            raise SnapchatClientException(f"Could not obtain statistics for {endpoint}, id: {endpointId}. "
+                                          f"Received: {scStatistics} - {jsStatistics}.")
+
+
+class SnapchatExecutor(ThreadPoolExecutor):
+
+    def __init__(self, client, maxConcurrency):
+
+        super().__init__(max_workers=maxConcurrency)
+        self.client = client
+
+    def submitStatistics(self, *args):
+
+        return self.submit(self.client.getStatistics, *args)
+
+
+class SnapchatClient(SnapchatApiBase, HttpClient):
+
+    def __init__(self, refreshToken, clientId, clientSecret, rateLimiter=None, metrics=None, responseCache=None):
+
+        self.paramRefreshToken = refreshToken
+        self.paramClientId = clientId
+        self.paramClientSecret = clientSecret
+        self.rateLimiter = rateLimiter if rateLimiter is not None else SnapchatRateLimiter()
+        self.metrics = metrics if metrics is not None else SnapchatMetrics()
+        self.responseCache = responseCache if responseCache is not None else SnapchatResponseCache()
+
+        # Rate limited requests are retried in _requestWithRetries, paced by the rate limiter.
+        super().__init__(base_url=BASE_URL, status_forcelist=(500, 502, 503, 504))
+        self._tokenLock = threading.Lock()
+        self.refreshAccessToken()
+
+    def _requests_retry_session(self, session=None):
+
+        # urllib3 would retry rate limited responses with Retry-After on its own, hiding them from the rate limiter.
+        session = session or requests.Session()
+        retry = Retry(total=self.max_retries, read=self.max_retries, connect=self.max_retries,
+                      backoff_factor=self.backoff_factor, status_forcelist=self.status_forcelist,
+                      allowed_methods=self.allowed_methods, respect_retry_after_header=False)
+        adapter = HTTPAdapter(max_retries=retry)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+
+        return session
+
+    def _request_raw(self, method, endpoint_path=None, **kwargs):
+
+        cacheKey = self._getCacheKey(method, endpoint_path, kwargs)
+
+        if cacheKey is None:
+            return self._requestWithRetries(method, endpoint_path, **kwargs)
+
+        # Identical requests within a run are served from memory, or wait for the same request in flight.
+        response, isCached = self.responseCache.getOrRequest(
+            cacheKey, lambda: self._requestWithRetries(method, endpoint_path, **kwargs))
+
+        if isCached is True:
+            self.metrics.recordCacheHit(method, response.url)
+
+        return response
+
+    def _requestWithRetries(self, method, endpoint_path=None, **kwargs):
+
+        attempt = 0
+
+        while True:
+
+            reservation = self.rateLimiter.acquire()
+
+            start = time.perf_counter()
+            response = super()._request_raw(method, endpoint_path, **kwargs)
+
+            # Server errors are retried by urllib3 within a single call, their count is kept with the response.
+            retries = getattr(getattr(response.raw, 'retries', None), 'history', ())
+            self._recordRequest(method, response, time.perf_counter() - start, len(retries) + min(attempt, 1))
+            self.rateLimiter.update(response.status_code, response.headers, reservation)
+
+            if not self._isRateLimitRetried(response, attempt):
+                return response
+
+            attempt += 1
+
+    def refreshAccessToken(self):
+
+        reqRefresh = self.post_raw(REFRESH_URL, params=self._getRefreshParameters())
+        self._setAccessToken(reqRefresh.status_code, reqRefresh.json())
+
+    def _isAccessTokenExpired(self):
+
+        timeDiff = int(time.time() - self.varAccessTokenCreated)
+        return timeDiff >= ACCESS_TOKEN_EXPIRATION
+
+    def _checkAndRefreshAccessToken(self):
+
+        # Statistics are requested from several threads at once, only one of them should refresh the token.
+        if self._isAccessTokenExpired():
+            with self._tokenLock:
+                if self._isAccessTokenExpired():
+                    self.refreshAccessToken()
+
+    def createExecutor(self, maxConcurrency):
+
+        return SnapchatExecutor(self, maxConcurrency)
+
+    def close(self):
+
+        # Each request uses its own session, there are no connections to be released.
+        pass
+
+    def getOrganizations(self):
+
+        self._checkAndRefreshAccessToken()
+
+        urlOrgs = os.path.join(self.base_url, 'me/organizations')
+
+        reqOrgs = self.get_raw(urlOrgs)
+        return self._parseOrganizations(reqOrgs.status_code, reqOrgs.json())
 
     def _npGetAdAccounts(self, organizationId, cursor=None):
 
@@ -94,16 +285,6 @@ class SnapchatClient(HttpClient):
 
         return reqAdAccs
 
-    @staticmethod
-    def _parseCursorParameter(urlToParse):
-
-        if urlToParse is None:
-            return None
-        else:
-            parsedUrl = urlparse(urlToParse)
-            cursor = parse_qs(parsedUrl.query).get('cursor', [None])[0]
-            return cursor
-
     def _npGetAdsForAdAccount(self, adAccountId, cursor=None):
 
         self._checkAndRefreshAccessToken()
@@ -159,108 +340,86 @@ class SnapchatClient(HttpClient):
 
         return reqCreatives
 
-    def _getPaginatedRequest(self, evalExpression, mappingObj, returnKey):
-
-        if 'cursor' not in mappingObj:
-            mappingObj['cursor'] = None
+    def _iterPaginatedRequest(self, pageFunction, pageArguments, returnKey):
 
+        cursor = None
         moreRecords = True
-        results = []
+
         while moreRecords is True:
 
-            reqPagination = eval(evalExpression, None, mappingObj)
+            reqPagination = pageFunction(*pageArguments, cursor)
             try:
                 scPagination, jsPagination = reqPagination.status_code, reqPagination.json()
             except JSONDecodeError as json_err:
                 raise SnapchatClientException(f" Failed to parse json from : {reqPagination}") from json_err
 
-            if scPagination == 200:
-
-                results += [obj[returnKey] for obj in jsPagination[returnKey + 's']]
-                nextPageUrl = jsPagination.get('paging', {}).get('next_link', None)
-                nextPageCursor = self._parseCursorParameter(nextPageUrl)
+            page, nextPageCursor = self._parsePage(returnKey, reqPagination.url, scPagination, jsPagination)
+            self.metrics.recordRows('GET', reqPagination.url, len(page))
 
-                if nextPageCursor is None:
-                    moreRecords = False
-                else:
-                    mappingObj['cursor'] = nextPageCursor
+            yield page
 
+            if nextPageCursor is None:
+                moreRecords = False
             else:
+                cursor = nextPageCursor
 
-                logging.error("Could not obtain %s. Request to %s failed." % (returnKey, reqPagination.url))
-                logging.error("Received: %s - %s." % (scPagination, jsPagination))
-                sys.exit(1)
+    def _getPaginatedRequest(self, pageFunction, pageArguments, returnKey):
+
+        results = []
+
+        for page in self._iterPaginatedRequest(pageFunction, pageArguments, returnKey):
+            results += page
 
         return results
 
-    def getAdsForAdAccount(self, adAccountId):
+    def iterAdsForAdAccount(self, adAccountId):
 
-        evalAds = 'func(adAccId, cursor)'
-        mapAds = {
-            'adAccId': adAccountId,
-            'func': self._npGetAdsForAdAccount
-        }
-        keyAds = 'ad'
+        return self._iterPaginatedRequest(self._npGetAdsForAdAccount, [adAccountId], 'ad')
 
-        return self._getPaginatedRequest(evalAds, mapAds, keyAds)
+    def iterAdAccounts(self, organizationId):
 
-    def getAdAccounts(self, organizationId):
+        return self._iterPaginatedRequest(self._npGetAdAccounts, [organizationId], 'adaccount')
 
-        evalAdAccs = 'func(orgId, cursor)'
-        mapAdAccs = {
-            'func': self._npGetAdAccounts,
-            'orgId': organizationId
-        }
-        keyAdAccs = 'adaccount'
+    def iterCampaignsForAdAccount(self, adAccountId):
 
-        return self._getPaginatedRequest(evalAdAccs, mapAdAccs, keyAdAccs)
+        return self._iterPaginatedRequest(self._npGetCampaignsForAdAccount, [adAccountId], 'campaign')
 
-    def getCampaignsForAdAccount(self, adAccountId):
+    def iterAdSquadsForAdAccount(self, adAccountId):
 
-        evalCampaigns = 'func(adAccId, cursor)'
-        mapCampaigns = {
-            'adAccId': adAccountId,
-            'func': self._npGetCampaignsForAdAccount
-        }
-        keyCampaigns = 'campaign'
+        return self._iterPaginatedRequest(self._npGetAdSquadsForAdAccount, [adAccountId], 'adsquad')
 
-        return self._getPaginatedRequest(evalCampaigns, mapCampaigns, keyCampaigns)
+    def iterCreativesForAdAccount(self, adAccountId):
 
-    def getAdSquadsForAdAccount(self, adAccountId):
+        return self._iterPaginatedRequest(self._npGetCreativesForAdAccount, [adAccountId], 'creative')
 
-        evalAdSquads = 'func(adAccId, cursor)'
-        mapAdSquads = {
-            'adAccId': adAccountId,
-            'func': self._npGetAdSquadsForAdAccount
-        }
-        keyAdSquads = 'adsquad'
+    def getAdsForAdAccount(self, adAccountId):
 
-        return self._getPaginatedRequest(evalAdSquads, mapAdSquads, keyAdSquads)
+        return self._getPaginatedRequest(self._npGetAdsForAdAccount, [adAccountId], 'ad')
 
-    def getCreativesForAdAccount(self, adAccountId):
+    def getAdAccounts(self, organizationId):
 
-        evalCreatives = 'func(adAccId, cursor)'
-        mapCreatives = {
-            'adAccId': adAccountId,
-            'func': self._npGetCreativesForAdAccount
-        }
-        keyCreatives = 'creative'
+        return self._getPaginatedRequest(self._npGetAdAccounts, [organizationId], 'adaccount')
 
-        return self._getPaginatedRequest(evalCreatives, mapCreatives, keyCreatives)
+    def getCampaignsForAdAccount(self, adAccountId):
+
+        return self._getPaginatedRequest(self._npGetCampaignsForAdAccount, [adAccountId], 'campaign')
+
+    def getAdSquadsForAdAccount(self, adAccountId):
+
+        return self._getPaginatedRequest(self._npGetAdSquadsForAdAccount, [adAccountId], 'adsquad')
 
-    def getStatistics(self, endpoint, endpointId, fields, granularity, startTime, endTime, windowSwipe, windowView):
+    def getCreativesForAdAccount(self, adAccountId):
+
+        return self._getPaginatedRequest(self._npGetCreativesForAdAccount, [adAccountId], 'creative')
+
+    def getStatistics(self, endpoint, endpointId, fields, granularity, startTime, endTime, windowSwipe, windowView,
+                      breakdown=None):
 
         self._checkAndRefreshAccessToken()
 
         urlStatistics = os.path.join(self.base_url, endpoint, endpointId, 'stats')
-        paramsStatistics = {
-            'fields': fields,
-            'granularity': granularity,
-            'start_time': startTime,
-            'end_time': endTime,
-            'swipe_up_attribution_window': windowSwipe,
-            'view_attribution_window': windowView
-        }
+        paramsStatistics = self._getStatisticsParameters(fields, granularity, startTime, endTime, windowSwipe,
+                                                         windowView, breakdown)
 
         try:
             reqStatistics = self.get_raw(urlStatistics, params=paramsStatistics)
@@ -274,12 +433,7 @@ class SnapchatClient(HttpClient):
             logging.error(f"Failed to parse statistics for account. Only got response : {reqStatistics}")
             raise SnapchatClientException(json_error) from JSONDecodeError
 
-        if scStatistics == 200:
-
-            return [x['timeseries_stat'] for x in jsStatistics['timeseries_stats']]
-
-        else:
+        statistics = self._parseStatistics(endpoint, endpointId, breakdown, scStatistics, jsStatistics)
+        self.metrics.recordRows('GET', reqStatistics.url, len(statistics))
 
-            logging.error(f"Could not obtain statistics for {endpoint}, id: {endpointId}.")
-            logging.error(f"Received: {scStatistics} - {jsStatistics}.")
-            sys.exit(1)
+        return statistics
@@ -0,0 +1,123 @@
+import contextlib
+import json
+import logging
+import math
+import threading
+import time
+from urllib.parse import urlparse
+
+# Segments of API paths, which are not identifiers of objects.
+PATH_RESOURCES = {'v1', 'me', 'organizations', 'adaccounts', 'campaigns', 'adsquads', 'ads', 'creatives', 'stats',
+                  'login', 'oauth2', 'access_token'}
+
+
+class SnapchatMetrics:
+
+    def __init__(self):
+
+        self._requests = {}
+        self._phases = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def getEndpointTemplate(url):
+
+        segments = [s for s in urlparse(str(url)).path.split('/') if s != '']
+        return '/'.join([s if s in PATH_RESOURCES else '{id}' for s in segments])
+
+    def _getEndpoint(self, method, url):
+
+        endpoint = f'{method.upper()} {self.getEndpointTemplate(url)}'
+        return self._requests.setdefault(endpoint, {'latencies': [], 'status_codes': {}, 'bytes': 0, 'retries': 0,
+                                                    'rows': 0, 'cache_hits': 0})
+
+    def recordRequest(self, method, url, statusCode, latency, size, retries=0):
+
+        with self._lock:
+
+            _endpoint = self._getEndpoint(method, url)
+            _endpoint['latencies'].append(latency)
+            _endpoint['status_codes'][str(statusCode)] = _endpoint['status_codes'].get(str(statusCode), 0) + 1
+            _endpoint['bytes'] += size
+            _endpoint['retries'] += retries
+
+    def recordRows(self, method, url, rows):
+
+        with self._lock:
+            self._getEndpoint(method, url)['rows'] += rows
+
+    def recordCacheHit(self, method, url):
+
+        with self._lock:
+            self._getEndpoint(method, url)['cache_hits'] += 1
+
+    @contextlib.contextmanager
+    def timer(self, phase):
+
+        start = time.perf_counter()
+
+        try:
+            yield
+
+        finally:
+            duration = time.perf_counter() - start
+
+            with self._lock:
+                _phase = self._phases.setdefault(phase, {'count': 0, 'seconds': 0.0})
+                _phase['count'] += 1
+                _phase['seconds'] += duration
+
+    @staticmethod
+    def _percentile(values, percentile):
+
+        # Nearest-rank percentile of sorted values.
+        return values[max(0, math.ceil(percentile / 100 * len(values)) - 1)]
+
+    def getSummary(self):
+
+        with self._lock:
+
+            endpoints = {}
+
+            for endpoint, _endpoint in sorted(self._requests.items()):
+
+                # Endpoints served only from the cache have no latencies.
+                latencies = sorted(_endpoint['latencies']) or [0.0]
+                endpoints[endpoint] = {
+                    'requests': len(_endpoint['latencies']),
+                    'rate_limited': _endpoint['status_codes'].get('429', 0),
+                    'retries': _endpoint['retries'],
+                    'cache_hits': _endpoint['cache_hits'],
+                    'status_codes': dict(sorted(_endpoint['status_codes'].items())),
+                    'latency_p50': round(self._percentile(latencies, 50), 4),
+                    'latency_p95': round(self._percentile(latencies, 95), 4),
+                    'latency_max': round(latencies[-1], 4),
+                    'bytes': _endpoint['bytes'],
+                    'rows': _endpoint['rows']
+                }
+
+            phases = {phase: {'count': _phase['count'], 'seconds': round(_phase['seconds'], 3)}
+                      for phase, _phase in self._phases.items()}
+
+        return {'endpoints': endpoints, 'phases': phases}
+
+    def logSummary(self):
+
+        summary = self.getSummary()
+
+        for endpoint, stats in summary['endpoints'].items():
+            logging.info(f"{endpoint}: {stats['requests']} requests, {stats['rate_limited']} rate limited, "
+                         f"{stats['retries']} retries, {stats['cache_hits']} served from cache, "
+                         f"p50 {stats['latency_p50']} s, p95 {stats['latency_p95']} s, {stats['bytes']} bytes, "
+                         f"{stats['rows']} rows.")
+
+        # Phases of ad accounts downloaded in parallel overlap, their time is a sum over all ad accounts.
+        for phase, stats in summary['phases'].items():
+            logging.info(f"Phase {phase}: {stats['seconds']} s in {stats['count']} runs.")
+
+        return summary
+
+    def writeSummary(self, path):
+
+        with open(path, 'w') as summaryFile:
+            json.dump(self.getSummary(), summaryFile, indent=2)
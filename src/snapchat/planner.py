@@ -0,0 +1,77 @@
+import collections
+import logging
+
+# Number of ad accounts with the most requests, which are listed in the plan.
+PLAN_LARGEST_ACCOUNTS = 10
+
+
+class SnapchatRequestPlan:
+
+    def __init__(self):
+
+        self.varCalls = collections.Counter()
+
+    def add(self, adAccountId, objectType, granularity, calls=1):
+
+        self.varCalls[(adAccountId, objectType, granularity)] += calls
+
+    def getTotal(self):
+
+        return sum(self.varCalls.values())
+
+    def getCallsBy(self, index):
+
+        calls = collections.Counter()
+
+        for key, count in self.varCalls.items():
+            calls[key[index]] += count
+
+        return calls
+
+    @staticmethod
+    def getMedianLatency(metricsSummary, statistics=True):
+
+        # Median latency of statistics or of listing requests, weighted by the number of requests of each endpoint.
+        _endpoints = [e for name, e in metricsSummary['endpoints'].items()
+                      if name.endswith('/stats') is statistics and not name.endswith('/access_token')
+                      and e['requests'] > 0]
+
+        if _endpoints == []:
+            return None
+
+        return sum([e['latency_p50'] * e['requests'] for e in _endpoints]) / sum([e['requests'] for e in _endpoints])
+
+    @staticmethod
+    def estimateSeconds(calls, latency, concurrency, rateLimit=None):
+
+        _seconds = calls * latency / concurrency
+
+        # Requests can not be sent faster than the rate limit allows, regardless of the concurrency.
+        if rateLimit is not None:
+            _seconds = max(_seconds, calls / rateLimit)
+
+        return _seconds
+
+    def logSummary(self, latency, latencySource, concurrency, rateLimit=None):
+
+        _total = self.getTotal()
+        logging.info(f"Planned {_total} statistics requests.")
+
+        _callsByType = collections.Counter()
+
+        for (_, objectType, granularity), calls in self.varCalls.items():
+            _callsByType[(objectType, granularity)] += calls
+
+        for (objectType, granularity), calls in sorted(_callsByType.items()):
+            logging.info(f"Statistics of {objectType} with {granularity} granularity: {calls} requests.")
+
+        for adAccountId, calls in self.getCallsBy(0).most_common(PLAN_LARGEST_ACCOUNTS):
+            logging.info(f"Ad account {adAccountId}: {calls} requests.")
+
+        if latency is None:
+            logging.info("Run time can not be estimated, no requests with a known latency were made.")
+
+        else:
+            _seconds = self.estimateSeconds(_total, latency, concurrency, rateLimit)
+            logging.info(f"Statistics are estimated to download in {_seconds:.0f} seconds, with median latency "
+                         f"of {latency:.3f} seconds from {latencySource} and concurrency {concurrency}.")
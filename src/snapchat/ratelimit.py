@@ -0,0 +1,196 @@
+import asyncio
+import collections
+import threading
+import time
+
+MIN_RATE = 0.5
+RATE_DECREASE_FACTOR = 0.5
+RATE_DECREASE_INTERVAL = 1.0
+RATE_INCREASE_STEP = 0.1
+RATE_INCREASE_FACTOR = 0.1
+RATE_OBSERVATION_WINDOW = 1.0
+MAX_RESERVATION_SECONDS = 1.0
+MAX_RATE_LIMIT_RETRIES = 5
+EPOCH_THRESHOLD = 1e9
+
+
+class SnapchatRateLimiter:
+
+    def __init__(self, maxRate=None, minRate=MIN_RATE):
+
+        self.paramMaxRate = float(maxRate) if maxRate is not None else None
+        self.paramMinRate = float(minRate) if maxRate is None else min(float(minRate), self.paramMaxRate)
+
+        # Without a configured limit, requests are not paced until the API reports one, either by a rate limit
+        # response or by rate limit headers.
+        self.varRate = self.paramMaxRate
+        self.varRateLimitedCount = 0
+
+        self._tokens = 1.0
+        self._updated = time.monotonic()
+        self._blockedUntil = 0.0
+        self._decreaseAllowedAfter = 0.0
+        self._increaseAllowedAfter = 0.0
+        self._generation = 0
+        self._acceptedRequests = collections.deque()
+        self._firstRequestAt = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _parseNumber(value):
+
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return None
+
+    def _refill(self, now):
+
+        # Tokens do not accumulate while requests are blocked after a rate limit response.
+        if self.varRate is not None and now > self._updated:
+            # The bucket holds at most one second worth of requests, so bursts stay close to the current rate.
+            capacity = max(1.0, self.varRate)
+            self._tokens = min(capacity, self._tokens + (now - self._updated) * self.varRate)
+
+        self._updated = max(self._updated, now)
+
+    def _invalidateReservations(self):
+
+        # Callers waiting for a reserved token reserve again at the new rate, their debt is cleared.
+        self._generation += 1
+        self._tokens = max(0.0, self._tokens)
+
+    def _setRate(self, rate):
+
+        if self.varRate is None:
+            self._tokens = 0.0
+
+        rate = max(self.paramMinRate, rate)
+        rate = min(self.paramMaxRate, rate) if self.paramMaxRate is not None else rate
+
+        if self.varRate is not None and rate < self.varRate:
+            self._invalidateReservations()
+
+        self.varRate = rate
+
+    def _getAcceptedRate(self, now):
+
+        while self._acceptedRequests and self._acceptedRequests[0] <= now - RATE_OBSERVATION_WINDOW:
+            self._acceptedRequests.popleft()
+
+        # Requests of a run shorter than the window are accepted over the time since its first request.
+        _observed = RATE_OBSERVATION_WINDOW if self._firstRequestAt is None \
+            else min(RATE_OBSERVATION_WINDOW, now - self._firstRequestAt)
+
+        return len(self._acceptedRequests) / max(_observed, RATE_OBSERVATION_WINDOW / 10)
+
+    def reserve(self):
+
+        # Returns the time to wait and the reservation of a token, which is None if no token was reserved
+        # and the caller must try again after the wait.
+        with self._lock:
+
+            now = time.monotonic()
+            self._refill(now)
+
+            if self._firstRequestAt is None:
+                self._firstRequestAt = now
+
+            if self._blockedUntil > now:
+                return self._blockedUntil - now, None
+
+            if self.varRate is None:
+                return 0.0, self._generation
+
+            # A single caller can not reserve more than a limited time ahead, later callers wait without a token,
+            # so a change of the rate applies to them.
+            waitTokens = (1 - self._tokens) / self.varRate
+
+            if waitTokens > MAX_RESERVATION_SECONDS:
+                return waitTokens - MAX_RESERVATION_SECONDS, None
+
+            self._tokens -= 1
+            return max(0.0, waitTokens), self._generation
+
+    def _isReservationValid(self, reservation):
+
+        with self._lock:
+            return reservation == self._generation and self._blockedUntil <= time.monotonic()
+
+    def acquire(self):
+
+        while True:
+
+            wait, reservation = self.reserve()
+
+            if wait > 0:
+                time.sleep(wait)
+
+            # Reservations made before a rate limit response or a decrease of the rate are void.
+            if reservation is not None and (wait == 0 or self._isReservationValid(reservation)):
+                return reservation
+
+    async def acquireAsync(self):
+
+        while True:
+
+            wait, reservation = self.reserve()
+
+            if wait > 0:
+                await asyncio.sleep(wait)
+
+            if reservation is not None and (wait == 0 or self._isReservationValid(reservation)):
+                return reservation
+
+    def update(self, statusCode, headers=None, reservation=None):
+
+        headers = headers if headers is not None else {}
+
+        with self._lock:
+
+            now = time.monotonic()
+            self._refill(now)
+
+            if statusCode == 429:
+
+                self.varRateLimitedCount += 1
+                retryAfter = self._parseNumber(headers.get('Retry-After'))
+
+                # Requests in flight are rejected together, the rate is decreased only once for all of them.
+                # A request sent after the last decrease shows that the rate is still too high.
+                # Without a configured limit, the decrease starts from the rate the API accepted recently.
+                if now >= self._decreaseAllowedAfter or (reservation is not None
+                                                         and reservation == self._generation):
+                    _currentRate = self.varRate if self.varRate is not None else self._getAcceptedRate(now)
+                    self._setRate(_currentRate * RATE_DECREASE_FACTOR)
+                    self._decreaseAllowedAfter = now + max(RATE_DECREASE_INTERVAL,
+                                                           retryAfter if retryAfter is not None else 0.0)
+                    self._increaseAllowedAfter = self._decreaseAllowedAfter
+
+                self._blockedUntil = max(self._blockedUntil,
+                                         now + (retryAfter if retryAfter is not None else 1 / self.varRate))
+                # A single request is sent once the block ends, the following ones are paced at the new rate.
+                self._invalidateReservations()
+                self._tokens = 1.0
+                self._updated = max(self._updated, self._blockedUntil)
+                return
+
+            self._acceptedRequests.append(now)
+            self._getAcceptedRate(now)
+
+            remaining = self._parseNumber(headers.get('X-RateLimit-Remaining'))
+            reset = self._parseNumber(headers.get('X-RateLimit-Reset'))
+
+            # Reset may be sent either as number of seconds, or as a unix timestamp.
+            if reset is not None and reset > EPOCH_THRESHOLD:
+                reset -= time.time()
+
+            if remaining is not None and reset is not None and reset > 0:
+                # Remaining requests of the current window are spread evenly until the window resets.
+                self._setRate(remaining / reset)
+
+            # The rate is raised at most once per interval, so it approaches the limit again without overshooting
+            # it within seconds.
+            elif self.varRate is not None and now >= self._increaseAllowedAfter:
+                self._setRate(self.varRate + max(RATE_INCREASE_STEP, self.varRate * RATE_INCREASE_FACTOR))
+                self._increaseAllowedAfter = now + RATE_DECREASE_INTERVAL
@@ -1,6 +1,16 @@
 import csv
+import datetime
+import gzip
 import json
 import os
+import pytz
+import threading
+
+WRITE_BUFFER_SIZE = 2 ** 20
+PARQUET_ROW_GROUP_SIZE = 100000
+PARQUET_COMPRESSION = 'zstd'
+OUTPUT_FORMATS = ['csv', 'parquet']
+GZIP_COMPRESS_LEVEL = 6
 
 FIELDS_ORGANIZATIONS = ['id', 'updated_at', 'created_at', 'name', 'country', 'postal_code', 'locality', 'contact_name',
                         'contact_email', 'tax_id', 'address_line_1', 'administrative_district_level_1',
@@ -46,26 +56,136 @@ PK_STATISTICS = ['id', 'type', 'granularity', 'swipe_up_attribution_window', 'vi
                  'start_time', 'end_time']
 
 
+class SnapchatParquetWriter:
+
+    def __init__(self, path, fields, numericFields=[]):
+
+        # pyarrow is only needed for the columnar output, it is imported once the output is requested.
+        import pyarrow
+        import pyarrow.parquet
+
+        self._pyarrow = pyarrow
+        self.paramTypes = [pyarrow.float64() if f in set(numericFields) else pyarrow.string() for f in fields]
+        self.schema = pyarrow.schema(list(zip(fields, self.paramTypes)))
+        self.writer = pyarrow.parquet.ParquetWriter(path, self.schema, compression=PARQUET_COMPRESSION)
+        self._rows = []
+
+    @staticmethod
+    def _toString(value):
+
+        return value if value is None or isinstance(value, str) else str(value)
+
+    def flush(self):
+
+        if self._rows == []:
+            return
+
+        columns = []
+
+        for values, columnType in zip(zip(*self._rows), self.paramTypes):
+
+            if columnType == self._pyarrow.string():
+                values = [self._toString(v) for v in values]
+
+            columns += [self._pyarrow.array(values, type=columnType)]
+
+        # Each flush is written as a single row group, rows are not kept in memory beyond that.
+        self.writer.write_table(self._pyarrow.Table.from_arrays(columns, schema=self.schema))
+        self._rows = []
+
+    def writerows(self, rows):
+
+        self._rows.extend(rows)
+
+        if len(self._rows) >= PARQUET_ROW_GROUP_SIZE:
+            self.flush()
+
+    def close(self):
+
+        self.flush()
+        self.writer.close()
+
+
+class SnapchatSlicedWriter:
+
+    def __init__(self, path, sliceRows):
+
+        # A sliced table is a folder of gzipped slices without a header, columns are listed in the manifest.
+        self.paramPath = path
+        self.paramSliceRows = sliceRows
+        self.varSlice = 0
+        self._file = None
+
+        os.makedirs(self.paramPath, exist_ok=True)
+        self.rotate()
+
+    def rotate(self):
+
+        if self._file is not None:
+            self._file.close()
+
+        self.varSlice += 1
+        self.varSliceRows = 0
+
+        self._file = gzip.open(os.path.join(self.paramPath, f'part-{self.varSlice}.csv.gz'), 'wt', newline='',
+                               compresslevel=GZIP_COMPRESS_LEVEL)
+        self.writer = csv.writer(self._file, quotechar='\"', quoting=csv.QUOTE_ALL)
+
+    def writerows(self, rows):
+
+        while rows != []:
+
+            if self.varSliceRows >= self.paramSliceRows:
+                self.rotate()
+
+            _rows = rows[:self.paramSliceRows - self.varSliceRows]
+            self.writer.writerows(_rows)
+            self.varSliceRows += len(_rows)
+            rows = rows[len(_rows):]
+
+    def close(self):
+
+        self._file.close()
+
+
+def createFileManifest(path, tags, isPermanent=True):
+
+    with open(path + '.manifest', 'w') as manifest:
+        json.dump({'is_permanent': isPermanent, 'tags': tags}, manifest)
+
+
 class SnapchatStatisticsWriter:
 
-    def __init__(self, dataPath, tableName='statistics', metricFields=[]):
+    def __init__(self, dataPath, tableName='statistics', metricFields=[], outputFormat='csv', sliceRows=0):
 
         self.paramPath = dataPath
-        self.paramTable = 'statistics.csv'
-        self.paramTablePath = os.path.join(self.paramPath, 'out/tables', self.paramTable)
+        self.paramOutputFormat = outputFormat
+        self.paramSliceRows = sliceRows
+        self.paramTable = 'statistics.' + outputFormat
+        self.paramTablePath = os.path.join(self.paramPath, 'out/tables' if outputFormat == 'csv' else 'out/files',
+                                           self.paramTable)
         self.paramFields = FIELDS_STATISTICS + metricFields
+        self.paramMetricFields = list(metricFields)
         self.paramPrimaryKey = PK_STATISTICS
+        self._lock = threading.Lock()
 
         self.createManifest()
         self.createWriter()
 
     def createManifest(self):
 
+        if self.paramOutputFormat == 'parquet':
+            createFileManifest(self.paramTablePath, ['snapchat', 'statistics'])
+            return
+
         template = {
             'incremental': True,
             'primary_key': self.paramPrimaryKey
         }
 
+        if self.paramSliceRows > 0:
+            template['columns'] = self.paramFields
+
         path = self.paramTablePath + '.manifest'
 
         with open(path, 'w') as manifest:
@@ -74,53 +194,144 @@ class SnapchatStatisticsWriter:
 
     def createWriter(self):
 
-        self.writer = csv.DictWriter(open(self.paramTablePath, 'w'), fieldnames=self.paramFields,
-                                     restval='', extrasaction='ignore', quotechar='\"', quoting=csv.QUOTE_ALL)
-        self.writer.writeheader()
+        if self.paramOutputFormat == 'parquet':
+            # Metrics are numeric, missing values are left empty as nulls instead of empty strings.
+            self._restval = None
+            self._file = self.writer = SnapchatParquetWriter(self.paramTablePath, self.paramFields,
+                                                             self.paramMetricFields)
 
-    def writerow(self, listToWrite):
+        elif self.paramSliceRows > 0:
+            self._restval = ''
+            self._file = self.writer = SnapchatSlicedWriter(self.paramTablePath, self.paramSliceRows)
+
+        else:
+            self._restval = ''
+            self._file = open(self.paramTablePath, 'w', buffering=WRITE_BUFFER_SIZE)
+            self.writer = csv.writer(self._file, quotechar='\"', quoting=csv.QUOTE_ALL)
+            self.writer.writerow(self.paramFields)
+
+    def encodeRows(self, listToWrite):
+
+        # Rows are built as lists in the order of output columns, metrics missing in a response are left empty.
+        rowsToWrite = []
+        metricFields = self.paramMetricFields
+        restval = self._restval
 
         for stat in listToWrite:
 
-            headerDict = {
-                'id': stat['id'],
-                'type': stat['type'],
-                'granularity': stat['granularity'],
-                'swipe_up_attribution_window': stat['swipe_up_attribution_window'],
-                'view_attribution_window': stat['view_attribution_window']
-            }
+            header = [stat['id'], stat['type'], stat['granularity'], stat['swipe_up_attribution_window'],
+                      stat['view_attribution_window']]
+
+            for timeseries in stat['timeseries']:
+
+                metrics = timeseries['stats']
+                rowsToWrite.append(header + [timeseries['start_time'], timeseries['end_time']]
+                                   + [metrics.get(m, restval) for m in metricFields])
+
+        return rowsToWrite
+
+    @staticmethod
+    def mergeStatistics(statisticsParts):
+
+        # Each part holds different metrics of the same objects and periods, they are merged into a single row
+        # per object and start of the period.
+        if len(statisticsParts) == 1:
+            return statisticsParts[0]
+
+        merged = {}
+
+        for statistics in statisticsParts:
+            for stat in statistics:
+
+                _stat = merged.setdefault(stat['id'], {**stat, 'timeseries': {}})
+
+                for timeseries in stat['timeseries']:
+                    _timeseries = _stat['timeseries'].setdefault(timeseries['start_time'], {**timeseries, 'stats': {}})
+                    _timeseries['stats'].update(timeseries['stats'])
+
+        return [{**stat, 'timeseries': list(stat['timeseries'].values())} for stat in merged.values()]
+
+    @staticmethod
+    def rollupStatistics(statistics, timezone, additiveFields):
+
+        # Hourly statistics are summed into days of the ad account's timezone. Hours of a day are always returned
+        # in the same response, as requests are split at midnight of the timezone.
+        tz = pytz.timezone(timezone)
+        rolledUp = []
+
+        for stat in statistics:
+
+            days = {}
 
             for timeseries in stat['timeseries']:
 
-                metricDict = timeseries['stats']
-                metricDict['start_time'] = timeseries['start_time']
-                metricDict['end_time'] = timeseries['end_time']
+                _start = datetime.datetime.fromisoformat(timeseries['start_time'].replace('Z', '+00:00'))
+                _stats = days.setdefault(_start.astimezone(tz).date(), {})
+
+                for m in additiveFields:
+                    _value = timeseries['stats'].get(m)
 
-                self.writer.writerow({**headerDict, **metricDict})
+                    if isinstance(_value, (int, float)):
+                        _stats[m] = _stats.get(m, 0) + _value
+
+            rolledUp += [{**stat, 'granularity': 'DAY', 'timeseries': [
+                {'start_time': tz.localize(datetime.datetime.combine(day, datetime.time())).isoformat(
+                    timespec='milliseconds'),
+                 'end_time': tz.localize(datetime.datetime.combine(day + datetime.timedelta(days=1),
+                                                                   datetime.time())).isoformat(timespec='milliseconds'),
+                 'stats': stats} for day, stats in days.items()]}]
+
+        return rolledUp
+
+    def writerow(self, listToWrite):
+
+        rowsToWrite = self.encodeRows(listToWrite)
+
+        with self._lock:
+            self.writer.writerows(rowsToWrite)
+
+    def close(self):
+
+        with self._lock:
+            self._file.close()
 
 
 class SnapchatWriter:
 
-    def __init__(self, dataPath, tableName):
+    def __init__(self, dataPath, tableName, outputFormat='csv', sliceRows=0):
 
         self.paramPath = dataPath
         self.paramTableName = tableName
-        self.paramTable = tableName + '.csv'
-        self.paramTablePath = os.path.join(self.paramPath, 'out/tables', self.paramTable)
+        self.paramOutputFormat = outputFormat
+        self.paramSliceRows = sliceRows
+        self.paramTable = tableName + '.' + outputFormat
+        self.paramTablePath = os.path.join(self.paramPath, 'out/tables' if outputFormat == 'csv' else 'out/files',
+                                           self.paramTable)
         self.paramFields = eval(f'FIELDS_{tableName.upper()}')
         self.paramJsonFields = eval(f'JSON_FIELDS_{tableName.upper()}')
         self.paramPrimaryKey = eval(f'PK_{tableName.upper()}')
+        self._lock = threading.Lock()
+
+        # Positions of columns, which are serialized to JSON, if present in the row.
+        self._jsonColumns = [(i, f) for i, f in enumerate(self.paramFields) if f in set(self.paramJsonFields)]
 
         self.createManifest()
         self.createWriter()
 
     def createManifest(self):
 
+        if self.paramOutputFormat == 'parquet':
+            createFileManifest(self.paramTablePath, ['snapchat', self.paramTableName])
+            return
+
         template = {
             'incremental': True,
             'primary_key': self.paramPrimaryKey
         }
 
+        if self.paramSliceRows > 0:
+            template['columns'] = self.paramFields
+
         path = self.paramTablePath + '.manifest'
 
         with open(path, 'w') as manifest:
@@ -129,22 +340,47 @@ class SnapchatWriter:
 
     def createWriter(self):
 
-        self.writer = csv.DictWriter(open(self.paramTablePath, 'w'), fieldnames=self.paramFields,
-                                     restval='', extrasaction='ignore', quotechar='\"', quoting=csv.QUOTE_ALL)
-        self.writer.writeheader()
+        if self.paramOutputFormat == 'parquet':
+            self._restval = None
+            self._file = self.writer = SnapchatParquetWriter(self.paramTablePath, self.paramFields)
 
-    def writerow(self, listToWrite):
+        elif self.paramSliceRows > 0:
+            self._restval = ''
+            self._file = self.writer = SnapchatSlicedWriter(self.paramTablePath, self.paramSliceRows)
+
+        else:
+            self._restval = ''
+            self._file = open(self.paramTablePath, 'w', buffering=WRITE_BUFFER_SIZE)
+            self.writer = csv.writer(self._file, quotechar='\"', quoting=csv.QUOTE_ALL)
+            self.writer.writerow(self.paramFields)
+
+    def encodeRows(self, listToWrite):
+
+        rowsToWrite = []
+        fields = self.paramFields
+        jsonColumns = self._jsonColumns
+        restval = self._restval
 
         for row in listToWrite:
 
-            _dictToWrite = {}
+            _row = [row.get(f, restval) for f in fields]
+
+            for i, f in jsonColumns:
+                if f in row:
+                    _row[i] = json.dumps(row[f])
+
+            rowsToWrite.append(_row)
+
+        return rowsToWrite
+
+    def writerow(self, listToWrite):
 
-            for key, value in row.items():
+        rowsToWrite = self.encodeRows(listToWrite)
 
-                if key in self.paramJsonFields:
-                    _dictToWrite[key] = json.dumps(value)
+        with self._lock:
+            self.writer.writerows(rowsToWrite)
 
-                else:
-                    _dictToWrite[key] = value
+    def close(self):
 
-            self.writer.writerow(_dictToWrite)
+        with self._lock:
+            self._file.close()
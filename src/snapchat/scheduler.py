@@ -0,0 +1,72 @@
+import heapq
+import itertools
+import threading
+from concurrent.futures import Future, InvalidStateError
+
+
+class SnapchatScheduler:
+
+    def __init__(self, executor, maxConcurrency, costFunction=None):
+
+        self.executor = executor
+        self.paramMaxConcurrency = maxConcurrency
+        self.costFunction = costFunction
+
+        self._pending = []
+        self._running = 0
+        self._order = itertools.count()
+        self._lock = threading.Lock()
+
+    def submitStatistics(self, *args):
+
+        # Requests are held back until the executor has a free slot, so that the most expensive request waiting
+        # is always started first. Requests of the same cost keep the order, in which they were submitted.
+        cost = self.costFunction(*args) if self.costFunction is not None else 0
+        future = Future()
+
+        with self._lock:
+            heapq.heappush(self._pending, (-cost, next(self._order), args, future))
+
+        self._dispatch()
+        return future
+
+    def _dispatch(self):
+
+        while True:
+
+            with self._lock:
+
+                if self._running >= self.paramMaxConcurrency or self._pending == []:
+                    return
+
+                _, _, args, future = heapq.heappop(self._pending)
+
+                if future.cancelled():
+                    continue
+
+                self._running += 1
+
+            request = self.executor.submitStatistics(*args)
+            future.add_done_callback(lambda f, request=request: request.cancel() if f.cancelled() else None)
+            request.add_done_callback(lambda r, future=future: self._complete(r, future))
+
+    def _complete(self, request, future):
+
+        with self._lock:
+            self._running -= 1
+
+        try:
+            if request.cancelled():
+                future.cancel()
+
+            elif request.exception() is not None:
+                future.set_exception(request.exception())
+
+            else:
+                future.set_result(request.result())
+
+        # The request was cancelled by the caller in the meantime.
+        except InvalidStateError:
+            pass
+
+        self._dispatch()
@@ -0,0 +1,58 @@
+import datetime
+import unittest
+
+from snapchat.activity import SnapchatActivityIndex
+
+
+def utc(*args):
+    return datetime.datetime(*args, tzinfo=datetime.timezone.utc)
+
+
+class TestSnapchatActivityIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.index = SnapchatActivityIndex(paddingDays=7)
+        self.index.add([{'id': 'campaign', 'start_time': '2020-01-01T00:00:00.000Z',
+                         'end_time': '2020-01-31T00:00:00.000Z'}])
+        self.index.add([{'id': 'adsquad', 'campaign_id': 'campaign', 'created_at': '2020-01-10T00:00:00.000Z'}],
+                       parentKey='campaign_id')
+        self.index.add([{'id': 'ad', 'ad_squad_id': 'adsquad'}], parentKey='ad_squad_id')
+
+    def test_child_inherits_parent_period(self):
+        self.assertEqual(self.index.getActivePeriod('ad'), (utc(2020, 1, 10), utc(2020, 1, 31)))
+
+    def test_inactive_before_start(self):
+        self.assertFalse(self.index.isActive('ad', utc(2019, 12, 1), utc(2020, 1, 10)))
+        self.assertTrue(self.index.isActive('ad', utc(2019, 12, 1), utc(2020, 1, 11)))
+
+    def test_inactive_after_end_and_padding(self):
+        self.assertTrue(self.index.isActive('campaign', utc(2020, 2, 6), utc(2020, 3, 1)))
+        self.assertFalse(self.index.isActive('campaign', utc(2020, 2, 7), utc(2020, 3, 1)))
+
+    def test_unknown_entity_is_active(self):
+        self.assertTrue(self.index.isActive('unknown', utc(2010, 1, 1), utc(2010, 1, 2)))
+
+    def test_active_range_of_entities(self):
+        self.index.add([{'id': 'later', 'start_time': '2020-03-01T00:00:00.000Z',
+                         'end_time': '2020-03-10T00:00:00.000Z'}])
+
+        self.assertEqual(self.index.getActiveRange(['campaign', 'later']), (utc(2020, 1, 1), utc(2020, 3, 17)))
+        self.assertEqual(self.index.getActiveRange(['later', 'unknown']), (None, None))
+
+    def test_times_normalized_to_utc(self):
+        self.index.add([{'id': 'naive', 'start_time': '2020-01-01T00:00:00'},
+                        {'id': 'offset', 'start_time': '2020-01-01T01:00:00+01:00'}])
+
+        self.assertEqual(self.index.getActivePeriod('naive'), (utc(2020, 1, 1), None))
+        self.assertEqual(self.index.getActivePeriod('offset'), (utc(2020, 1, 1), None))
+        self.assertFalse(self.index.isActive('naive', utc(2019, 12, 1), utc(2020, 1, 1)))
+
+    def test_unparseable_time_is_logged(self):
+        with self.assertLogs(level='WARNING'):
+            self.index.add([{'id': 'invalid', 'start_time': 'not a time'}])
+
+        self.assertTrue(self.index.isActive('invalid', utc(2010, 1, 1), utc(2010, 1, 2)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,156 @@
+import asyncio
+import threading
+import time
+import unittest
+import httpx
+import mock
+
+from snapchat.async_client import AsyncSnapchatClient, SnapchatAsyncClientAdapter, SnapchatAsyncExecutor
+from snapchat.client import SnapchatClientException
+
+
+def create_client(handler):
+    client = AsyncSnapchatClient('token', 'id', 'secret')
+    client.client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return client
+
+
+def page_handler(request):
+    if 'cursor' not in request.url.params:
+        return httpx.Response(200, json={'ads': [{'ad': {'id': 1}}], 'paging': {
+            'next_link': 'https://adsapi.snapchat.com/v1/adaccounts/acc/ads?cursor=abc'}})
+    return httpx.Response(200, json={'ads': [{'ad': {'id': 2}}], 'paging': {}})
+
+
+class TestAsyncSnapchatClient(unittest.TestCase):
+
+    def test_request_raw_returns_error_response(self):
+        client = create_client(lambda request: httpx.Response(403, json={'request_status': 'ERROR'}))
+
+        response = asyncio.run(client._requestRaw('GET', 'https://adsapi.snapchat.com/v1/me/organizations'))
+
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(response.json(), {'request_status': 'ERROR'})
+
+    def test_error_response_raises_client_exception(self):
+        client = create_client(lambda request: httpx.Response(403, json={'request_status': 'ERROR'}))
+        client.varAccessTokenCreated = time.time()
+
+        with self.assertRaises(SnapchatClientException):
+            asyncio.run(client.getStatistics('ads', 'ad', 'impressions', 'DAY', 'start', 'end', '28_DAY', '1_DAY'))
+
+    def test_requests_and_rows_recorded_in_metrics(self):
+        client = create_client(lambda request: httpx.Response(200, json={'timeseries_stats': [
+            {'timeseries_stat': {'id': 'ad1'}}, {'timeseries_stat': {'id': 'ad2'}}]}))
+        client.varAccessTokenCreated = time.time()
+
+        asyncio.run(client.getStatistics('ads', 'ad1', 'impressions', 'DAY', 'start', 'end', '28_DAY', '1_DAY'))
+
+        summary = client.metrics.getSummary()['endpoints']['GET v1/ads/{id}/stats']
+        self.assertEqual(summary['requests'], 1)
+        self.assertEqual(summary['status_codes'], {'200': 1})
+        self.assertEqual(summary['rows'], 2)
+
+    def test_access_token_refreshed_once_for_concurrent_requests(self):
+        requests = []
+
+        def handler(request):
+            requests.append(request.url.path)
+            if request.method == 'POST':
+                return httpx.Response(200, json={'access_token': 'access'})
+            return httpx.Response(200, json={'adaccounts': [], 'paging': {}})
+
+        client = create_client(handler)
+
+        async def get_ad_accounts():
+            return await asyncio.gather(*[client.getAdAccounts(f'org{i}') for i in range(5)])
+
+        asyncio.run(get_ad_accounts())
+
+        self.assertEqual(len([r for r in requests if 'oauth2' in r]), 1)
+        self.assertEqual(len(requests), 6)
+
+    def test_identical_concurrent_requests_sent_once(self):
+        requests = []
+
+        def handler(request):
+            requests.append(request.url.path)
+            return httpx.Response(200, json={'organizations': [{'organization': {'id': 'org'}}]})
+
+        client = create_client(handler)
+        client.varAccessTokenCreated = time.time()
+
+        async def get_organizations():
+            return await asyncio.gather(*[client.getOrganizations() for _ in range(5)])
+
+        self.assertEqual(asyncio.run(get_organizations()), [[{'id': 'org'}]] * 5)
+        self.assertEqual(len(requests), 1)
+        self.assertEqual(client.metrics.getSummary()['endpoints']['GET v1/me/organizations']['cache_hits'], 4)
+
+
+class TestSnapchatAsyncClientAdapter(unittest.TestCase):
+
+    def setUp(self):
+        with mock.patch.object(AsyncSnapchatClient, 'refreshAccessToken'):
+            self.adapter = SnapchatAsyncClientAdapter('token', 'id', 'secret')
+
+        self.adapter.client.client = httpx.AsyncClient(transport=httpx.MockTransport(page_handler))
+        self.adapter.client.varAccessTokenCreated = time.time()
+        self.addCleanup(self.adapter.close)
+
+    def test_connection_pool_replaces_client_of_base_class(self):
+        client = AsyncSnapchatClient('token', 'id', 'secret', maxConnections=7)
+        base_client = client.client
+
+        asyncio.run(client.openConnectionPool())
+
+        self.assertTrue(base_client.is_closed)
+        self.assertIsNot(client.client, base_client)
+        self.assertEqual(client.client._transport._pool._max_connections, 7)
+        asyncio.run(client.close())
+
+    def test_iterate_bridges_async_pagination(self):
+        pages = self.adapter.iterAdsForAdAccount('acc')
+
+        self.assertEqual(next(pages), [{'id': 1}])
+        self.assertEqual(list(pages), [[{'id': 2}]])
+
+    def test_executor_bounds_and_cancels_requests(self):
+        started = []
+        running = threading.Event()
+        release = threading.Event()
+
+        async def get_statistics(*args):
+            started.append(args)
+            running.set()
+            await asyncio.get_running_loop().run_in_executor(None, release.wait)
+            return args
+
+        client = mock.Mock(getStatistics=get_statistics)
+        executor = SnapchatAsyncExecutor(client, self.adapter.loop, 1)
+
+        first = executor.submitStatistics('first')
+        second = executor.submitStatistics('second')
+        running.wait(1)
+
+        executor.shutdown(cancel_futures=True)
+        release.set()
+
+        self.assertTrue(first.cancelled())
+        self.assertTrue(second.cancelled())
+        self.assertEqual(started, [('first',)])
+
+    def test_executor_shutdown_waits_for_requests(self):
+        async def get_statistics(*args):
+            await asyncio.sleep(0.01)
+            return args
+
+        with SnapchatAsyncExecutor(mock.Mock(getStatistics=get_statistics), self.adapter.loop, 2) as executor:
+            futures = [executor.submitStatistics(i) for i in range(3)]
+
+        self.assertTrue(all([f.done() for f in futures]))
+        self.assertEqual([f.result() for f in futures], [(0,), (1,), (2,)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,180 @@
+import datetime
+import os
+import tempfile
+import threading
+import unittest
+import mock
+from freezegun import freeze_time
+
+from snapchat.cache import SnapchatResponseCache, SnapchatStatisticsCache
+
+
+def response(content=b'{}', status_code=200):
+    return mock.Mock(status_code=status_code, content=content)
+
+
+class TestSnapchatResponseCache(unittest.TestCase):
+
+    def test_key_normalizes_parameters(self):
+        self.assertEqual(SnapchatResponseCache.getKey('get', 'https://api/v1/ads/', {'b': 1, 'a': 'x', 'cursor': None}),
+                         SnapchatResponseCache.getKey('GET', 'https://api/v1/ads', {'a': 'x', 'b': '1'}))
+        self.assertNotEqual(SnapchatResponseCache.getKey('GET', 'https://api/v1/ads', {'cursor': 'abc'}),
+                            SnapchatResponseCache.getKey('GET', 'https://api/v1/ads'))
+
+    def test_least_recently_used_evicted(self):
+        cache = SnapchatResponseCache(maxSize=2)
+        cache.put('a', response())
+        cache.put('b', response())
+        cache.get('a')
+        cache.put('c', response())
+
+        self.assertIsNone(cache.get('b'))
+        self.assertIsNotNone(cache.get('a'))
+        self.assertIsNotNone(cache.get('c'))
+
+    def test_size_in_bytes_bounded(self):
+        cache = SnapchatResponseCache(maxBytes=10)
+        cache.put('a', response(b'123456'))
+        cache.put('b', response(b'123456'))
+        cache.put('c', response(b'12345678901'))
+
+        self.assertIsNone(cache.get('a'))
+        self.assertIsNotNone(cache.get('b'))
+        self.assertIsNone(cache.get('c'))
+
+    def test_error_responses_not_cached(self):
+        cache = SnapchatResponseCache()
+        request = mock.Mock(return_value=response(status_code=500))
+
+        cache.getOrRequest('a', request)
+        cache.getOrRequest('a', request)
+
+        self.assertEqual(request.call_count, 2)
+
+    def test_identical_requests_in_flight_sent_once(self):
+        cache = SnapchatResponseCache()
+        started, release = threading.Event(), threading.Event()
+        calls = []
+
+        def request():
+            calls.append(1)
+            started.set()
+            release.wait(1)
+            return response()
+
+        results = []
+        first = threading.Thread(target=lambda: results.append(cache.getOrRequest('a', request)))
+        first.start()
+        started.wait(1)
+        second = threading.Thread(target=lambda: results.append(cache.getOrRequest('a', request)))
+        second.start()
+        release.set()
+        first.join()
+        second.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sorted([isCached for _, isCached in results]), [False, True])
+
+    def test_failed_request_in_flight_requested_again(self):
+        cache = SnapchatResponseCache()
+
+        with self.assertRaises(ValueError):
+            cache.getOrRequest('a', mock.Mock(side_effect=ValueError()))
+
+        self.assertEqual(cache.getOrRequest('a', mock.Mock(return_value=response()))[1], False)
+
+
+def statistic(object_id, days, finalized=None):
+    stat = {'id': object_id, 'type': 'AD', 'granularity': 'DAY', 'start_time': 'x', 'end_time': 'y', 'timeseries': [
+        {'start_time': f'2021-01-{d:02d}T00:00:00.000-08:00', 'end_time': f'2021-01-{d + 1:02d}T00:00:00.000-08:00',
+         'stats': {'impressions': d}} for d in days]}
+    if finalized is not None:
+        stat['finalized_data_end_time'] = finalized
+    return stat
+
+
+class TestSnapchatStatisticsCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = SnapchatStatisticsCache()
+        self.key = self.cache.getKey('ads', 'ad1', 'spend,impressions', 'DAY', '28_DAY', '1_DAY')
+        self.closed_before = datetime.datetime(2021, 1, 20, tzinfo=datetime.timezone.utc)
+
+    def test_key_ignores_order_of_fields(self):
+        self.assertEqual(self.key, self.cache.getKey('ads', 'ad1', 'impressions,spend', 'DAY', '28_DAY', '1_DAY'))
+
+    def test_closed_range_served_from_cache(self):
+        self.cache.update(self.key, '2021-01-01T00:00:00-08:00', '2021-01-05T00:00:00-08:00',
+                          [statistic('ad1', range(1, 5))], self.closed_before)
+
+        cached, start_time = self.cache.lookup(self.key, '2021-01-02T00:00:00-08:00', '2021-01-04T00:00:00-08:00')
+
+        self.assertIsNone(start_time)
+        self.assertEqual([t['stats']['impressions'] for t in cached[0]['timeseries']], [2, 3])
+        self.assertNotIn('start_time', cached[0])
+
+    def test_attribution_window_not_cached(self):
+        self.cache.update(self.key, '2021-01-15T00:00:00-08:00', '2021-01-25T00:00:00-08:00',
+                          [statistic('ad1', range(15, 25))], self.closed_before)
+
+        cached, start_time = self.cache.lookup(self.key, '2021-01-15T00:00:00-08:00', '2021-01-25T00:00:00-08:00')
+
+        # Days ending before 2021-01-20 UTC are closed, the rest must be requested.
+        self.assertEqual(start_time, '2021-01-19T00:00:00.000-08:00')
+        self.assertEqual([t['stats']['impressions'] for t in cached[0]['timeseries']], [15, 16, 17, 18])
+
+        merged = self.cache.merge(cached, [statistic('ad1', range(19, 25))])
+        self.assertEqual([t['stats']['impressions'] for t in merged[0]['timeseries']], list(range(15, 25)))
+
+    def test_finalized_data_end_time_limits_cache(self):
+        self.cache.update(self.key, '2021-01-01T00:00:00-08:00', '2021-01-05T00:00:00-08:00',
+                          [statistic('ad1', range(1, 5), finalized='2021-01-03T08:00:00.000Z')], self.closed_before)
+
+        cached, start_time = self.cache.lookup(self.key, '2021-01-01T00:00:00-08:00', '2021-01-05T00:00:00-08:00')
+
+        self.assertEqual(start_time, '2021-01-03T00:00:00.000-08:00')
+        self.assertEqual(len(cached[0]['timeseries']), 2)
+
+    def test_range_not_starting_in_cache_requested(self):
+        self.cache.update(self.key, '2021-01-03T00:00:00-08:00', '2021-01-05T00:00:00-08:00',
+                          [statistic('ad1', range(3, 5))], self.closed_before)
+
+        self.assertEqual(self.cache.lookup(self.key, '2021-01-01T00:00:00-08:00', '2021-01-05T00:00:00-08:00'),
+                         ([], '2021-01-01T00:00:00-08:00'))
+
+    def test_range_cached_only_if_covered_whole(self):
+        self.cache.update(self.key, '2021-01-15T00:00:00-08:00', '2021-01-25T00:00:00-08:00',
+                          [statistic('ad1', range(15, 25))], self.closed_before)
+
+        self.assertTrue(self.cache.isCached(self.key, '2021-01-15T00:00:00-08:00', '2021-01-18T00:00:00-08:00'))
+        self.assertFalse(self.cache.isCached(self.key, '2021-01-15T00:00:00-08:00', '2021-01-25T00:00:00-08:00'))
+        self.assertFalse(self.cache.isCached('other', '2021-01-15T00:00:00-08:00', '2021-01-18T00:00:00-08:00'))
+
+    @freeze_time('2021-06-01')
+    def test_save_and_load_drops_unused_entries(self):
+        self.cache.update(self.key, '2021-01-01T00:00:00-08:00', '2021-01-05T00:00:00-08:00',
+                          [statistic('ad1', range(1, 5))], self.closed_before)
+        self.cache._entries['old'] = {'covered': [], 'statistics': {}, 'used_at': '2020-01-01'}
+        path = os.path.join(tempfile.mkdtemp(), 'cache.json.gz')
+
+        self.cache.save(path)
+        loaded = SnapchatStatisticsCache()
+        loaded.load(path)
+
+        self.assertEqual(list(loaded._entries), [self.key])
+        self.assertIsNone(loaded.lookup(self.key, '2021-01-01T00:00:00-08:00', '2021-01-05T00:00:00-08:00')[1])
+
+    def test_unreadable_cache_ignored(self):
+        path = os.path.join(tempfile.mkdtemp(), 'cache.json.gz')
+
+        with open(path, 'w') as cache_file:
+            cache_file.write('not gzip')
+
+        with self.assertLogs(level='WARNING'):
+            self.cache.load(path)
+
+        self.assertEqual(self.cache._entries, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
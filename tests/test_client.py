@@ -0,0 +1,118 @@
+import unittest
+import mock
+
+from snapchat.cache import SnapchatResponseCache
+from snapchat.client import SnapchatClient, SnapchatClientException
+from snapchat.metrics import SnapchatMetrics
+from snapchat.ratelimit import MAX_RATE_LIMIT_RETRIES
+
+
+def page_response(objects, key, next_cursor=None, status_code=200):
+    body = {key + 's': [{key: o} for o in objects], 'paging': {}}
+    if next_cursor is not None:
+        body['paging']['next_link'] = f'https://adsapi.snapchat.com/v1/adaccounts/x/ads?cursor={next_cursor}'
+    return mock.Mock(status_code=status_code, json=mock.Mock(return_value=body),
+                     url='https://adsapi.snapchat.com/v1/adaccounts/x/ads')
+
+
+def create_client():
+    client = SnapchatClient.__new__(SnapchatClient)
+    client.metrics = SnapchatMetrics()
+    client.responseCache = SnapchatResponseCache()
+    return client
+
+
+class TestSnapchatClient(unittest.TestCase):
+
+    def test_flatten_breakdown_statistics_inherits_attribution(self):
+        statistics = [{
+            'id': 'account', 'type': 'AD_ACCOUNT', 'granularity': 'DAY',
+            'swipe_up_attribution_window': '28_DAY', 'view_attribution_window': '1_DAY',
+            'breakdown_stats': {
+                'ad': [{'id': 'ad1', 'type': 'AD', 'granularity': 'DAY', 'timeseries': []},
+                       {'id': 'ad2', 'type': 'AD', 'granularity': 'DAY', 'timeseries': []}]
+            }
+        }]
+
+        flat = SnapchatClient._flattenBreakdownStatistics(statistics, 'ad')
+
+        self.assertEqual([s['id'] for s in flat], ['ad1', 'ad2'])
+        self.assertEqual(flat[0]['type'], 'AD')
+        self.assertEqual(flat[0]['swipe_up_attribution_window'], '28_DAY')
+        self.assertEqual(flat[1]['view_attribution_window'], '1_DAY')
+
+    def test_flatten_breakdown_statistics_missing_breakdown(self):
+        statistics = [{'id': 'account', 'type': 'AD_ACCOUNT', 'granularity': 'DAY', 'timeseries': []}]
+        self.assertEqual(SnapchatClient._flattenBreakdownStatistics(statistics, 'campaign'), [])
+
+    def test_iter_paginated_request_yields_pages(self):
+        client = create_client()
+        pages = {None: page_response([{'id': 1}, {'id': 2}], 'ad', 'abc'),
+                 'abc': page_response([{'id': 3}], 'ad')}
+        page_function = mock.Mock(side_effect=lambda accountId, cursor: pages[cursor])
+
+        iterator = client._iterPaginatedRequest(page_function, ['account'], 'ad')
+
+        self.assertEqual(next(iterator), [{'id': 1}, {'id': 2}])
+        self.assertEqual(page_function.call_count, 1)
+        self.assertEqual(list(iterator), [[{'id': 3}]])
+        page_function.assert_called_with('account', 'abc')
+
+    def test_request_raw_records_metrics(self):
+        client = create_client()
+        client.rateLimiter = mock.Mock()
+        responses = [mock.Mock(status_code=429, content=b'{}', url='https://adsapi.snapchat.com/v1/ads/ad1/stats',
+                               headers={}, raw=mock.Mock(retries=None)),
+                     mock.Mock(status_code=200, content=b'{"a": 1}', url='https://adsapi.snapchat.com/v1/ads/ad1/stats',
+                               headers={}, raw=mock.Mock(retries=mock.Mock(history=(1,))))]
+
+        with mock.patch('keboola.http_client.HttpClient._request_raw', side_effect=responses):
+            response = client._request_raw('GET', 'https://adsapi.snapchat.com/v1/ads/ad1/stats')
+
+        summary = client.metrics.getSummary()['endpoints']['GET v1/ads/{id}/stats']
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(summary['requests'], 2)
+        self.assertEqual(summary['rate_limited'], 1)
+        self.assertEqual(summary['retries'], 2)
+        self.assertEqual(summary['bytes'], 10)
+
+    def test_rate_limited_request_retried_while_retry_after_is_sent(self):
+        client = create_client()
+        client.rateLimiter = mock.Mock()
+
+        def response(status_code, headers):
+            return mock.Mock(status_code=status_code, content=b'{}', url='https://adsapi.snapchat.com/v1/ads/ad1/stats',
+                             headers=headers, raw=mock.Mock(retries=None))
+
+        retried = [response(429, {'Retry-After': '1'}) for _ in range(MAX_RATE_LIMIT_RETRIES + 2)]
+
+        with mock.patch('keboola.http_client.HttpClient._request_raw', side_effect=retried + [response(200, {})]):
+            self.assertEqual(client._request_raw('GET', 'https://adsapi.snapchat.com/v1/ads/ad1/stats').status_code,
+                             200)
+
+        with mock.patch('keboola.http_client.HttpClient._request_raw',
+                        side_effect=[response(429, {}) for _ in range(MAX_RATE_LIMIT_RETRIES + 2)]) as request:
+            self.assertEqual(client._request_raw('GET', 'https://adsapi.snapchat.com/v1/ads/ad1/stats?a=1')
+                             .status_code, 429)
+
+        self.assertEqual(request.call_count, MAX_RATE_LIMIT_RETRIES + 1)
+
+    def test_rate_limited_responses_not_retried_by_session(self):
+        with mock.patch.object(SnapchatClient, 'refreshAccessToken'):
+            client = SnapchatClient('token', 'id', 'secret')
+
+        retry = client._requests_retry_session().get_adapter('https://adsapi.snapchat.com').max_retries
+
+        self.assertFalse(retry.is_retry('GET', 429, has_retry_after=True))
+        self.assertTrue(retry.is_retry('GET', 503))
+
+    def test_iter_paginated_request_fails_on_error(self):
+        client = create_client()
+        page_function = mock.Mock(return_value=page_response([], 'ad', status_code=403))
+
+        with self.assertRaises(SnapchatClientException):
+            list(client._iterPaginatedRequest(page_function, ['account'], 'ad'))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -3,12 +3,43 @@ Created on 12. 11. 2018
 
 @author: esner
 '''
+import json
+import tempfile
+from concurrent.futures import Future, ThreadPoolExecutor
+import threading
 import unittest
 import mock
 import os
 from freezegun import freeze_time
 
+from keboola.component import UserException
+
 from component import SnapchatComponent
+from snapchat.client import SnapchatClientException
+
+
+def create_data_dir(parameters, state=None, action=None):
+    data_dir = tempfile.mkdtemp()
+    os.makedirs(os.path.join(data_dir, 'in'))
+    os.makedirs(os.path.join(data_dir, 'out', 'tables'))
+    os.makedirs(os.path.join(data_dir, 'out', 'files'))
+
+    config = {
+        'parameters': parameters,
+        'authorization': {'oauth_api': {'credentials': {
+            'appKey': 'key', '#appSecret': 'secret', '#data': json.dumps({'refresh_token': 'token'})}}}
+    }
+
+    if action is not None:
+        config['action'] = action
+
+    with open(os.path.join(data_dir, 'config.json'), 'w') as config_file:
+        json.dump(config, config_file)
+
+    with open(os.path.join(data_dir, 'in', 'state.json'), 'w') as state_file:
+        json.dump(state or {}, state_file)
+
+    return data_dir
 
 
 class TestComponent(unittest.TestCase):
@@ -22,6 +53,454 @@ class TestComponent(unittest.TestCase):
             comp = SnapchatComponent()
             comp.run()
 
+    @freeze_time("2020-03-16")
+    @mock.patch('component.SnapchatClient')
+    def test_incremental_start_date_from_state(self, _):
+        parameters = {'statisticsObjects': ['ads'], 'query': 'impressions',
+                      'dateSettings': {'startDate': '2020-01-01', 'endDate': '2020-03-15',
+                                       'incremental': True, 'lookbackDays': 7}}
+        settings = {'query': ['impressions'], 'granularity': 'DAY', 'windowSwipe': '28_DAY', 'windowView': '1_DAY'}
+        state = {'statistics': {'acc': {'ads': {'end_date': '2020-03-10', 'settings': settings}}}}
+
+        with mock.patch.dict(os.environ, {'KBC_DATADIR': create_data_dir(parameters, state)}):
+            comp = SnapchatComponent()
+
+        self.assertEqual(comp.getDateChunks('acc', 'ads'), [{'start_date': '2020-03-03', 'end_date': '2020-03-15'}])
+        self.assertEqual(comp.getDateChunks('other', 'ads'), comp.paramDateChunks)
+
+        comp.updateStatisticsState('acc', ['ads'])
+        self.assertEqual(comp.stateOut['statistics']['acc']['ads']['end_date'], '2020-03-15')
+
+    @freeze_time("2020-03-16")
+    @mock.patch('component.SnapchatClient')
+    def test_incremental_state_ignored_on_changed_settings(self, _):
+        parameters = {'statisticsObjects': ['ads'], 'query': 'impressions, spend',
+                      'dateSettings': {'startDate': '2020-03-01', 'endDate': '2020-03-15', 'incremental': True}}
+        settings = {'query': ['impressions'], 'granularity': 'DAY', 'windowSwipe': '28_DAY', 'windowView': '1_DAY'}
+        state = {'statistics': {'acc': {'ads': {'end_date': '2020-03-14', 'settings': settings}}}}
+
+        with mock.patch.dict(os.environ, {'KBC_DATADIR': create_data_dir(parameters, state)}):
+            comp = SnapchatComponent()
+
+        self.assertEqual(comp.getDateChunks('acc', 'ads'), [{'start_date': '2020-03-01', 'end_date': '2020-03-15'}])
+
+    @freeze_time("2020-03-16")
+    @mock.patch('component.SnapchatClient')
+    def test_incremental_state_end_date_kept_per_object_type(self, _):
+        parameters = {'statisticsObjects': ['ads', 'campaigns'], 'query': 'impressions',
+                      'dateSettings': {'startDate': '2020-03-01', 'endDate': '2020-03-15', 'incremental': True}}
+        settings = {'query': ['impressions'], 'granularity': 'DAY', 'windowSwipe': '28_DAY', 'windowView': '1_DAY'}
+        state = {'statistics': {'acc': {'ads': {'end_date': '2020-04-01', 'settings': settings}}}}
+
+        with mock.patch.dict(os.environ, {'KBC_DATADIR': create_data_dir(parameters, state)}):
+            comp = SnapchatComponent()
+
+        comp.updateStatisticsState('acc', ['ads', 'campaigns'])
+
+        self.assertEqual(comp.stateOut['statistics']['acc']['ads']['end_date'], '2020-04-01')
+        self.assertEqual(comp.stateOut['statistics']['acc']['campaigns']['end_date'], '2020-03-15')
+
+    @mock.patch('component.SnapchatClient')
+    def test_default_lookback_uses_longer_attribution_window(self, _):
+        parameters = {'dateSettings': {'incremental': True},
+                      'attributionSettings': {'windowSwipe': '7_DAY', 'windowView': '28_DAY'}}
+
+        with mock.patch.dict(os.environ, {'KBC_DATADIR': create_data_dir(parameters)}):
+            comp = SnapchatComponent()
+
+        self.assertEqual(comp.paramLookbackDays, 28)
+
+    @mock.patch('component.SnapchatClient')
+    def test_date_range_narrowed_to_active_period(self, _):
+        parameters = {'statisticsObjects': ['ads'], 'skipInactiveObjects': True,
+                      'dateSettings': {'startDate': '2020-01-01', 'endDate': '2020-03-15'},
+                      'attributionSettings': {'windowSwipe': '1_DAY', 'windowView': '1_HOUR'}}
+
+        with mock.patch.dict(os.environ, {'KBC_DATADIR': create_data_dir(parameters)}):
+            comp = SnapchatComponent()
+
+        self.assertEqual(len(comp.paramDateChunks), 3)
+
+        activityIndex = comp.createActivityIndex()
+        activityIndex.add([{'id': 'ad', 'start_time': '2020-01-10T10:00:00.000Z', 'end_time': '2020-01-20T00:00:00Z'},
+                           {'id': 'ended', 'end_time': '2019-10-01T00:00:00.000Z'}])
+
+        self.assertEqual(comp.getRequestDateChunks('UTC', comp.paramDateChunks, activityIndex, ['ad']),
+                         [{'start_date': '2020-01-10T00:00:00+00:00', 'end_date': '2020-01-21T00:00:00+00:00'}])
+        self.assertEqual(comp.getRequestDateChunks('Europe/Prague', comp.paramDateChunks, activityIndex, ['ad']),
+                         [{'start_date': '2020-01-10T00:00:00+01:00', 'end_date': '2020-01-22T00:00:00+01:00'}])
+        self.assertEqual(comp.getRequestDateChunks('UTC', comp.paramDateChunks, activityIndex, ['ended']), [])
+        self.assertEqual(len(comp.getRequestDateChunks('UTC', comp.paramDateChunks, activityIndex, ['unknown'])), 3)
+
+    @freeze_time("2020-03-16")
+    @mock.patch('component.SnapchatClient')
+    def test_only_changed_entities_written(self, _):
+        parameters = {'statisticsObjects': ['ads'], 'changedEntitiesOnly': True}
+        state = {'entities': {'acc': {'ads': {'a1': {'updated_at': '2020-01-01'}, 'a2': {'updated_at': '2020-01-01'}}}}}
+
+        with mock.patch.dict(os.environ, {'KBC_DATADIR': create_data_dir(parameters, state)}):
+            comp = SnapchatComponent()
+
+        writer = mock.Mock()
+        pages = [[{'id': 'a1', 'updated_at': '2020-01-01', 'ad_squad_id': 's1'},
+                  {'id': 'a2', 'updated_at': '2020-03-01', 'ad_squad_id': 's1'}], [{'id': 'a3'}]]
+
+        statObjects = comp.getAndWriteEntities('acc', iter(pages), writer, 'ads')
+
+        self.assertEqual(statObjects, [('a1', 'ads'), ('a2', 'ads'), ('a3', 'ads')])
+        self.assertEqual(writer.writerow.call_args_list, [mock.call([pages[0][1]]), mock.call(pages[1])])
+        self.assertEqual(comp.stateOut['entities']['acc']['ads'],
+                         {'a1': {'updated_at': '2020-01-01', 'ad_squad_id': 's1'},
+                          'a2': {'updated_at': '2020-03-01', 'ad_squad_id': 's1'}, 'a3': {}})
+        self.assertEqual(comp.stateOut['entities']['acc']['listed_at'], '2020-03-16T00:00:00+00:00')
+
+    @freeze_time("2020-03-16 06:00:00")
+    @mock.patch('component.SnapchatClient')
+    def test_statistics_objects_from_fresh_entity_cache(self, _):
+        parameters = {'statisticsObjects': ['campaigns', 'ads'], 'entityCacheHours': 12, 'skipInactiveObjects': True}
+        state = {'entities': {
+            'acc': {'listed_at': '2020-03-16T00:00:00+00:00', 'creatives': {}, 'adsquads': {'s1': {}},
+                    'campaigns': {'c1': {'end_time': '2020-01-01T00:00:00.000Z'}},
+                    'ads': {'a1': {'ad_squad_id': 's1'}}},
+            'old': {'listed_at': '2020-03-15T00:00:00+00:00', 'creatives': {}, 'adsquads': {}, 'campaigns': {},
+                    'ads': {}}}}
+
+        with mock.patch.dict(os.environ, {'KBC_DATADIR': create_data_dir(parameters, state)}):
+            comp = SnapchatComponent()
+
+        self.assertTrue(comp.isEntityCacheFresh('acc'))
+        self.assertFalse(comp.isEntityCacheFresh('old'))
+
+        activityIndex = comp.createActivityIndex()
+        self.assertEqual(comp.getCachedStatObjects('acc', activityIndex), [('c1', 'campaigns'), ('a1', 'ads')])
+        self.assertIsNotNone(activityIndex.getActivePeriod('c1')[1])
+
+    @mock.patch('component.SnapchatClient')
+    def test_checkpoint_skips_finished_chunks(self, _):
+        parameters = {'statisticsObjects': ['ads'], 'checkpoint': True,
+                      'dateSettings': {'startDate': '2020-01-01', 'endDate': '2020-03-01'}}
+
+        with mock.patch.dict(os.environ, {'KBC_DATADIR': create_data_dir(parameters)}):
+            comp = SnapchatComponent()
+
+        finished = comp.getCheckpointKey(comp.normalizeTime('UTC')[0])
+        comp.stateIn = {'checkpoint': {'settings': comp.varCheckpointSettings,
+                                       'accounts': {'acc': {'chunks': {'ads': [finished]}}}}}
+        comp.writerStatistics = mock.Mock()
+
+        def submit(*args):
+            future = Future()
+            future.set_result([])
+            return future
+
+        executor = mock.Mock(submitStatistics=mock.Mock(side_effect=submit))
+        comp.getAndWriteStatistics('acc', 'UTC', [('a1', 'ads'), ('a2', 'ads')], executor)
+
+        self.assertEqual(executor.submitStatistics.call_count, 2)
+        self.assertEqual(set([c.args[1] for c in executor.submitStatistics.call_args_list]), {'a1', 'a2'})
+        self.assertEqual(comp.stateOut['checkpoint']['accounts']['acc']['chunks']['ads'],
+                         [comp.getCheckpointKey(comp.normalizeTime('UTC')[1])])
+
+    @mock.patch('component.SnapchatClient')
+    def test_failed_ad_account_saves_checkpoint(self, _):
+        with mock.patch.dict(os.environ, {'KBC_DATADIR': create_data_dir({'checkpoint': True})}):
+            comp = SnapchatComponent()
+
+        comp.varAdAccs = {'ok': {'timezone': 'UTC'}, 'failed': {'timezone': 'UTC'}}
+
+        def download(adAccId, *_):
+            if adAccId == 'failed':
+                raise SnapchatClientException('Forbidden')
+            comp.updateCheckpoint(adAccId)
+
+        with mock.patch.object(comp, 'downloadAdAccount', side_effect=download):
+            comp.downloadAdAccounts()
+
+        self.assertEqual(comp.stateOut['checkpoint']['accounts'], {'ok': {'finished': True}})
+
+    @mock.patch('component.SnapchatClient')
+    def test_failed_ad_account_fails_run_after_others(self, _):
+        with mock.patch.dict(os.environ, {'KBC_DATADIR': create_data_dir({})}):
+            comp = SnapchatComponent()
+
+        comp.varAdAccs = {'ok': {'timezone': 'UTC'}, 'failed': {'timezone': 'UTC'}}
+        downloaded = []
+
+        def download(adAccId, *_):
+            if adAccId == 'failed':
+                raise SnapchatClientException('Forbidden')
+            downloaded.append(adAccId)
+
+        with mock.patch.object(comp, 'downloadAdAccount', side_effect=download):
+            with self.assertRaises(UserException):
+                comp.downloadAdAccounts()
+
+        self.assertEqual(downloaded, ['ok'])
+
+    @mock.patch('component.SnapchatClient')
+    def test_unexpected_error_is_not_isolated_to_ad_account(self, _):
+        with mock.patch.dict(os.environ, {'KBC_DATADIR': create_data_dir({})}):
+            comp = SnapchatComponent()
+
+        comp.varAdAccs = {'acc': {'timezone': 'UTC'}}
+
+        with mock.patch.object(comp, 'downloadAdAccount', side_effect=KeyError('id')):
+            with self.assertRaises(KeyError):
+                comp.downloadAdAccounts()
+
+    @mock.patch('component.SnapchatClient')
+    def test_metrics_written_to_files(self, _):
+        data_dir = create_data_dir({'writeMetrics': True})
+
+        with mock.patch.dict(os.environ, {'KBC_DATADIR': data_dir}):
+            comp = SnapchatComponent()
+
+        comp.metrics.recordRequest('GET', 'https://adsapi.snapchat.com/v1/me/organizations', 200, 0.1, 10)
+        comp.reportMetrics()
+
+        with open(os.path.join(data_dir, 'out', 'files', 'snapchat_metrics.json')) as metrics_file:
+            self.assertEqual(json.load(metrics_file)['endpoints']['GET v1/me/organizations']['requests'], 1)
+
+        self.assertTrue(os.path.exists(os.path.join(data_dir, 'out', 'files', 'snapchat_metrics.json.manifest')))
+
+    @freeze_time("2021-03-01")
+    @mock.patch('component.SnapchatClient')
+    def test_closed_statistics_read_from_cache(self, _):
+        parameters = {'statisticsObjects': ['ads'], 'query': 'impressions', 'statisticsCache': True}
+
+        with mock.patch.dict(os.environ, {'KBC_DATADIR': create_data_dir(parameters)}):
+            comp = SnapchatComponent()
+            comp.loadStatisticsCache()
+
+        executor = mock.Mock()
+        executor.submitStatistics.return_value = Future()
+        chunk = {'start_date': '2021-01-01T00:00:00-08:00', 'end_date': '2021-01-03T00:00:00-08:00'}
+        statistics = [{'id': 'ad1', 'timeseries': [
+            {'start_time': '2021-01-01T00:00:00.000-08:00', 'end_time': '2021-01-02T00:00:00.000-08:00'},
+            {'start_time': '2021-01-02T00:00:00.000-08:00', 'end_time': '2021-01-03T00:00:00.000-08:00'}]}]
+
+        future, context = comp.submitStatistics(executor, 'ads', 'ad1', chunk, None, 'impressions')
+        self.assertEqual(comp.getCachedStatistics(statistics, chunk, context), statistics)
+
+        future, context = comp.submitStatistics(executor, 'ads', 'ad1', chunk, None, 'impressions')
+        self.assertEqual(executor.submitStatistics.call_count, 1)
+        self.assertEqual(comp.getCachedStatistics(future.result(), chunk, context), statistics)
+
+    @mock.patch('component.SnapchatClient')
+    def test_metrics_per_object_type_split_into_requests(self, _):
+        parameters = {'statisticsObjects': ['campaigns', 'ads'], 'query': 'impressions, spend',
+                      'objectQuery': {'campaigns': 'impressions\nspend\nswipes', 'ads': ''}, 'fieldsPerRequest': 2}
+
+        with mock.patch.dict(os.environ, {'KBC_DATADIR': create_data_dir(parameters)}):
+            comp = SnapchatComponent()
+
+        self.assertEqual(comp.varMetricFields, ['impressions', 'spend', 'swipes'])
+        self.assertEqual(comp.getFieldGroups('campaigns'), ['impressions,spend', 'swipes'])
+        self.assertEqual(comp.getFieldGroups('ads'), ['impressions,spend'])
+        self.assertEqual(comp.varStatisticsSettings['objectQuery'], {'campaigns': ['impressions', 'spend', 'swipes']})
+
+        def get_statistics(endpoint, endpoint_id, fields, *args):
+            future = Future()
+            future.set_result([{'id': endpoint_id, 'timeseries': [
+                {'start_time': 's', 'end_time': 'e', 'stats': {f: 1 for f in fields.split(',')}}]}])
+            return future
+
+        executor = mock.Mock(submitStatistics=mock.Mock(side_effect=get_statistics))
+        comp.writerStatistics = mock.Mock()
+
+        with mock.patch.object(comp, 'getRequestDateChunks', return_value=[{'start_date': 'a', 'end_date': 'b'}]):
+            comp.getAndWriteStatistics('acc', 'UTC', [('c1', 'campaigns')], executor)
+
+        self.assertEqual(executor.submitStatistics.call_count, 2)
+        comp.writerStatistics.writerow.assert_called_once_with([{'id': 'c1', 'timeseries': [
+            {'start_time': 's', 'end_time': 'e', 'stats': {'impressions': 1, 'spend': 1, 'swipes': 1}}]}])
+
+    @mock.patch('component.SnapchatClient')
+    def test_entity_listings_of_ad_account_run_in_parallel(self, client):
+        with mock.patch.dict(os.environ, {'KBC_DATADIR': create_data_dir({'statisticsObjects': ['campaigns', 'ads']})}):
+            comp = SnapchatComponent()
+
+        # Every listing waits for all the others to start, sequential listings would break the barrier.
+        barrier = threading.Barrier(4, timeout=5)
+
+        def listing(*objects):
+            def iter_pages(_):
+                barrier.wait()
+                yield [{'id': o} for o in objects]
+            return iter_pages
+
+        client.return_value.iterCampaignsForAdAccount.side_effect = listing('c1')
+        client.return_value.iterAdSquadsForAdAccount.side_effect = listing('s1')
+        client.return_value.iterAdsForAdAccount.side_effect = listing('a1', 'a2')
+        client.return_value.iterCreativesForAdAccount.side_effect = listing('cr1')
+
+        with ThreadPoolExecutor(max_workers=4) as listing_executor:
+            stat_objects = comp.getAndWriteAllEntities('acc', listing_executor)
+
+        self.assertEqual(stat_objects, [('c1', 'campaigns'), ('a1', 'ads'), ('a2', 'ads')])
+
+    @mock.patch('component.SnapchatClient')
+    def test_daily_rollup_requests_non_additive_metrics_daily(self, _):
+        parameters = {'statisticsObjects': ['ads'], 'query': 'impressions, uniques, spend',
+                      'attributionSettings': {'granularity': 'HOUR', 'dailyRollup': True}}
+
+        with mock.patch.dict(os.environ, {'KBC_DATADIR': create_data_dir(parameters)}):
+            comp = SnapchatComponent()
+
+        self.assertEqual(comp.getStatisticsParts('ads'), [('HOUR', 'impressions,uniques,spend'), ('DAY', 'uniques')])
+
+        hourly = [{'id': 'ad1', 'granularity': 'HOUR', 'timeseries': [
+            {'start_time': f'2021-01-01T{h:02}:00:00.000Z', 'end_time': '',
+             'stats': {'impressions': 1, 'uniques': 1, 'spend': 2}} for h in range(24)]}]
+        daily = [{'id': 'ad1', 'granularity': 'DAY', 'timeseries': [
+            {'start_time': '2021-01-01T00:00:00.000+00:00', 'end_time': '2021-01-02T00:00:00.000+00:00',
+             'stats': {'uniques': 5}}]}]
+
+        statistics = comp.getWrittenStatistics('ads', 'UTC', [('DAY', daily), ('HOUR', hourly)])
+
+        self.assertEqual(len(statistics), 2)
+        self.assertEqual(statistics[0]['timeseries'], hourly[0]['timeseries'])
+        self.assertEqual(statistics[1]['timeseries'], [
+            {'start_time': '2021-01-01T00:00:00.000+00:00', 'end_time': '2021-01-02T00:00:00.000+00:00',
+             'stats': {'impressions': 24, 'spend': 48, 'uniques': 5}}])
+
+    @mock.patch('component.SnapchatClient')
+    def test_daily_rollup_requires_hourly_granularity(self, _):
+        with mock.patch.dict(os.environ, {'KBC_DATADIR': create_data_dir({'attributionSettings': {'dailyRollup': True}})}):
+            with self.assertRaises(SystemExit):
+                SnapchatComponent()
+
+    @mock.patch('component.SnapchatClient')
+    def test_statistics_requested_for_each_attribution_window(self, _):
+        parameters = {'statisticsObjects': ['ads'],
+                      'attributionSettings': {'windowSwipe': '7_DAY', 'windowView': '1_DAY', 'additionalWindows': [
+                          {'windowSwipe': '28_DAY', 'windowView': '1_HOUR'}, {'windowView': '1_DAY'}]}}
+
+        with mock.patch.dict(os.environ, {'KBC_DATADIR': create_data_dir(parameters)}):
+            comp = SnapchatComponent()
+
+        self.assertEqual(comp.paramAttributionWindows, [('7_DAY', '1_DAY'), ('28_DAY', '1_HOUR')])
+        self.assertEqual(comp.getAttributionWindowDays(), 28)
+
+        def get_statistics(endpoint, endpoint_id, fields, granularity, start, end, swipe, view, breakdown):
+            future = Future()
+            future.set_result([{'id': endpoint_id, 'swipe_up_attribution_window': swipe, 'timeseries': []}])
+            return future
+
+        executor = mock.Mock(submitStatistics=mock.Mock(side_effect=get_statistics))
+        comp.writerStatistics = mock.Mock()
+
+        with mock.patch.object(comp, 'getRequestDateChunks', return_value=[{'start_date': 'a', 'end_date': 'b'}]):
+            comp.getAndWriteStatistics('acc', 'UTC', [('ad1', 'ads')], executor)
+
+        self.assertEqual(sorted([c.args[0][0]['swipe_up_attribution_window']
+                                 for c in comp.writerStatistics.writerow.call_args_list]), ['28_DAY', '7_DAY'])
+
+    @mock.patch('component.SnapchatAsyncClientAdapter')
+    @mock.patch('component.SnapchatClient')
+    def test_sync_action_only_lists_organizations(self, client, async_client):
+        data_dir = create_data_dir({'clientType': 'async', 'statisticsObjects': ['ads']}, action='list_organizations')
+        client.return_value.getOrganizations.return_value = [{'id': 'org1', 'name': 'Organization'}]
+
+        with mock.patch.dict(os.environ, {'KBC_DATADIR': data_dir}):
+            comp = SnapchatComponent()
+
+        with mock.patch('sys.stdout'):
+            result = comp.execute_action()
+
+        self.assertEqual([(r.value, r.label) for r in result], [('org1', 'Organization (org1)')])
+        self.assertEqual(os.listdir(os.path.join(data_dir, 'out', 'tables')), [])
+        self.assertFalse(hasattr(comp, 'paramDateChunks'))
+        async_client.assert_not_called()
+
+    @mock.patch('component.SnapchatClient')
+    def test_larger_ad_accounts_are_downloaded_first(self, client):
+        state = {'account_costs': {'small': 10, 'large': 500}}
+
+        with mock.patch.dict(os.environ, {'KBC_DATADIR': create_data_dir({'accountConcurrency': 1}, state)}):
+            comp = SnapchatComponent()
+
+        client.return_value.createExecutor.return_value = ThreadPoolExecutor(max_workers=1)
+        comp.varAdAccs = {'small': {'timezone': 'UTC'}, 'new': {'timezone': 'UTC'}, 'large': {'timezone': 'UTC'}}
+        downloaded = []
+
+        with mock.patch.object(comp, 'downloadAdAccount', side_effect=lambda adAccId, *_: downloaded.append(adAccId)):
+            comp.downloadAdAccounts()
+
+        self.assertEqual(downloaded, ['new', 'large', 'small'])
+
+    @mock.patch('component.SnapchatClient')
+    def test_request_cost_is_size_of_response(self, _):
+        with mock.patch.dict(os.environ, {'KBC_DATADIR': create_data_dir({'statisticsObjects': ['ads']})}):
+            comp = SnapchatComponent()
+
+        comp.recordAccountCosts('acc', [('a1', 'ads'), ('a2', 'ads'), ('c1', 'campaigns')], 2)
+        args = ('impressions,spend', 'DAY', '2021-01-01T00:00:00-08:00', '2021-01-11T00:00:00-08:00', '28_DAY', '1_DAY')
+
+        self.assertEqual(comp.estimateRequestCost('ads', 'a1', *args), 20)
+        self.assertEqual(comp.estimateRequestCost('adaccounts', 'acc', *args, 'ad'), 40)
+        self.assertEqual(comp.stateOut['account_costs'], {'acc': 2})
+
+
+    @mock.patch('component.SnapchatClient')
+    def test_dry_run_plans_without_statistics_requests(self, _):
+        parameters = {'statisticsObjects': ['ads'], 'dryRun': True,
+                      'dateSettings': {'startDate': '2020-01-01', 'endDate': '2020-03-01'}}
+
+        with mock.patch.dict(os.environ, {'KBC_DATADIR': create_data_dir(parameters)}):
+            comp = SnapchatComponent()
+
+        comp.varAdAccs = {'acc': {'timezone': 'UTC'}}
+        listing = ([('a1', 'ads'), ('a2', 'ads')], None, None)
+
+        with mock.patch.object(comp, 'listAdAccount', return_value=listing), \
+                mock.patch.object(comp, 'downloadStatistics') as download, \
+                mock.patch.object(comp, 'logRequestPlan') as log_plan:
+            comp.downloadAdAccounts()
+
+        download.assert_not_called()
+        self.assertEqual(log_plan.call_args.args[0].getTotal(), 4)
+        self.assertEqual(log_plan.call_args.args[0].getCallsBy(0), {'acc': 4})
+
+    @mock.patch('component.SnapchatClient')
+    def test_request_budget_exceeded_fails_before_statistics(self, _):
+        parameters = {'statisticsObjects': ['ads'], 'requestBudget': 3,
+                      'dateSettings': {'startDate': '2020-01-01', 'endDate': '2020-03-01'}}
+
+        with mock.patch.dict(os.environ, {'KBC_DATADIR': create_data_dir(parameters)}):
+            comp = SnapchatComponent()
+
+        comp.varAdAccs = {'acc': {'timezone': 'UTC'}}
+        listing = ([('a1', 'ads'), ('a2', 'ads')], None, None)
+
+        with mock.patch.object(comp, 'listAdAccount', return_value=listing), \
+                mock.patch.object(comp, 'downloadStatistics') as download:
+            with self.assertRaises(UserException):
+                comp.downloadAdAccounts()
+
+        download.assert_not_called()
+
+    @mock.patch('component.SnapchatClient')
+    def test_request_budget_reduces_date_range(self, _):
+        parameters = {'statisticsObjects': ['ads'], 'requestBudget': 3, 'budgetAction': 'reduce',
+                      'dateSettings': {'startDate': '2020-01-01', 'endDate': '2020-03-01'}}
+
+        with mock.patch.dict(os.environ, {'KBC_DATADIR': create_data_dir(parameters)}):
+            comp = SnapchatComponent()
+
+        comp.varAdAccs = {'acc': {'timezone': 'UTC'}}
+        last_chunk = comp.paramDateChunks[-1]
+        listing = ([('a1', 'ads'), ('a2', 'ads')], None, None)
+
+        with mock.patch.object(comp, 'listAdAccount', return_value=listing), \
+                mock.patch.object(comp, 'downloadStatistics') as download:
+            comp.downloadAdAccounts()
+
+        planned = download.call_args.args[4]
+        self.assertEqual(len(planned), 2)
+        self.assertEqual(set([dr['start_date'][:10] for _, _, _, _, dr, _ in planned]), {last_chunk['start_date']})
+        self.assertEqual(comp.paramDateChunks, [last_chunk])
+
 
 if __name__ == "__main__":
     # import sys;sys.argv = ['', 'Test.testName']
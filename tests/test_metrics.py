@@ -0,0 +1,62 @@
+import json
+import os
+import tempfile
+import unittest
+import mock
+
+from snapchat.metrics import SnapchatMetrics
+
+
+class TestSnapchatMetrics(unittest.TestCase):
+
+    def test_endpoint_template_replaces_identifiers(self):
+        self.assertEqual(SnapchatMetrics.getEndpointTemplate(
+            'https://adsapi.snapchat.com/v1/adaccounts/8f3e-11/campaigns?cursor=abc'), 'v1/adaccounts/{id}/campaigns')
+        self.assertEqual(SnapchatMetrics.getEndpointTemplate('https://adsapi.snapchat.com/v1/ads/1a2b/stats'),
+                         'v1/ads/{id}/stats')
+
+    def test_summary_percentiles_and_counts(self):
+        metrics = SnapchatMetrics()
+
+        for latency in range(1, 21):
+            metrics.recordRequest('get', f'https://adsapi.snapchat.com/v1/ads/{latency}/stats',
+                                  429 if latency == 20 else 200, latency / 10, 100)
+
+        metrics.recordRows('GET', 'https://adsapi.snapchat.com/v1/ads/1/stats', 5)
+        summary = metrics.getSummary()['endpoints']['GET v1/ads/{id}/stats']
+
+        self.assertEqual(summary['requests'], 20)
+        self.assertEqual(summary['rate_limited'], 1)
+        self.assertEqual(summary['status_codes'], {'200': 19, '429': 1})
+        self.assertEqual(summary['latency_p50'], 1.0)
+        self.assertEqual(summary['latency_p95'], 1.9)
+        self.assertEqual(summary['bytes'], 2000)
+        self.assertEqual(summary['rows'], 5)
+
+    @mock.patch('snapchat.metrics.time')
+    def test_timer_sums_phase_durations(self, time):
+        time.perf_counter.side_effect = [1.0, 3.0, 10.0, 10.5]
+        metrics = SnapchatMetrics()
+
+        with metrics.timer('entities'):
+            pass
+
+        with self.assertRaises(ValueError):
+            with metrics.timer('entities'):
+                raise ValueError()
+
+        self.assertEqual(metrics.getSummary()['phases'], {'entities': {'count': 2, 'seconds': 2.5}})
+
+    def test_write_summary(self):
+        metrics = SnapchatMetrics()
+        metrics.recordRequest('GET', 'https://adsapi.snapchat.com/v1/me/organizations', 200, 0.1, 10)
+        path = os.path.join(tempfile.mkdtemp(), 'metrics.json')
+
+        metrics.writeSummary(path)
+
+        with open(path) as summary_file:
+            self.assertIn('GET v1/me/organizations', json.load(summary_file)['endpoints'])
+
+
+if __name__ == "__main__":
+    unittest.main()
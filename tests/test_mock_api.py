@@ -0,0 +1,45 @@
+import os
+import sys
+import unittest
+import mock
+
+from snapchat.client import SnapchatClient, SnapchatClientException
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts', 'benchmark'))
+
+from mock_api import MockSnapchatApi  # noqa: E402
+
+
+class TestClientWithMockApi(unittest.TestCase):
+
+    def setUp(self):
+        self.api = MockSnapchatApi(accounts=1, campaigns=5, pageSize=2)
+        url = self.api.start()
+        self.addCleanup(self.api.stop)
+
+        with mock.patch('snapchat.client.BASE_URL', f'{url}/v1/'), \
+                mock.patch('snapchat.client.REFRESH_URL', f'{url}/login/oauth2/access_token'):
+            self.client = SnapchatClient('token', 'id', 'secret')
+
+    def test_listing_follows_pagination(self):
+        pages = list(self.client.iterCampaignsForAdAccount('acc0'))
+
+        self.assertEqual([len(p) for p in pages], [2, 2, 1])
+        self.assertEqual(self.api.requestCount, 4)
+
+    def test_statistics_timeseries(self):
+        statistics = self.client.getStatistics('campaigns', 'acc0-c0', 'impressions,spend', 'DAY',
+                                               '2021-01-01T00:00:00-08:00', '2021-01-04T00:00:00-08:00', '28_DAY',
+                                               '1_DAY')
+
+        self.assertEqual(len(statistics[0]['timeseries']), 3)
+        self.assertEqual(set(statistics[0]['timeseries'][0]['stats']), {'impressions', 'spend'})
+
+    def test_statistics_range_limit(self):
+        with self.assertRaises(SnapchatClientException):
+            self.client.getStatistics('campaigns', 'acc0-c0', 'impressions', 'HOUR', '2021-01-01T00:00:00-08:00',
+                                      '2021-01-09T00:00:00-08:00', '28_DAY', '1_DAY')
+
+
+if __name__ == "__main__":
+    unittest.main()
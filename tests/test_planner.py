@@ -0,0 +1,38 @@
+import unittest
+
+from snapchat.planner import SnapchatRequestPlan
+
+
+def endpoint(requests, latency):
+    return {'requests': requests, 'latency_p50': latency}
+
+
+class TestSnapchatRequestPlan(unittest.TestCase):
+
+    def test_calls_counted_per_account(self):
+        plan = SnapchatRequestPlan()
+        plan.add('acc1', 'ads', 'HOUR')
+        plan.add('acc1', 'ads', 'DAY', 2)
+        plan.add('acc2', 'campaigns', 'HOUR')
+
+        self.assertEqual(plan.getTotal(), 4)
+        self.assertEqual(plan.getCallsBy(0), {'acc1': 3, 'acc2': 1})
+        self.assertEqual(plan.getCallsBy(2), {'HOUR': 2, 'DAY': 2})
+
+    def test_median_latency_of_statistics_weighted_by_requests(self):
+        summary = {'endpoints': {'GET v1/ads/{id}/stats': endpoint(3, 0.5),
+                                 'GET v1/adaccounts/{id}/stats': endpoint(1, 1.5),
+                                 'GET v1/adaccounts/{id}/ads': endpoint(2, 0.1),
+                                 'POST oauth2/access_token': endpoint(1, 2.0)}}
+
+        self.assertEqual(SnapchatRequestPlan.getMedianLatency(summary), 0.75)
+        self.assertEqual(SnapchatRequestPlan.getMedianLatency(summary, statistics=False), 0.1)
+        self.assertIsNone(SnapchatRequestPlan.getMedianLatency({'endpoints': {}}))
+
+    def test_estimate_bounded_by_rate_limit(self):
+        self.assertEqual(SnapchatRequestPlan.estimateSeconds(100, 0.5, 10), 5)
+        self.assertEqual(SnapchatRequestPlan.estimateSeconds(100, 0.5, 10, rateLimit=5), 20)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,188 @@
+import threading
+import time
+import unittest
+import mock
+
+from snapchat.ratelimit import SnapchatRateLimiter
+
+
+class RateLimitedApi:
+
+    # Token bucket of the API, which answers requests over the limit with 429.
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = rate / 10
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+        self.accepted = 0
+        self.rejected = 0
+
+    def request(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate / 10, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+            if self.tokens >= 1:
+                self.tokens -= 1
+                self.accepted += 1
+                return 200
+
+            self.rejected += 1
+            return 429
+
+
+class TestSnapchatRateLimiter(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch('snapchat.ratelimit.time')
+        self.time = patcher.start()
+        self.time.monotonic.return_value = 100.0
+        self.time.time.return_value = 1600000000.0
+        self.addCleanup(patcher.stop)
+
+    def test_token_bucket_wait(self):
+        limiter = SnapchatRateLimiter(2)
+
+        self.assertEqual(limiter.reserve(), (0.0, 0))
+        self.assertAlmostEqual(limiter.reserve()[0], 0.5)
+        self.assertAlmostEqual(limiter.reserve()[0], 1.0)
+
+        self.time.monotonic.return_value = 102.0
+        self.assertAlmostEqual(limiter.reserve()[0], 0.0)
+
+    def test_reservation_ahead_is_limited(self):
+        limiter = SnapchatRateLimiter(2)
+
+        for _ in range(3):
+            limiter.reserve()
+
+        wait, reservation = limiter.reserve()
+        self.assertAlmostEqual(wait, 0.5)
+        self.assertIsNone(reservation)
+
+    def test_reservation_void_after_429(self):
+        limiter = SnapchatRateLimiter(2)
+        limiter.reserve()
+        wait, reservation = limiter.reserve()
+
+        limiter.update(429, {})
+        self.time.monotonic.return_value = 100.0 + wait
+        self.assertFalse(limiter._isReservationValid(reservation))
+
+        self.time.monotonic.return_value = 101.0
+        self.assertIsNotNone(limiter.reserve()[1])
+
+    def test_unlimited_without_rate(self):
+        limiter = SnapchatRateLimiter()
+
+        self.assertEqual([limiter.reserve()[0] for _ in range(10)], [0.0] * 10)
+        self.assertIsNone(limiter.varRate)
+
+    def test_rate_halved_once_per_interval_on_429(self):
+        limiter = SnapchatRateLimiter(10)
+
+        limiter.update(429, {})
+        limiter.update(429, {})
+        self.assertEqual(limiter.varRate, 5.0)
+        self.assertEqual(limiter.varRateLimitedCount, 2)
+
+        self.time.monotonic.return_value = 101.5
+        limiter.update(429, {})
+        self.assertEqual(limiter.varRate, 2.5)
+
+    def test_rate_halved_again_on_429_of_request_sent_after_decrease(self):
+        limiter = SnapchatRateLimiter(10)
+        in_flight = limiter.reserve()[1]
+
+        limiter.update(429, {}, in_flight)
+        limiter.update(429, {}, in_flight)
+        self.assertEqual(limiter.varRate, 5.0)
+
+        self.time.monotonic.return_value = 100.5
+        limiter.update(429, {}, limiter.reserve()[1])
+        self.assertEqual(limiter.varRate, 2.5)
+
+    def test_unlimited_rate_starts_from_accepted_rate_on_429(self):
+        limiter = SnapchatRateLimiter()
+        limiter.reserve()
+
+        for _ in range(8):
+            limiter.update(200, {})
+
+        self.time.monotonic.return_value = 100.5
+        limiter.update(429, {})
+        self.assertEqual(limiter.varRate, 8.0)
+
+    def test_retry_after_blocks_requests(self):
+        limiter = SnapchatRateLimiter(100)
+
+        limiter.update(429, {'Retry-After': '3'})
+        self.assertEqual(limiter.reserve(), (3.0, None))
+
+        self.time.monotonic.return_value = 103.0
+        self.assertAlmostEqual(limiter.reserve()[0], 0.0)
+
+    def test_rate_from_headers_with_reset_in_seconds(self):
+        limiter = SnapchatRateLimiter()
+
+        limiter.update(200, {'X-RateLimit-Remaining': '30', 'X-RateLimit-Reset': '10'})
+        self.assertEqual(limiter.varRate, 3.0)
+
+    def test_rate_from_headers_with_reset_as_epoch(self):
+        limiter = SnapchatRateLimiter(100)
+
+        limiter.update(200, {'X-RateLimit-Remaining': '40', 'X-RateLimit-Reset': '1600000020'})
+        self.assertEqual(limiter.varRate, 2.0)
+
+    def test_rate_increases_up_to_limit(self):
+        limiter = SnapchatRateLimiter(1)
+        limiter.varRate = 0.95
+
+        limiter.update(200, {})
+        self.assertEqual(limiter.varRate, 1.0)
+
+    def test_rate_increases_once_per_interval(self):
+        limiter = SnapchatRateLimiter(10)
+        limiter.varRate = 5.0
+
+        limiter.update(200, {})
+        limiter.update(200, {})
+        self.assertEqual(limiter.varRate, 5.5)
+
+        self.time.monotonic.return_value = 101.0
+        limiter.update(200, {})
+        self.assertEqual(limiter.varRate, 6.05)
+
+
+class TestSnapchatRateLimiterConcurrency(unittest.TestCase):
+
+    def test_concurrent_callers_keep_rate_limited_responses_bounded(self):
+        # The configured rate is far above the limit of the API, many callers wait for a token at once.
+        api = RateLimitedApi(200)
+        limiter = SnapchatRateLimiter(1000)
+
+        def call():
+            for _ in range(4):
+                while True:
+                    reservation = limiter.acquire()
+                    status = api.request()
+                    limiter.update(status, {}, reservation)
+
+                    if status != 429:
+                        break
+
+        threads = [threading.Thread(target=call) for _ in range(50)]
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(api.accepted, 200)
+        self.assertLessEqual(api.rejected, 20)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,156 @@
+import csv
+import gzip
+import io
+import json
+import os
+import tempfile
+import unittest
+import pyarrow.parquet
+
+from snapchat.result import SnapchatStatisticsWriter, SnapchatWriter
+
+
+def create_data_dir():
+    data_dir = tempfile.mkdtemp()
+    os.makedirs(os.path.join(data_dir, 'out', 'tables'))
+    return data_dir
+
+
+def dict_writer_output(fields, rows):
+    output = io.StringIO()
+    writer = csv.DictWriter(output, fieldnames=fields, restval='', extrasaction='ignore', quotechar='\"',
+                            quoting=csv.QUOTE_ALL)
+    writer.writeheader()
+    writer.writerows(rows)
+    return output.getvalue()
+
+
+class TestSnapchatWriter(unittest.TestCase):
+
+    def test_output_equals_dict_writer(self):
+        writer = SnapchatWriter(create_data_dir(), 'campaigns')
+        rows = [{'id': '1', 'name': 'Quoted "name", with comma', 'status': None, 'regulations': {'a': [1, 'ř']},
+                 'measurement_spec': None, 'unknown': 'x'},
+                {'id': '2', 'daily_budget_micro': 1000, 'start_time': '2020-01-01T00:00:00.000Z'}]
+
+        writer.writerow(rows)
+        writer.close()
+
+        expected = [{k: '{"a": [1, "\\u0159"]}' if k == 'regulations' else 'null' if k == 'measurement_spec' else v
+                     for k, v in r.items()} for r in rows]
+
+        with open(writer.paramTablePath, newline='') as output:
+            self.assertEqual(output.read(), dict_writer_output(writer.paramFields, expected))
+
+    def test_sliced_output_rotates_gzipped_slices(self):
+        writer = SnapchatWriter(create_data_dir(), 'ads', sliceRows=2)
+        rows = [{'id': str(i), 'name': f'ad {i}'} for i in range(5)]
+
+        writer.writerow(rows[:1])
+        writer.writerow(rows[1:])
+        writer.close()
+
+        slices = sorted(os.listdir(writer.paramTablePath))
+        self.assertEqual(slices, ['part-1.csv.gz', 'part-2.csv.gz', 'part-3.csv.gz'])
+
+        output = ''
+        for name in slices:
+            with gzip.open(os.path.join(writer.paramTablePath, name), 'rt', newline='') as part:
+                output += part.read()
+
+        self.assertEqual(output, dict_writer_output(writer.paramFields, rows).split('\r\n', 1)[1])
+
+        with open(writer.paramTablePath + '.manifest') as manifest:
+            self.assertEqual(json.load(manifest)['columns'], writer.paramFields)
+
+    def test_parquet_output_as_strings(self):
+        data_dir = create_data_dir()
+        os.makedirs(os.path.join(data_dir, 'out', 'files'))
+        writer = SnapchatWriter(data_dir, 'campaigns', outputFormat='parquet')
+
+        writer.writerow([{'id': '1', 'daily_budget_micro': 1000, 'regulations': {'a': 1}}])
+        writer.close()
+
+        rows = pyarrow.parquet.read_table(writer.paramTablePath).to_pylist()
+
+        self.assertEqual(rows[0]['daily_budget_micro'], '1000')
+        self.assertEqual(rows[0]['regulations'], '{"a": 1}')
+        self.assertIsNone(rows[0]['name'])
+
+
+class TestSnapchatStatisticsWriter(unittest.TestCase):
+
+    def test_output_equals_dict_writer(self):
+        writer = SnapchatStatisticsWriter(create_data_dir(), metricFields=['impressions', 'spend'])
+        statistics = [{'id': 'ad', 'type': 'AD', 'granularity': 'DAY', 'swipe_up_attribution_window': '28_DAY',
+                       'view_attribution_window': '1_DAY', 'start_time': 'x', 'timeseries': [
+                           {'start_time': 's1', 'end_time': 'e1', 'stats': {'impressions': 10, 'spend': 0}},
+                           {'start_time': 's2', 'end_time': 'e2', 'stats': {'impressions': None, 'other': 1}}]}]
+
+        writer.writerow(statistics)
+        writer.close()
+
+        expected = [{'id': 'ad', 'type': 'AD', 'granularity': 'DAY', 'swipe_up_attribution_window': '28_DAY',
+                     'view_attribution_window': '1_DAY', 'start_time': 's1', 'end_time': 'e1', 'impressions': 10,
+                     'spend': 0},
+                    {'id': 'ad', 'type': 'AD', 'granularity': 'DAY', 'swipe_up_attribution_window': '28_DAY',
+                     'view_attribution_window': '1_DAY', 'start_time': 's2', 'end_time': 'e2', 'impressions': None}]
+
+        with open(writer.paramTablePath, newline='') as output:
+            self.assertEqual(output.read(), dict_writer_output(writer.paramFields, expected))
+
+    def test_parquet_output_with_numeric_metrics(self):
+        data_dir = create_data_dir()
+        os.makedirs(os.path.join(data_dir, 'out', 'files'))
+        writer = SnapchatStatisticsWriter(data_dir, metricFields=['impressions'], outputFormat='parquet')
+        statistics = [{'id': 'ad', 'type': 'AD', 'granularity': 'DAY', 'swipe_up_attribution_window': '28_DAY',
+                       'view_attribution_window': '1_DAY', 'timeseries': [
+                           {'start_time': 's1', 'end_time': 'e1', 'stats': {'impressions': 10}},
+                           {'start_time': 's2', 'end_time': 'e2', 'stats': {}}]}]
+
+        writer.writerow(statistics)
+        writer.close()
+
+        table = pyarrow.parquet.read_table(os.path.join(data_dir, 'out', 'files', 'statistics.parquet'))
+
+        self.assertEqual(table.schema.field('impressions').type, pyarrow.float64())
+        self.assertEqual(table.column('impressions').to_pylist(), [10.0, None])
+        self.assertEqual(table.column('start_time').to_pylist(), ['s1', 's2'])
+        self.assertTrue(os.path.exists(os.path.join(data_dir, 'out', 'files', 'statistics.parquet.manifest')))
+
+    def test_merge_statistics_parts_by_id_and_start_time(self):
+        def stat(object_id, stats):
+            return {'id': object_id, 'type': 'AD', 'timeseries': [
+                {'start_time': f's{i}', 'end_time': f'e{i}', 'stats': s} for i, s in enumerate(stats)]}
+
+        merged = SnapchatStatisticsWriter.mergeStatistics([
+            [stat('ad1', [{'impressions': 1}, {'impressions': 2}]), stat('ad2', [{'impressions': 3}])],
+            [stat('ad2', [{'spend': 30}]), stat('ad1', [{'spend': 10}, {'spend': 20}])]])
+
+        self.assertEqual([s['id'] for s in merged], ['ad1', 'ad2'])
+        self.assertEqual([t['stats'] for t in merged[0]['timeseries']],
+                         [{'impressions': 1, 'spend': 10}, {'impressions': 2, 'spend': 20}])
+        self.assertEqual(merged[1]['timeseries'], [{'start_time': 's0', 'end_time': 'e0',
+                                                    'stats': {'impressions': 3, 'spend': 30}}])
+
+    def test_rollup_statistics_sums_hours_in_account_timezone(self):
+        # Hours are returned in UTC, days are split at midnight in Los Angeles, which has 23 hours on 2020-03-08.
+        statistics = [{'id': 'ad', 'type': 'AD', 'granularity': 'HOUR', 'timeseries': [
+            {'start_time': f'2020-03-{d:02}T{h:02}:00:00.000Z', 'end_time': '',
+             'stats': {'impressions': 1, 'spend': 0.5, 'uniques': 1}} for d in range(8, 11) for h in range(24)]}]
+
+        rolled_up = SnapchatStatisticsWriter.rollupStatistics(statistics, 'America/Los_Angeles', ['impressions', 'spend'])
+
+        self.assertEqual(rolled_up[0]['granularity'], 'DAY')
+        self.assertEqual([(t['start_time'], t['end_time'], t['stats']['impressions'])
+                          for t in rolled_up[0]['timeseries']],
+                         [('2020-03-07T00:00:00.000-08:00', '2020-03-08T00:00:00.000-08:00', 8),
+                          ('2020-03-08T00:00:00.000-08:00', '2020-03-09T00:00:00.000-07:00', 23),
+                          ('2020-03-09T00:00:00.000-07:00', '2020-03-10T00:00:00.000-07:00', 24),
+                          ('2020-03-10T00:00:00.000-07:00', '2020-03-11T00:00:00.000-07:00', 17)])
+        self.assertEqual(rolled_up[0]['timeseries'][2]['stats'], {'impressions': 24, 'spend': 12.0})
+        self.assertEqual(statistics[0]['granularity'], 'HOUR')
+
+
+if __name__ == "__main__":
+    unittest.main()
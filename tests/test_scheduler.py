@@ -0,0 +1,64 @@
+import unittest
+from concurrent.futures import Future
+
+from snapchat.scheduler import SnapchatScheduler
+
+
+class ManualExecutor:
+
+    def __init__(self):
+        self.requests = []
+
+    def submitStatistics(self, *args):
+        future = Future()
+        self.requests.append((args, future))
+        return future
+
+
+class TestSnapchatScheduler(unittest.TestCase):
+
+    def test_most_expensive_pending_request_is_sent_first(self):
+        executor = ManualExecutor()
+        scheduler = SnapchatScheduler(executor, 1, costFunction=lambda name, cost: cost)
+
+        futures = [scheduler.submitStatistics(name, cost) for name, cost in
+                   [('first', 1), ('small', 1), ('large', 5), ('other small', 1)]]
+        self.assertEqual([args for args, _ in executor.requests], [('first', 1)])
+
+        while len(executor.requests) < 4:
+            args, request = executor.requests[-1]
+            request.set_result(args[0])
+
+        executor.requests[-1][1].set_result('other small')
+
+        self.assertEqual([args[0] for args, _ in executor.requests], ['first', 'large', 'small', 'other small'])
+        self.assertEqual([f.result() for f in futures], ['first', 'small', 'large', 'other small'])
+
+    def test_cancelled_requests_are_not_sent(self):
+        executor = ManualExecutor()
+        scheduler = SnapchatScheduler(executor, 1)
+
+        running = scheduler.submitStatistics('running')
+        pending = scheduler.submitStatistics('pending')
+        failing = scheduler.submitStatistics('failing')
+
+        self.assertTrue(pending.cancel())
+        executor.requests[0][1].set_result('running')
+        executor.requests[1][1].set_exception(ValueError('failed'))
+
+        self.assertEqual([args for args, _ in executor.requests], [('running',), ('failing',)])
+        self.assertEqual(running.result(), 'running')
+        self.assertIsInstance(failing.exception(), ValueError)
+
+    def test_cancelling_running_request_cancels_it_in_executor(self):
+        executor = ManualExecutor()
+        scheduler = SnapchatScheduler(executor, 2)
+
+        future = scheduler.submitStatistics('running')
+        future.cancel()
+
+        self.assertTrue(executor.requests[0][1].cancelled())
+
+
+if __name__ == "__main__":
+    unittest.main()